@@ -1,6 +1,6 @@
 import os
 from datetime import datetime, timedelta, timezone
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, Request, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
 from passlib.context import CryptContext
@@ -75,6 +75,7 @@ def create_user(db: Session, user: schemas.UserCreate) -> models.User:
 
 
 def get_current_user(
+    request: Request,
     token: str = Depends(oauth2_scheme), 
     db: Session = Depends(database.get_db) 
 ) -> models.User:
@@ -94,4 +95,7 @@ def get_current_user(
     user = db.query(models.User).filter(models.User.username == username).first()
     if user is None:
         raise credentials_exception
+    # 供 database.get_read_db 做读写路由
+    request.state.user_id = user.id
+    request.state.last_write_at = user.last_write_at
     return user
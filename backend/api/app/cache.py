@@ -0,0 +1,53 @@
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Hashable
+
+from sqlalchemy import update
+from sqlalchemy.orm import Session
+
+from . import models, database
+
+# 每个进程缓存的仪表盘结果条数
+DASHBOARD_CACHE_SIZE = int(os.getenv("DASHBOARD_CACHE_SIZE", "2048"))
+
+_MISSING = object()
+
+
+class ResultCache:
+    """进程内的 LRU 结果缓存。键中包含用户的数据版本号，数据变化后旧条目自然不再命中，随后被淘汰"""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._items: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default=None):
+        with self._lock:
+            value = self._items.get(key, _MISSING)
+            if value is _MISSING:
+                return default
+            self._items.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+
+dashboard_cache = ResultCache(DASHBOARD_CACHE_SIZE)
+
+
+def bump_data_version(db: Session, user_id: int) -> None:
+    """
+    用户的使用数据（汇总表）发生变化时调用，与数据修改在同一事务中提交。
+    同时记录写入时间，之后一小段时间内该用户的读请求走主库（见 database.ReadRoutingSession）
+    """
+    db.execute(
+        update(models.User)
+        .where(models.User.id == user_id)
+        .values(data_version=models.User.data_version + 1, last_write_at=database.utcnow())
+    )
@@ -0,0 +1,352 @@
+import re
+import re._constants as sre_constants
+import re._parser as sre_parser
+import threading
+from collections import defaultdict
+from datetime import datetime
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Tuple
+from zoneinfo import ZoneInfo
+
+from sqlalchemy import select, delete, insert, update, func
+from sqlalchemy.orm import Session
+
+from . import models, rollups
+from .logger import logger
+
+# 未匹配任何规则的焦点时间记在这个分类下
+UNCATEGORIZED = ""
+# 重算时每批读取的会话数
+RECATEGORIZE_CHUNK_SIZE = 500
+# 每个匹配器缓存的 (可执行文件名, 标题) -> 分类 结果数，窗口标题重复度很高
+MATCH_CACHE_SIZE = 4096
+
+# 标题正则的长度上限，以及一条规则中可变次数量词（*、+、{m,n}）的个数上限。
+# 匹配在同步请求中同步执行，量词嵌套或过多时回溯可能是指数或高次多项式级别的，会卡住整个请求
+MAX_TITLE_PATTERN_LENGTH = 200
+MAX_PATTERN_QUANTIFIERS = 3
+_REPEAT_OPS = (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT, sre_constants.POSSESSIVE_REPEAT)
+# 规则中不能使用的正则写法：合并成一个大正则后，命名组和反向引用的编号会错乱
+_FORBIDDEN_PATTERN_RE = re.compile(r"\(\?P[<=]|\\[1-9]|\\g<")
+# 开头的全局内联标志，如 (?i)；合并后不在整个正则的开头，Python 会报错，改写成只作用于本规则的 (?i:...)
+_LEADING_FLAGS_RE = re.compile(r"\(\?([aiLmsux]+)\)")
+# 合并匹配器使用的标志
+_MATCHER_FLAGS = re.IGNORECASE | re.DOTALL
+
+
+def _title_condition(pattern: str) -> str:
+    """
+    把用户的标题正则改写成合并匹配器中的一个前瞻条件。
+    匹配对象是 "可执行文件名\\0窗口标题"，规则里的 ^ 和 \\A 本意是标题开头，改写为紧跟在 \\0 之后
+    """
+    m = _LEADING_FLAGS_RE.match(pattern)
+    flags = m.group(1) if m else ""
+    body = pattern[m.end():] if m else pattern
+
+    out, i, in_class = [], 0, False
+    while i < len(body):
+        ch = body[i]
+        if ch == "\\":
+            token = body[i:i + 2]
+            out.append("(?<=\\x00)" if token == "\\A" and not in_class else token)
+            i += 2
+            continue
+        if in_class:
+            if ch == "]":
+                in_class = False
+        elif ch == "[":
+            in_class = True
+            # 紧跟在 [ 或 [^ 之后的 ] 是字面字符
+            j = i + 2 if body[i + 1:i + 2] == "^" else i + 1
+            if body[j:j + 1] == "]":
+                out.append(body[i:j + 1])
+                i = j + 1
+                continue
+        elif ch == "^":
+            ch = "(?<=\\x00)"
+        out.append(ch)
+        i += 1
+    body = "".join(out)
+    if flags:
+        body = f"(?{flags}:{body})"
+    return f"(?=[^\\x00]*\\x00.*?(?:{body}))"
+
+
+def _quantifier_complexity(node, inside_repeat: bool = False) -> Tuple[int, bool]:
+    """遍历正则的语法树，返回 (可变次数量词的个数, 是否有可变次数量词出现在另一个重复内部)"""
+    count, nested = 0, False
+    if isinstance(node, sre_parser.SubPattern):
+        children = node.data
+    elif isinstance(node, (list, tuple)):
+        children = node
+    else:
+        return 0, False
+    for child in children:
+        if isinstance(child, tuple) and len(child) == 2 and child[0] in _REPEAT_OPS:
+            low, high, item = child[1]
+            variable = high != low
+            # ? 只有一次可选，单独出现时不计数；但出现在 {30} 这类重复内部时同样会指数回溯
+            if variable and high > 1:
+                count += 1
+            nested = nested or (variable and inside_repeat)
+            sub_count, sub_nested = _quantifier_complexity(item, inside_repeat or high > 1)
+        else:
+            sub_count, sub_nested = _quantifier_complexity(child, inside_repeat)
+        count += sub_count
+        nested = nested or sub_nested
+    return count, nested
+
+
+def validate_title_pattern(pattern: str) -> Optional[str]:
+    """检查标题正则能否用于合并匹配器、且不会引起灾难性回溯，返回错误原因；可用时返回 None"""
+    if len(pattern) > MAX_TITLE_PATTERN_LENGTH:
+        return f"正则表达式不能超过 {MAX_TITLE_PATTERN_LENGTH} 个字符"
+    if _FORBIDDEN_PATTERN_RE.search(pattern):
+        return "正则表达式中不能使用命名组或反向引用"
+    try:
+        parsed = sre_parser.parse(pattern)
+        # 按合并匹配器中的实际写法再编译一次，例如不在开头的全局标志只有放进分支后才会出错
+        re.compile(_title_condition(pattern) + "(?P<r0>)", _MATCHER_FLAGS)
+    except re.error as e:
+        return f"正则表达式无效: {e}"
+    count, nested = _quantifier_complexity(parsed)
+    if nested:
+        return "正则表达式中不能嵌套使用 *、+、{m,n} 等量词，如 (a+)+"
+    if count > MAX_PATTERN_QUANTIFIERS:
+        return f"正则表达式中的 *、+、{{m,n}} 等量词不能超过 {MAX_PATTERN_QUANTIFIERS} 个"
+    return None
+
+
+class CategoryMatcher:
+    """
+    把一个用户的全部规则编译成一个正则，每次匹配只调用一次 re.match。
+    匹配对象是 "可执行文件名\\0窗口标题"，每条规则对应一个锚定在开头、由前瞻断言组成的分支，
+    分支按优先级排列，第一个满足的分支即命中的规则（lastgroup 给出其编号）。
+    """
+
+    def __init__(self, rules: Iterable[models.ServerCategoryRule]):
+        self.categories: List[str] = []
+        branches = []
+        for rule in rules:
+            conditions = []
+            if rule.executable_name:
+                conditions.append(f"(?={re.escape(rule.executable_name.lower())}\\x00)")
+            if rule.title_pattern:
+                conditions.append(_title_condition(rule.title_pattern))
+            if not conditions:
+                continue
+            branch = "".join(conditions) + f"(?P<r{len(self.categories)}>)"
+            # 旧版本保存的规则未经现在的校验，重新检查一次，跳过无效或可能回溯失控的规则而不是让整个匹配器失败
+            reason = validate_title_pattern(rule.title_pattern) if rule.title_pattern else None
+            if reason is None:
+                try:
+                    re.compile(branch, _MATCHER_FLAGS)
+                except re.error as e:
+                    reason = str(e)
+            if reason:
+                logger.warning(f"跳过无效的分类规则 (id={rule.id}, pattern={rule.title_pattern!r}): {reason}")
+                continue
+            branches.append(branch)
+            self.categories.append(rule.category)
+
+        self._regex = re.compile("|".join(branches), _MATCHER_FLAGS) if branches else None
+        self.categorize = lru_cache(maxsize=MATCH_CACHE_SIZE)(self._categorize)
+
+    def _categorize(self, executable_name: str, window_title: Optional[str]) -> str:
+        if self._regex is None:
+            return UNCATEGORIZED
+        subject = f"{(executable_name or '').lower()}\x00{(window_title or '').replace(chr(0), '')}"
+        m = self._regex.match(subject)
+        if m is None or m.lastgroup is None:
+            return UNCATEGORIZED
+        return self.categories[int(m.lastgroup[1:])]
+
+
+# 进程内缓存：user_id -> (规则版本, 匹配器)。版本号存在数据库中，其他 worker 修改规则后这里也会失效
+_matcher_cache: Dict[int, Tuple[int, CategoryMatcher]] = {}
+_matcher_lock = threading.Lock()
+
+
+def load_rules(db: Session, user_id: int) -> List[models.ServerCategoryRule]:
+    return db.query(models.ServerCategoryRule)\
+        .filter(models.ServerCategoryRule.user_id == user_id)\
+        .order_by(models.ServerCategoryRule.priority, models.ServerCategoryRule.id)\
+        .all()
+
+
+def get_matcher(db: Session, user: models.User) -> CategoryMatcher:
+    version = user.category_rules_version or 0
+    with _matcher_lock:
+        cached = _matcher_cache.get(user.id)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+    try:
+        matcher = CategoryMatcher(load_rules(db, user.id))
+    except re.error as e:
+        # 不应发生（每条规则已单独检查过），兜底：宁可暂不分类也不能让同步和导入失败
+        logger.error(f"用户 {user.id} 的分类规则无法编译，暂不分类: {e}")
+        matcher = CategoryMatcher([])
+    with _matcher_lock:
+        _matcher_cache[user.id] = (version, matcher)
+    return matcher
+
+
+def bump_rules_version(db: Session, user: models.User) -> None:
+    """规则变化后调用（与规则修改在同一事务中）；用 UPDATE ... +1 避免并发修改时丢失版本"""
+    db.execute(
+        update(models.User)
+        .where(models.User.id == user.id)
+        .values(category_rules_version=models.User.category_rules_version + 1)
+    )
+    db.flush()
+    db.refresh(user, ["category_rules_version"])
+
+
+def category_seconds(matcher: CategoryMatcher, executable_name: str, activities) -> Dict[str, int]:
+    """按分类累加一个会话内的焦点时长，activities 为 (窗口标题, 秒数) 序列"""
+    totals = defaultdict(int)
+    for title, seconds in activities:
+        totals[matcher.categorize(executable_name, title)] += int(seconds or 0)
+    return totals
+
+
+def daily_category_rows(
+    user_id: int,
+    application_id: int,
+    start_utc: datetime,
+    end_utc: datetime,
+    per_category: Dict[str, int],
+    tz: ZoneInfo,
+) -> List[dict]:
+    """与日汇总表一样，跨越本地午夜的会话按各天占用的时长比例分摊"""
+    pieces = rollups.split_by_local_day(start_utc, end_utc, tz)
+    weights = [seconds for _, seconds in pieces]
+    rows = []
+    for category, total in per_category.items():
+        for (day, _), share in zip(pieces, rollups.allocate(total, weights)):
+            rows.append({
+                "user_id": user_id,
+                "application_id": application_id,
+                "category": category,
+                "local_date": day,
+                "focus_seconds": share,
+            })
+    return rows
+
+
+def upsert_category_daily(db: Session, rows: List[dict]) -> None:
+    rollups.upsert_increment(
+        db,
+        models.ServerCategoryDailyUsage,
+        rollups.merge_rows(rows, ["application_id", "category", "local_date"], ["focus_seconds"]),
+        key_columns=["application_id", "category", "local_date"],
+        increment_columns=["focus_seconds"],
+    )
+
+
+def apply_category_rollups(db: Session, user_id: int, application_id: int, start_utc: datetime,
+                           end_utc: datetime, per_category: Dict[str, int], tz: ZoneInfo) -> None:
+    upsert_category_daily(db, daily_category_rows(user_id, application_id, start_utc, end_utc, per_category, tz))
+
+
+def _aggregate_sessions(db: Session, matcher: CategoryMatcher, app: models.ServerWatchedApplication,
+                        summary_id: int, tz: ZoneInfo, after_id: int, into: dict) -> int:
+    """
+    按批读取 id 大于 after_id 的会话及其焦点活动，按 (分类, 日期) 累加到 into 中，
+    返回读到的最大会话 id。
+    """
+    Session_ = models.ServerProcessSession
+    Activity = models.ServerFocusActivity
+    last_id = after_id
+    while True:
+        sessions = db.execute(
+            select(Session_.id, Session_.session_start_time, Session_.session_end_time)
+            .where(Session_.summary_id == summary_id)
+            .where(Session_.id > last_id)
+            .order_by(Session_.id)
+            .limit(RECATEGORIZE_CHUNK_SIZE)
+        ).all()
+        if not sessions:
+            return last_id
+
+        activities = defaultdict(list)
+        for session_id, title, seconds in db.execute(
+            select(Activity.session_id, Activity.window_title, Activity.focus_duration_seconds)
+            .where(Activity.session_id.in_([s.id for s in sessions]))
+        ):
+            activities[session_id].append((title, seconds))
+
+        for s in sessions:
+            per_category = category_seconds(matcher, app.executable_name, activities.get(s.id, ()))
+            for row in daily_category_rows(app.user_id, app.id, s.session_start_time, s.session_end_time, per_category, tz):
+                into[(row["category"], row["local_date"])] += row["focus_seconds"]
+        last_id = sessions[-1].id
+
+
+def recategorize_application(db: Session, user: models.User, matcher: CategoryMatcher,
+                             app: models.ServerWatchedApplication) -> None:
+    """
+    用当前规则重算一个应用的分类日汇总。
+    先不加锁地扫描已有会话（可能很多），再在持有 summary 行锁（与同步写入同一把锁）的短事务中
+    补上扫描期间新同步进来的会话，并整体替换该应用的分类汇总行。
+    """
+    summary_id = db.execute(
+        select(models.ServerAppUsageSummary.id)
+        .where(models.ServerAppUsageSummary.application_id == app.id)
+    ).scalar()
+    if summary_id is None:
+        return
+    tz = rollups.get_zone(user.timezone)
+    totals = defaultdict(int)
+    scanned_up_to = _aggregate_sessions(db, matcher, app, summary_id, tz, 0, totals)
+    db.rollback()
+
+    db.execute(
+        select(models.ServerAppUsageSummary.id)
+        .where(models.ServerAppUsageSummary.id == summary_id)
+        .with_for_update()
+    ).all()
+    _aggregate_sessions(db, matcher, app, summary_id, tz, scanned_up_to, totals)
+    Daily = models.ServerCategoryDailyUsage
+    db.execute(delete(Daily).where(Daily.application_id == app.id))
+    rows = [
+        {"user_id": user.id, "application_id": app.id, "category": category,
+         "local_date": day, "focus_seconds": seconds}
+        for (category, day), seconds in totals.items()
+    ]
+    if rows:
+        db.execute(insert(Daily), rows)
+    db.commit()
+
+
+def recategorize_user(user_id: int, affected_executables: Optional[set], rules_version: int):
+    """
+    返回在后台执行的重算任务函数。affected_executables 为 None 时重算全部应用，
+    否则只重算这些可执行文件名对应的应用（修改的规则都限定了可执行文件时）。
+    若执行期间规则再次被修改，本任务停止，由新的任务接着重算。
+    """
+    from . import database
+
+    def run(reporter):
+        db = database.SessionLocal()
+        try:
+            user = db.get(models.User, user_id)
+            App = models.ServerWatchedApplication
+            query = db.query(App).filter(App.user_id == user_id)
+            if affected_executables is not None:
+                query = query.filter(func.lower(App.executable_name).in_(affected_executables))
+            apps = query.order_by(App.id).all()
+            reporter.update(applications_total=len(apps), applications_done=0)
+
+            matcher = get_matcher(db, user)
+            for done, app in enumerate(apps, start=1):
+                db.refresh(user, ["category_rules_version"])
+                if user.category_rules_version != rules_version:
+                    logger.info(f"用户 {user_id} 的分类规则已再次修改，停止旧的重算任务")
+                    reporter.update(superseded=True)
+                    return
+                recategorize_application(db, user, matcher, app)
+                reporter.update(applications_done=done)
+        finally:
+            db.close()
+    return run
@@ -1,7 +1,10 @@
 import os # 用于获取环境变量（数据库连接信息）
+from datetime import datetime, timezone
+from typing import Optional
+from fastapi import Request
 from sqlalchemy import create_engine # 用于创建数据库引擎
 from sqlalchemy.ext.declarative import declarative_base # 用于创建ORM基类
-from sqlalchemy.orm import sessionmaker # 用于创建数据库会话
+from sqlalchemy.orm import sessionmaker, Session # 用于创建数据库会话
 
 # 从环境变量中获取数据库连接信息
 DB_USER = os.getenv("DATABASE_USER")
@@ -10,8 +13,21 @@ DB_HOST = os.getenv("DATABASE_HOSTNAME")
 DB_PORT = os.getenv("DATABASE_PORT")
 DB_NAME = os.getenv("DATABASE_NAME")
 
+# 只读副本的连接信息（可选），未配置时读请求与写请求共用主库
+DB_READ_HOST = os.getenv("DATABASE_READ_HOSTNAME")
+DB_READ_PORT = os.getenv("DATABASE_READ_PORT", DB_PORT)
+DB_READ_USER = os.getenv("DATABASE_READ_USER", DB_USER)
+DB_READ_PASSWORD = os.getenv("DATABASE_READ_PASSWORD", DB_PASSWORD)
+
+# 用户自己同步之后的这段时间内，其读请求仍然走主库，避免因复制延迟看不到刚写入的数据
+READ_YOUR_WRITES_SECONDS = float(os.getenv("READ_YOUR_WRITES_SECONDS", "5"))
+
 # 构建 SQLAlchemy数据库连接URL
 SQLALCHEMY_DATABASE_URL = f"mysql+pymysql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+SQLALCHEMY_READ_DATABASE_URL = (
+    f"mysql+pymysql://{DB_READ_USER}:{DB_READ_PASSWORD}@{DB_READ_HOST}:{DB_READ_PORT}/{DB_NAME}"
+    if DB_READ_HOST else None
+)
 
 # 创建数据库引擎(engine)
 engine = create_engine(
@@ -19,7 +35,45 @@ engine = create_engine(
     pool_pre_ping=True
 )
 
+# 只读引擎：未配置副本时直接复用主库引擎（本地测试即是如此）
+read_engine = create_engine(
+    SQLALCHEMY_READ_DATABASE_URL,
+    pool_pre_ping=True
+) if SQLALCHEMY_READ_DATABASE_URL else engine
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=read_engine)
+
+def utcnow() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def wrote_recently(last_write_at: Optional[datetime]) -> bool:
+    """
+    用户最近一次写入（users.last_write_at，与数据修改在同一事务中更新）是否仍在读自己的写窗口内。
+    写入时间存在主库中，多个 worker 进程看到的是同一个值
+    """
+    if last_write_at is None:
+        return False
+    return (utcnow() - last_write_at).total_seconds() < READ_YOUR_WRITES_SECONDS
+
+
+class ReadRoutingSession(Session):
+    """
+    只读请求使用的会话。绑定在第一次执行语句时才决定：
+    此时 auth.get_current_user 已从主库读出用户，并把其最近写入时间放入 request.state，
+    若该用户刚刚写入过数据则走主库，否则走只读副本。
+    """
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        request = self.info.get("request")
+        last_write_at = getattr(request.state, "last_write_at", None) if request is not None else None
+        if wrote_recently(last_write_at):
+            return engine
+        return read_engine
+
+
+RoutedReadSessionLocal = sessionmaker(class_=ReadRoutingSession, autocommit=False, autoflush=False)
 
 Base = declarative_base()
 
@@ -32,3 +86,11 @@ def get_db():
     finally:
         db.close()
 
+# 只读查询（如仪表盘）使用的依赖项，优先走只读副本
+def get_read_db(request: Request):
+    db = RoutedReadSessionLocal(info={"request": request})
+    try:
+        yield db
+    finally:
+        db.close()
+
@@ -0,0 +1,81 @@
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from . import models
+
+
+def _utc_now() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def get_or_create_device(db: Session, user: models.User, device_uid: str, name: Optional[str] = None) -> models.ServerDevice:
+    """
+    根据客户端上报的设备标识找到设备记录，不存在时创建。
+    同一设备并发的首次同步可能同时插入，唯一约束冲突时回退为重新查询。
+    """
+    device = db.query(models.ServerDevice).filter_by(user_id=user.id, device_uid=device_uid).first()
+    if device is None:
+        try:
+            with db.begin_nested():
+                device = models.ServerDevice(
+                    user_id=user.id,
+                    device_uid=device_uid,
+                    name=name,
+                    created_at=_utc_now(),
+                    last_client_session_id=0,
+                )
+                db.add(device)
+        except IntegrityError:
+            device = db.query(models.ServerDevice).filter_by(user_id=user.id, device_uid=device_uid).one()
+
+    device.last_seen_at = _utc_now()
+    if name and device.name != name:
+        device.name = name
+    return device
+
+
+def existing_client_session_ids(db: Session, device: models.ServerDevice, client_session_ids,
+                                locking: bool = False) -> set:
+    """
+    返回这批本地会话 id 中已经被服务器接收过的部分（一次查询）。
+    locking 时用加锁读取：读到其他事务最新提交的行（而不是可重复读的快照），并等待尚未提交的同 id 插入
+    """
+    ids = [i for i in client_session_ids if i is not None]
+    if not ids:
+        return set()
+    query = db.query(models.ServerProcessSession.client_session_id)\
+        .filter(models.ServerProcessSession.device_id == device.id)\
+        .filter(models.ServerProcessSession.client_session_id.in_(ids))
+    if locking:
+        query = query.with_for_update()
+    return {row[0] for row in query.all()}
+
+
+def existing_client_sessions(db: Session, device: models.ServerDevice, client_session_ids) -> Dict[int, datetime]:
+    """返回这批本地会话 id 中已被服务器接收过的部分：id -> 服务器上该会话的开始时间（UTC）"""
+    ids = [i for i in client_session_ids if i is not None]
+    if not ids:
+        return {}
+    rows = db.query(models.ServerProcessSession.client_session_id, models.ServerProcessSession.session_start_time)\
+        .filter(models.ServerProcessSession.device_id == device.id)\
+        .filter(models.ServerProcessSession.client_session_id.in_(ids))\
+        .all()
+    return {client_session_id: start for client_session_id, start in rows}
+
+
+def is_same_session(stored_start: datetime, start_utc: datetime) -> bool:
+    """
+    同一设备、同一本地 id 的会话是否就是服务器已有的那一个。
+    客户端恢复旧备份后本地 id 会回退，同一个 id 可能对应另一个会话；DATETIME 列不保存微秒，按秒比较
+    """
+    return abs((stored_start - start_utc).total_seconds()) < 1
+
+
+def advance_watermark(device: models.ServerDevice, client_session_ids) -> None:
+    """把设备的高水位推进到已确认的最大本地会话 id"""
+    ids = [i for i in client_session_ids if i is not None]
+    if ids and max(ids) > (device.last_client_session_id or 0):
+        device.last_client_session_id = max(ids)
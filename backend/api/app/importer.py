@@ -0,0 +1,335 @@
+import os
+import gzip
+import sqlite3
+from collections import defaultdict
+from datetime import datetime
+from typing import Iterator, List, Optional, Tuple
+
+from pydantic import ValidationError
+from sqlalchemy import select, insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from . import models, schemas, rollups, intervals, categories, devices, ingest, cache, database, title_index
+from .logger import logger
+
+# 每批导入的会话数，每批按应用分别提交
+IMPORT_CHUNK_SIZE = int(os.getenv("IMPORT_CHUNK_SIZE", "500"))
+# 进度中最多保留的拒绝原因条数
+MAX_REPORTED_REJECTIONS = 20
+
+FORMAT_SQLITE = "sqlite"
+FORMAT_NDJSON = "ndjson"
+
+_SQLITE_MAGIC = b"SQLite format 3\x00"
+_GZIP_MAGIC = b"\x1f\x8b"
+
+
+def detect_format(path: str) -> Optional[str]:
+    """根据文件头判断格式：客户端的 SQLite 数据库，或 (gzip 压缩的) NDJSON"""
+    with open(path, "rb") as f:
+        head = f.read(16)
+    if head.startswith(_SQLITE_MAGIC):
+        return FORMAT_SQLITE
+    if head.startswith(_GZIP_MAGIC) or head.lstrip().startswith(b"{"):
+        return FORMAT_NDJSON
+    return None
+
+
+# ---------- 读取 ----------
+
+Record = Tuple[int, Optional[schemas.SyncProcessSession], Optional[str]]  # (序号, 会话, 解析错误)
+
+
+def _parse_local_datetime(value) -> Optional[datetime]:
+    if value is None or isinstance(value, datetime):
+        return value
+    return datetime.fromisoformat(str(value))
+
+
+def first_open_session_id(path: str) -> Optional[int]:
+    """客户端数据库中仍在进行（尚未结束）的最早会话 id；设备高水位不能越过它，否则客户端会把它误标为已同步"""
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        return conn.execute("SELECT MIN(id) FROM process_sessions WHERE session_end_time IS NULL").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def iter_sqlite_chunks(path: str, chunk_size: int = IMPORT_CHUNK_SIZE) -> Iterator[List[Record]]:
+    """
+    读取客户端的 local_client.db（只读打开），只导入已结束的会话。
+    时间是客户端本地时间（不带时区），与旧版客户端同步时一样按用户时区解释。
+    """
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        cursor = conn.execute(
+            "SELECT s.id, s.process_name, a.executable_path, s.session_start_time, s.session_end_time, "
+            "       s.total_lifetime_seconds, s.total_focus_seconds "
+            "FROM process_sessions s "
+            "JOIN app_usage_summary u ON u.id = s.summary_id "
+            "JOIN watched_applications a ON a.id = u.application_id "
+            "WHERE s.session_end_time IS NOT NULL "
+            "ORDER BY s.id"
+        )
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                return
+            activities = defaultdict(list)
+            placeholders = ",".join("?" * len(rows))
+            for session_id, title, seconds in conn.execute(
+                f"SELECT session_id, window_title, focus_duration_seconds FROM focus_activities "
+                f"WHERE session_id IN ({placeholders}) ORDER BY id",
+                [row[0] for row in rows],
+            ):
+                activities[session_id].append({"window_title": title or "", "focus_duration_seconds": seconds or 0})
+
+            chunk = []
+            for session_id, process_name, path_, start, end, lifetime, focus in rows:
+                try:
+                    chunk.append((session_id, schemas.SyncProcessSession(
+                        client_session_id=session_id,
+                        process_name=process_name,
+                        executable_path=path_,
+                        session_start_time=_parse_local_datetime(start),
+                        session_end_time=_parse_local_datetime(end),
+                        total_lifetime_seconds=lifetime or 0,
+                        total_focus_seconds=focus or 0,
+                        activities=activities.get(session_id, []),
+                    ), None))
+                except (ValidationError, ValueError) as e:
+                    chunk.append((session_id, None, f"无法解析: {e.__class__.__name__}"))
+            yield chunk
+    finally:
+        conn.close()
+
+
+def iter_ndjson_chunks(path: str, chunk_size: int = IMPORT_CHUNK_SIZE) -> Iterator[List[Record]]:
+    """每行一个与同步接口相同格式的会话对象，文件可以是 gzip 压缩的"""
+    with open(path, "rb") as raw:
+        compressed = raw.read(2) == _GZIP_MAGIC
+    opener = gzip.open if compressed else open
+    with opener(path, "rt", encoding="utf-8") as f:
+        chunk = []
+        for line_no, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                chunk.append((line_no, schemas.SyncProcessSession.model_validate_json(line), None))
+            except ValidationError as e:
+                chunk.append((line_no, None, f"第 {line_no} 行无法解析: {e.error_count()} 个错误"))
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+
+# ---------- 写入 ----------
+
+def _get_or_create_apps(db: Session, user: models.User, dtos: List[schemas.SyncProcessSession]) -> dict:
+    """一次查询取回这批会话涉及的应用，缺少的批量创建；返回 executable_path -> 应用"""
+    App = models.ServerWatchedApplication
+    paths = {dto.executable_path: dto.process_name for dto in dtos}
+    apps = {
+        app.executable_path: app
+        for app in db.query(App).filter(App.user_id == user.id).filter(App.executable_path.in_(list(paths))).all()
+    }
+    for path, process_name in paths.items():
+        if path in apps:
+            continue
+        try:
+            with db.begin_nested():
+                app = App(user_id=user.id, executable_name=process_name, executable_path=path)
+                db.add(app)
+        except IntegrityError:
+            # 同一应用恰好正在被同步接口创建
+            app = db.query(App).filter_by(user_id=user.id, executable_path=path).one()
+        apps[path] = app
+    db.commit()
+    return apps
+
+
+def _lock_or_create_summary(db: Session, app: models.ServerWatchedApplication) -> models.ServerAppUsageSummary:
+    Summary = models.ServerAppUsageSummary
+    summary = db.query(Summary).filter_by(application_id=app.id).with_for_update().first()
+    if summary is not None:
+        return summary
+    try:
+        with db.begin_nested():
+            summary = Summary(application_id=app.id, total_lifetime_seconds=0, total_focus_time_seconds=0,
+                              total_wallclock_seconds=0)
+            db.add(summary)
+    except IntegrityError:
+        summary = db.query(Summary).filter_by(application_id=app.id).with_for_update().one()
+    return summary
+
+
+def _import_app_sessions(db: Session, ctx: ingest.IngestContext, app: models.ServerWatchedApplication,
+                         dtos: List[schemas.SyncProcessSession], watermark_cap: Optional[int]) -> int:
+    """
+    在一个事务中批量写入同一应用的一批会话：会话、焦点活动各一次批量插入，
+    区间索引整批合并一次，各汇总表按批合并后 upsert。持有与同步接口相同的 summary 行锁。
+    返回实际写入的会话数。
+    """
+    user, tz, device = ctx.user, ctx.tz, ctx.device
+    S = models.ServerProcessSession
+    summary = _lock_or_create_summary(db, app)
+    # import_chunk 的去重检查不持锁，之后同步接口可能已写入了其中的会话；
+    # 加锁后再查一次，跳过这些会话，否则批量插入违反唯一索引，整个导入任务失败
+    received = devices.existing_client_session_ids(db, device, [dto.client_session_id for dto in dtos], locking=True)
+    dtos = [dto for dto in dtos if dto.client_session_id not in received]
+    if not dtos:
+        db.commit()
+        return 0
+
+    times = [(rollups.to_utc_naive(dto.session_start_time, tz), rollups.to_utc_naive(dto.session_end_time, tz))
+             for dto in dtos]
+    wallclock = intervals.add_intervals(db, app.id, times)
+
+    db.execute(insert(S), [
+        {
+            "summary_id": summary.id,
+            "device_id": device.id,
+            "client_session_id": dto.client_session_id,
+            "process_name": dto.process_name,
+            "session_start_time": start,
+            "session_end_time": end,
+            "total_lifetime_seconds": dto.total_lifetime_seconds,
+            "total_focus_seconds": dto.total_focus_seconds,
+            "rollup_version": rollups.ROLLUP_VERSION,
+        }
+        for dto, (start, end) in zip(dtos, times)
+    ])
+    # 批量插入拿不到自增 id，通过 (device_id, client_session_id) 唯一索引一次查回
+    session_ids = dict(db.execute(
+        select(S.client_session_id, S.id)
+        .where(S.device_id == device.id)
+        .where(S.client_session_id.in_([dto.client_session_id for dto in dtos]))
+    ).all())
+
+    activity_rows = []
+    daily, hourly, category = [], [], []
+    for dto, (start, end), pieces in zip(dtos, times, wallclock):
+        session_id = session_ids[dto.client_session_id]
+        activity_rows.extend(
+            {
+                "session_id": session_id,
+                "window_title": a.window_title[:ingest.MAX_WINDOW_TITLE_LENGTH],
+                "focus_duration_seconds": a.focus_duration_seconds,
+            }
+            for a in dto.activities
+        )
+        daily += rollups.daily_rows(user.id, app.id, start, end, dto.total_lifetime_seconds,
+                                    dto.total_focus_seconds, tz, pieces)
+        hourly += rollups.hourly_rows(user.id, app.id, start, end, dto.total_lifetime_seconds,
+                                      dto.total_focus_seconds, tz)
+        per_category = categories.category_seconds(
+            ctx.matcher, app.executable_name, ((a.window_title, a.focus_duration_seconds) for a in dto.activities)
+        )
+        category += categories.daily_category_rows(user.id, app.id, start, end, per_category, tz)
+    if activity_rows:
+        db.execute(insert(models.ServerFocusActivity), activity_rows)
+        title_index.index_titles(db, user.id, app.id, (row["window_title"] for row in activity_rows))
+    rollups.upsert_daily(db, daily)
+    rollups.upsert_hourly(db, hourly)
+    categories.upsert_category_daily(db, category)
+
+    summary.total_lifetime_seconds = (summary.total_lifetime_seconds or 0) + sum(d.total_lifetime_seconds for d in dtos)
+    summary.total_focus_time_seconds = (summary.total_focus_time_seconds or 0) + sum(d.total_focus_seconds for d in dtos)
+    summary.total_wallclock_seconds = (summary.total_wallclock_seconds or 0) \
+        + sum(intervals.covered_seconds(pieces) for pieces in wallclock)
+    first_start = min(start for start, _ in times)
+    last_start, last_end = max(times, key=lambda t: t[1])
+    if summary.first_seen_at is None or summary.first_seen_at > first_start:
+        summary.first_seen_at = first_start
+    if summary.last_seen_end_at is None or summary.last_seen_end_at < last_end:
+        summary.last_seen_start_at = last_start
+        summary.last_seen_end_at = last_end
+
+    devices.advance_watermark(device, [
+        dto.client_session_id for dto in dtos
+        if watermark_cap is None or dto.client_session_id < watermark_cap
+    ])
+    cache.bump_data_version(db, user.id)
+    db.commit()
+    return len(dtos)
+
+
+def import_chunk(db: Session, ctx: ingest.IngestContext, records: List[Record], stats: dict,
+                 watermark_cap: Optional[int] = None) -> None:
+    """校验一批记录、跳过该设备已导入/已同步过的会话，其余按应用分组批量写入"""
+    valid = []
+    for position, dto, error in records:
+        reason = error
+        if reason is None:
+            reason = ingest.validate_session(dto)
+        if reason is None and dto.client_session_id is None:
+            reason = "缺少 client_session_id"
+        if reason is not None:
+            stats["rejected"] += 1
+            if len(stats["rejections"]) < MAX_REPORTED_REJECTIONS:
+                stats["rejections"].append({"position": position, "reason": reason})
+            continue
+        valid.append(dto)
+
+    # 同一文件中重复的会话只取第一条
+    seen = set()
+    unique = []
+    for dto in valid:
+        if dto.client_session_id not in seen:
+            seen.add(dto.client_session_id)
+            unique.append(dto)
+    stats["duplicates"] += len(valid) - len(unique)
+
+    existing = devices.existing_client_session_ids(db, ctx.device, [dto.client_session_id for dto in unique])
+    new = [dto for dto in unique if dto.client_session_id not in existing]
+    stats["duplicates"] += len(unique) - len(new)
+    if not new:
+        db.rollback()
+        return
+
+    apps = _get_or_create_apps(db, ctx.user, new)
+    by_app = defaultdict(list)
+    for dto in new:
+        by_app[dto.executable_path].append(dto)
+    for path in sorted(by_app):
+        imported = _import_app_sessions(db, ctx, apps[path], by_app[path], watermark_cap)
+        stats["imported"] += imported
+        stats["duplicates"] += len(by_app[path]) - imported
+
+
+def run_import(user_id: int, device_id: int, path: str, fmt: str):
+    """返回在后台执行的导入任务函数，结束后删除上传的临时文件"""
+
+    def run(reporter):
+        db = database.SessionLocal()
+        try:
+            user = db.get(models.User, user_id)
+            ctx = ingest.IngestContext(
+                user=user,
+                tz=rollups.get_zone(user.timezone),
+                device=db.get(models.ServerDevice, device_id),
+                matcher=categories.get_matcher(db, user),
+            )
+            stats = {"imported": 0, "duplicates": 0, "rejected": 0, "rejections": []}
+            if fmt == FORMAT_SQLITE:
+                watermark_cap = first_open_session_id(path)
+                chunks = iter_sqlite_chunks(path)
+            else:
+                watermark_cap = None
+                chunks = iter_ndjson_chunks(path)
+            for chunk in chunks:
+                import_chunk(db, ctx, chunk, stats, watermark_cap)
+                reporter.update(**stats)
+            logger.info(f"用户 {user.username} 导入完成: 新增 {stats['imported']}，重复 {stats['duplicates']}，拒绝 {stats['rejected']}")
+        finally:
+            db.close()
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    return run
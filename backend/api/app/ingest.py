@@ -0,0 +1,154 @@
+from dataclasses import dataclass
+from typing import Optional
+from zoneinfo import ZoneInfo
+
+from sqlalchemy.orm import Session
+
+from . import models, schemas, rollups, intervals, categories, title_index
+
+# 与模型中的列长度保持一致
+MAX_EXECUTABLE_PATH_LENGTH = 512
+MAX_PROCESS_NAME_LENGTH = 255
+MAX_WINDOW_TITLE_LENGTH = 1024
+
+
+@dataclass
+class IngestContext:
+    """一次同步请求内所有会话共用的信息"""
+    user: models.User
+    tz: ZoneInfo
+    device: Optional[models.ServerDevice] = None
+    matcher: Optional[categories.CategoryMatcher] = None
+
+
+def validate_session(session_dto: schemas.SyncProcessSession) -> Optional[str]:
+    """检查会话数据是否能够入库，返回拒绝原因；可以入库时返回 None"""
+    if not session_dto.executable_path or len(session_dto.executable_path) > MAX_EXECUTABLE_PATH_LENGTH:
+        return "executable_path 为空或过长"
+    if not session_dto.process_name or len(session_dto.process_name) > MAX_PROCESS_NAME_LENGTH:
+        return "process_name 为空或过长"
+    if session_dto.session_end_time < session_dto.session_start_time:
+        return "session_end_time 早于 session_start_time"
+    if session_dto.total_lifetime_seconds < 0 or session_dto.total_focus_seconds < 0:
+        return "时长不能为负数"
+    if any(a.focus_duration_seconds < 0 for a in session_dto.activities):
+        return "焦点活动时长不能为负数"
+    return None
+
+
+def ingest_session(db: Session, ctx: IngestContext, session_dto: schemas.SyncProcessSession) -> models.ServerProcessSession:
+    """把一个客户端会话写入数据库并更新各类汇总，调用方负责事务/保存点"""
+    current_user = ctx.user
+    device = ctx.device
+
+    #查找或创建WatchedApplication
+    watched_app = db.query(models.ServerWatchedApplication).filter_by(
+        user_id=current_user.id,
+        executable_path=session_dto.executable_path
+    ).first()
+
+    if not watched_app:
+        watched_app = models.ServerWatchedApplication(
+            owner=current_user,
+            executable_name=session_dto.process_name,
+            executable_path=session_dto.executable_path
+        )
+        db.add(watched_app)
+        db.flush()
+
+    #锁定并更新或创建AppUsageSummary
+    summary = db.query(models.ServerAppUsageSummary).filter_by(
+        application_id=watched_app.id
+    ).with_for_update().first()
+
+    #current_session_focus_seconds = sum(act.focus_duration_seconds for act in session_dto.activities)
+    current_session_focus_seconds = session_dto.total_focus_seconds
+    # 统一转换为 UTC 存储；旧版客户端发送的不带时区的本地时间按用户时区解释
+    start_time = rollups.to_utc_naive(session_dto.session_start_time, ctx.tz)
+    end_time = rollups.to_utc_naive(session_dto.session_end_time, ctx.tz)
+    if not summary:
+        summary = models.ServerAppUsageSummary(
+            application=watched_app,
+            first_seen_at=start_time,
+            last_seen_start_at=start_time,
+            last_seen_end_at=end_time,
+            total_lifetime_seconds=session_dto.total_lifetime_seconds,
+            total_focus_time_seconds=current_session_focus_seconds
+        )
+        db.add(summary)
+    else:
+        summary.total_lifetime_seconds += session_dto.total_lifetime_seconds
+        summary.total_focus_time_seconds += current_session_focus_seconds
+        summary.last_seen_start_at = start_time
+        summary.last_seen_end_at = end_time
+        if not summary.first_seen_at or summary.first_seen_at > start_time:
+            summary.first_seen_at = start_time
+
+    db.flush()
+
+    #并入应用的区间索引，只有此前未被覆盖的时间段才计入真实运行时长
+    wallclock_pieces = intervals.add_interval(db, watched_app.id, start_time, end_time)
+    summary.total_wallclock_seconds = (summary.total_wallclock_seconds or 0) \
+        + intervals.covered_seconds(wallclock_pieces)
+
+    #创建ProcessSession
+    new_session = models.ServerProcessSession(
+        summary_id=summary.id,
+        device_id=device.id if device is not None else None,
+        client_session_id=session_dto.client_session_id if device is not None else None,
+        process_name=session_dto.process_name,
+        session_start_time=start_time,
+        session_end_time=end_time,
+        total_lifetime_seconds=session_dto.total_lifetime_seconds,
+        total_focus_seconds=current_session_focus_seconds,
+        rollup_version=rollups.ROLLUP_VERSION
+    )
+    db.add(new_session)
+    db.flush()
+
+    #按用户本地日期累加到日汇总表
+    rollups.apply_session_rollups(
+        db,
+        user_id=current_user.id,
+        application_id=watched_app.id,
+        start_utc=start_time,
+        end_utc=end_time,
+        lifetime_seconds=session_dto.total_lifetime_seconds,
+        focus_seconds=current_session_focus_seconds,
+        tz=ctx.tz,
+        wallclock_pieces=wallclock_pieces,
+    )
+
+    #按用户的分类规则把焦点时长累加到分类日汇总表
+    if ctx.matcher is None:
+        ctx.matcher = categories.get_matcher(db, current_user)
+    categories.apply_category_rollups(
+        db,
+        user_id=current_user.id,
+        application_id=watched_app.id,
+        start_utc=start_time,
+        end_utc=end_time,
+        per_category=categories.category_seconds(
+            ctx.matcher,
+            watched_app.executable_name,
+            ((a.window_title, a.focus_duration_seconds) for a in session_dto.activities),
+        ),
+        tz=ctx.tz,
+    )
+
+    #批量创建FocusActivities（过长的窗口标题截断而不是拒绝整个会话）
+    activities_to_add = []
+    for activity_data in session_dto.activities:
+        activities_to_add.append(
+            models.ServerFocusActivity(
+                session_id=new_session.id,
+                window_title=activity_data.window_title[:MAX_WINDOW_TITLE_LENGTH],
+                focus_duration_seconds=activity_data.focus_duration_seconds
+            )
+        )
+    if activities_to_add:
+        db.add_all(activities_to_add)
+        db.flush()
+        title_index.index_titles(db, current_user.id, watched_app.id, (a.window_title for a in activities_to_add))
+
+    return new_session
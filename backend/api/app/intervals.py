@@ -0,0 +1,137 @@
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+from typing import List, Tuple
+
+from sqlalchemy import select, delete, insert
+from sqlalchemy.orm import Session
+
+from . import models
+
+Interval = Tuple[datetime, datetime]
+
+
+def merge_intervals(intervals: List[Interval]) -> List[Interval]:
+    """排序后一次扫描合并重叠或首尾相接的区间，返回互不重叠的有序区间"""
+    merged: List[Interval] = []
+    for start, end in sorted(intervals):
+        if end <= start:
+            continue
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def subtract(interval: Interval, covered: List[Interval]) -> List[Interval]:
+    """返回 interval 中未被 covered（有序且互不重叠）覆盖的部分"""
+    start, end = interval
+    pieces: List[Interval] = []
+    cursor = start
+    for c_start, c_end in covered:
+        if c_end <= cursor:
+            continue
+        if c_start >= end:
+            break
+        if c_start > cursor:
+            pieces.append((cursor, c_start))
+        cursor = max(cursor, c_end)
+        if cursor >= end:
+            break
+    if cursor < end:
+        pieces.append((cursor, end))
+    return pieces
+
+
+def add_interval(db: Session, application_id: int, start: datetime, end: datetime) -> List[Interval]:
+    """
+    把一个会话区间并入应用的区间索引（每个应用一组互不重叠的区间），
+    返回此前未被任何会话覆盖的部分，其总长即为本次新增的真实运行时长。
+    只读取与新区间相交或相接的几条索引记录，不需要扫描历史会话。
+    调用方需已持有该应用 summary 的行锁，保证同一应用的合并是串行的。
+    """
+    if end <= start:
+        return []
+    Intervals = models.ServerAppInterval
+    existing = db.execute(
+        select(Intervals.id, Intervals.start_time, Intervals.end_time)
+        .where(Intervals.application_id == application_id)
+        .where(Intervals.end_time >= start)
+        .where(Intervals.start_time <= end)
+        .order_by(Intervals.start_time)
+    ).all()
+
+    covered = [(row.start_time, row.end_time) for row in existing]
+    new_pieces = subtract((start, end), covered)
+    if not new_pieces:
+        return []
+
+    merged = merge_intervals(covered + [(start, end)])
+    if existing:
+        db.execute(delete(Intervals).where(Intervals.id.in_([row.id for row in existing])))
+    db.execute(insert(Intervals), [
+        {"application_id": application_id, "start_time": m_start, "end_time": m_end}
+        for m_start, m_end in merged
+    ])
+    return new_pieces
+
+
+def _insert_sorted(covered: List[Interval], start: datetime, end: datetime) -> None:
+    """把 [start, end) 并入有序且互不重叠的 covered（原地修改），只改动与之相交或相接的一段"""
+    ends = [c_end for _, c_end in covered]
+    starts = [c_start for c_start, _ in covered]
+    lo = bisect_left(ends, start)
+    hi = bisect_right(starts, end)
+    if lo < hi:
+        start = min(start, covered[lo][0])
+        end = max(end, covered[hi - 1][1])
+    covered[lo:hi] = [(start, end)]
+
+
+def add_intervals(db: Session, application_id: int, new_intervals: List[Interval]) -> List[List[Interval]]:
+    """
+    add_interval 的批量版本（用于导入等批量写入）：整批只读取、删除、插入各一次。
+    按输入顺序依次并入，返回每个输入区间此前未被覆盖的部分，与逐个调用 add_interval 的结果相同。
+    调用方同样需要持有该应用 summary 的行锁。
+    """
+    valid = [(start, end) for start, end in new_intervals if end > start]
+    if not valid:
+        return [[] for _ in new_intervals]
+    lo = min(start for start, _ in valid)
+    hi = max(end for _, end in valid)
+
+    Intervals = models.ServerAppInterval
+    existing = db.execute(
+        select(Intervals.id, Intervals.start_time, Intervals.end_time)
+        .where(Intervals.application_id == application_id)
+        .where(Intervals.end_time >= lo)
+        .where(Intervals.start_time <= hi)
+        .order_by(Intervals.start_time)
+    ).all()
+
+    covered = [(row.start_time, row.end_time) for row in existing]
+    result = []
+    changed = False
+    for start, end in new_intervals:
+        if end <= start:
+            result.append([])
+            continue
+        pieces = subtract((start, end), covered)
+        result.append(pieces)
+        if pieces:
+            _insert_sorted(covered, start, end)
+            changed = True
+
+    if changed:
+        if existing:
+            db.execute(delete(Intervals).where(Intervals.id.in_([row.id for row in existing])))
+        db.execute(insert(Intervals), [
+            {"application_id": application_id, "start_time": c_start, "end_time": c_end}
+            for c_start, c_end in covered
+        ])
+    return result
+
+
+def covered_seconds(pieces: List[Interval]) -> int:
+    return int(sum((end - start).total_seconds() for start, end in pieces))
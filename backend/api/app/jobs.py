@@ -0,0 +1,88 @@
+import json
+import uuid
+from datetime import datetime, timezone
+from typing import Callable, Optional
+
+from sqlalchemy.orm import Session
+
+from . import models, database
+from .logger import logger
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+def _utc_now() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def create_job(db: Session, user_id: int, kind: str, progress: Optional[dict] = None) -> models.ServerJob:
+    now = _utc_now()
+    job = models.ServerJob(
+        id=uuid.uuid4().hex,
+        user_id=user_id,
+        kind=kind,
+        status=PENDING,
+        progress=json.dumps(progress or {}, ensure_ascii=False),
+        created_at=now,
+        updated_at=now,
+    )
+    db.add(job)
+    db.commit()
+    return job
+
+
+def job_to_dict(job: models.ServerJob) -> dict:
+    return {
+        "id": job.id,
+        "kind": job.kind,
+        "status": job.status,
+        "progress": json.loads(job.progress) if job.progress else {},
+        "error": job.error,
+        "created_at": job.created_at,
+        "updated_at": job.updated_at,
+    }
+
+
+class JobReporter:
+    """后台任务内使用：用独立的短事务更新进度，不影响任务自身的事务"""
+
+    def __init__(self, job_id: str):
+        self.job_id = job_id
+        # 保留创建任务时写入的初始信息，进度在其基础上追加
+        db = database.SessionLocal()
+        try:
+            job = db.get(models.ServerJob, job_id)
+            self.progress = json.loads(job.progress) if job is not None and job.progress else {}
+        finally:
+            db.close()
+
+    def _write(self, **fields):
+        db = database.SessionLocal()
+        try:
+            fields["updated_at"] = _utc_now()
+            db.query(models.ServerJob).filter_by(id=self.job_id).update(fields)
+            db.commit()
+        finally:
+            db.close()
+
+    def update(self, **progress):
+        self.progress.update(progress)
+        self._write(progress=json.dumps(self.progress, ensure_ascii=False, default=str))
+
+    def set_status(self, status: str, error: Optional[str] = None):
+        self._write(status=status, error=error)
+
+
+def run_job(job_id: str, func: Callable[[JobReporter], None]) -> None:
+    """在后台执行任务函数并记录状态；供 BackgroundTasks 调用"""
+    reporter = JobReporter(job_id)
+    reporter.set_status(RUNNING)
+    try:
+        func(reporter)
+        reporter.set_status(DONE)
+    except Exception as e:
+        logger.error(f"后台任务 {job_id} 执行失败: {e}", exc_info=True)
+        reporter.set_status(FAILED, error=str(e))
@@ -1,117 +1,159 @@
-from typing import List
-from datetime import datetime, timezone
-from fastapi import FastAPI, Depends, HTTPException, status
+from typing import List, Optional
+from fastapi import FastAPI, Depends, Header, HTTPException, status
 from fastapi.security import OAuth2PasswordRequestForm
+from sqlalchemy.exc import DataError, DBAPIError, IntegrityError, PendingRollbackError
 from sqlalchemy.orm import Session
-from . import models, schemas, auth, database
-from .routers import dashboard
+from . import models, schemas, auth, database, rate_limit, rollups, migrations, devices, ingest, categories, cache
+from .request_encoding import BodySizeLimitMiddleware, GzipRequestMiddleware
+from .routers import dashboard, export, apps, jobs, search, imports, categories as category_routes
 from .logger import logger
 
-
-def ensure_aware_dt(dt: datetime) -> datetime:
-    """如果 datetime 是 naive（无时区），则假定为 UTC 并添加时区信息"""
-    if dt is None:
-        return None
-    if dt.tzinfo is None:
-        return dt.replace(tzinfo=timezone.utc)
-    return dt
-
 # 初始化数据库表
 models.Base.metadata.create_all(bind=database.engine) 
+migrations.run_startup_migrations(database.engine, models.Base.metadata)
 
 app = FastAPI()
 app.include_router(dashboard.router)
+app.include_router(export.router)
+app.include_router(apps.router)
+app.include_router(jobs.router)
+app.include_router(search.router)
+app.include_router(category_routes.router)
+app.include_router(imports.router)
+# 客户端会 gzip 压缩较大的同步请求；解压后的大小与同步请求体使用同一上限，只作用于同步接口
+app.add_middleware(GzipRequestMiddleware, max_bytes=rate_limit.SYNC_MAX_BODY_BYTES, path_prefix="/sync/")
+# 在解析请求体之前拒绝过大的同步请求（后添加的中间件在外层，限制的是压缩前实际收到的字节数）
+app.add_middleware(BodySizeLimitMiddleware, max_bytes=rate_limit.SYNC_MAX_BODY_BYTES, path_prefix="/sync/")
 logger.info("后端 API 已启动。")
 
+# 同步因数据库暂时不可用而整批失败时，建议客户端等待的秒数
+SYNC_RETRY_AFTER_SECONDS = 5
+
 #智能同步接口(采用手动事务控制)
-@app.post("/sync/sessions/", status_code=status.HTTP_201_CREATED, tags=["Sync"])
+#每个会话在独立的保存点中写入：单个会话失败只回滚它自己，其余会话照常提交，
+#返回结果中逐个列出被接收和被拒绝的会话，客户端据此精确标记同步状态
+@app.post("/sync/sessions/", status_code=status.HTTP_201_CREATED, response_model=schemas.SyncResult, tags=["Sync"])
 def sync_sessions_from_client(
     sessions_data: List[schemas.SyncProcessSession],
     db: Session = Depends(database.get_db),
-    current_user: models.User = Depends(auth.get_current_user)
+    current_user: models.User = Depends(auth.get_current_user),
+    x_client_timezone: Optional[str] = Header(None),
+    x_device_id: Optional[str] = Header(None, max_length=64),
+    x_device_name: Optional[str] = Header(None, max_length=255)
 ):
     if not sessions_data:
-        return {"message": "无新数据需要同步。"}
-        
+        return schemas.SyncResult(message="无新数据需要同步。")
+
+    # 准入控制：超过限额时直接返回 429/413，不触碰数据库
+    rate_limit.ingest_limiter.check(current_user.id, len(sessions_data))
+
     try:
+        # 客户端上报的时区变化时更新到用户上，之后的日期划分都以此为准
+        if x_client_timezone and x_client_timezone != current_user.timezone \
+                and rollups.is_valid_timezone(x_client_timezone):
+            logger.info(f"用户 {current_user.username} 的时区更新为 {x_client_timezone}")
+            current_user.timezone = x_client_timezone
+        ctx = ingest.IngestContext(
+            user=current_user,
+            tz=rollups.get_zone(current_user.timezone),
+            matcher=categories.get_matcher(db, current_user),
+        )
 
-        for session_dto in sessions_data:
-            #查找或创建WatchedApplication
-            watched_app = db.query(models.ServerWatchedApplication).filter_by(
-                user_id=current_user.id,
-                executable_path=session_dto.executable_path
-            ).first()
-
-            if not watched_app:
-                watched_app = models.ServerWatchedApplication(
-                    owner=current_user,
-                    executable_name=session_dto.process_name,
-                    executable_path=session_dto.executable_path
-                )
-                db.add(watched_app)
-                db.flush()
-
-            #锁定并更新或创建AppUsageSummary
-            summary = db.query(models.ServerAppUsageSummary).filter_by(
-                application_id=watched_app.id
-            ).with_for_update().first()
-
-            #current_session_focus_seconds = sum(act.focus_duration_seconds for act in session_dto.activities)
-            current_session_focus_seconds = session_dto.total_focus_seconds
-            start_time = ensure_aware_dt(session_dto.session_start_time)
-            end_time = ensure_aware_dt(session_dto.session_end_time)
-            if not summary:
-                summary = models.ServerAppUsageSummary(
-                    application=watched_app,
-                    first_seen_at=start_time,
-                    last_seen_start_at=start_time,
-                    last_seen_end_at=end_time,
-                    total_lifetime_seconds=session_dto.total_lifetime_seconds,
-                    total_focus_time_seconds=current_session_focus_seconds
-                )
-                db.add(summary)
-            else:
-                summary.total_lifetime_seconds += session_dto.total_lifetime_seconds
-                summary.total_focus_time_seconds += current_session_focus_seconds
-                summary.last_seen_start_at = start_time
-                summary.last_seen_end_at = end_time
-                if not summary.first_seen_at or summary.first_seen_at > start_time:
-                    summary.first_seen_at = start_time
-            
-            db.flush()
-
-            #创建ProcessSession
-            new_session = models.ServerProcessSession(
-                summary_id=summary.id,
-                process_name=session_dto.process_name,
-                session_start_time=start_time,
-                session_end_time=end_time,
-                total_lifetime_seconds=session_dto.total_lifetime_seconds,
-                total_focus_seconds=current_session_focus_seconds
+        #识别来源设备；同一设备已接收过的本地会话不再重复累加，但仍视为已接收
+        already_received = {}
+        if x_device_id:
+            ctx.device = devices.get_or_create_device(db, current_user, x_device_id, x_device_name)
+            already_received = devices.existing_client_sessions(
+                db, ctx.device, [dto.client_session_id for dto in sessions_data]
             )
-            db.add(new_session)
-            db.flush()
-
-            #批量创建FocusActivities
-            activities_to_add = []
-            for activity_data in session_dto.activities:
-                activities_to_add.append(
-                    models.ServerFocusActivity(
-                        session_id=new_session.id,
-                        window_title=activity_data.window_title,
-                        focus_duration_seconds=activity_data.focus_duration_seconds
-                    )
-                )
-            if activities_to_add:
-                db.add_all(activities_to_add)
-        
-        #所有循环成功结束后，在 try 块的最后，手动提交整个事务
+
+        accepted_ids = []
+        accepted_count = 0
+        duplicate_count = 0
+        rejected = []
+
+        for index, session_dto in enumerate(sessions_data):
+            client_session_id = session_dto.client_session_id
+            if ctx.device is not None and client_session_id is not None and client_session_id in already_received:
+                start_utc = rollups.to_utc_naive(session_dto.session_start_time, ctx.tz)
+                if devices.is_same_session(already_received[client_session_id], start_utc):
+                    accepted_ids.append(client_session_id)
+                    duplicate_count += 1
+                    continue
+                # 这个 id 已被本设备的另一个会话占用（客户端恢复了旧备份），不按 id 去重，照常写入
+                logger.warning(f"设备 {x_device_id} 的本地会话 id {client_session_id} 已对应另一个会话，按新会话写入")
+                session_dto = session_dto.model_copy(update={"client_session_id": None})
+
+            reason = ingest.validate_session(session_dto)
+            retryable = False
+            if reason is None:
+                try:
+                    with db.begin_nested():
+                        ingest.ingest_session(db, ctx, session_dto)
+                except (IntegrityError, DataError) as e:
+                    # 约束冲突（如并发同步写入了同一会话）可重传；数据超出列的范围则重传也无用
+                    logger.warning(f"会话写入失败，已回滚该会话 (index={index}, client_session_id={client_session_id}): {e}")
+                    reason = f"服务器写入失败: {e.__class__.__name__}"
+                    retryable = isinstance(e, IntegrityError)
+                except (DBAPIError, PendingRollbackError):
+                    # 死锁、连接断开等会让数据库回滚整个外层事务，之前接收的会话也已丢失，只能整批失败
+                    raise
+                except Exception as e:
+                    logger.warning(f"会话写入失败，已回滚该会话 (index={index}, client_session_id={client_session_id}): {e}", exc_info=True)
+                    reason = f"服务器写入失败: {e.__class__.__name__}"
+                    retryable = True
+
+            if reason is not None:
+                rejected.append(schemas.RejectedSession(
+                    index=index, client_session_id=client_session_id, reason=reason, retryable=retryable
+                ))
+                continue
+
+            accepted_count += 1
+            if client_session_id is not None:
+                accepted_ids.append(client_session_id)
+                already_received[client_session_id] = rollups.to_utc_naive(session_dto.session_start_time, ctx.tz)
+
+        watermark = None
+        if ctx.device is not None:
+            # 高水位表示"不超过它的会话都已收到"，不能越过需要客户端重传的会话
+            retry_from = min(
+                (r.client_session_id for r in rejected if r.retryable and r.client_session_id is not None),
+                default=None,
+            )
+            devices.advance_watermark(ctx.device, [
+                i for i in accepted_ids if retry_from is None or i < retry_from
+            ])
+            watermark = ctx.device.last_client_session_id
+
+        if accepted_count:
+            cache.bump_data_version(db, current_user.id)
+
+        #所有会话处理完后，手动提交整个事务
         db.commit()
-        logger.info(f"用户 {current_user.username} 成功同步了 {len(sessions_data)} 个会话。")
-        return {"message": f"成功同步了 {len(sessions_data)} 个会话。"}
+        logger.info(
+            f"用户 {current_user.username} 同步了 {len(sessions_data)} 个会话："
+            f"新接收 {accepted_count}，重复 {duplicate_count}，拒绝 {len(rejected)}。"
+        )
+        return schemas.SyncResult(
+            message=f"成功同步了 {accepted_count + duplicate_count} 个会话，拒绝 {len(rejected)} 个。",
+            accepted=accepted_ids,
+            accepted_count=accepted_count + duplicate_count,
+            rejected=rejected,
+            watermark=watermark,
+        )
 
+    except (DBAPIError, PendingRollbackError) as e:
+        #数据库层面的失败（死锁、连接断开等）：整个事务已回滚，本次没有接收任何会话，让客户端稍后整批重传
+        db.rollback()
+        logger.warning(f"同步时数据库暂时不可用，事务已回滚: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="数据库暂时不可用，请稍后重试",
+            headers={"Retry-After": str(SYNC_RETRY_AFTER_SECONDS)},
+        )
     except Exception as e:
-        #如果 try块中的任何地方（包括flush）发生异常手动回滚所有更改
+        #如果 try块中的任何地方（包括提交）发生异常手动回滚所有更改
         db.rollback()
         logger.error(f"同步过程中发生严重错误，事务已回滚: {e}", exc_info=True)
         raise HTTPException(
@@ -121,6 +163,29 @@ def sync_sessions_from_client(
 
 
 
+# 查询当前用户的所有设备及其同步高水位
+@app.get("/sync/devices", response_model=List[schemas.DeviceCursor], tags=["Sync"])
+def list_devices(
+    db: Session = Depends(database.get_db),
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    return db.query(models.ServerDevice).filter_by(user_id=current_user.id).all()
+
+# 客户端询问"服务器已确认收到我的哪些会话"，用于重装或恢复备份后避免重复上传
+@app.get("/sync/devices/{device_uid}/cursor", response_model=schemas.DeviceCursor, tags=["Sync"])
+def get_device_cursor(
+    device_uid: str,
+    db: Session = Depends(database.get_db),
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    device = db.query(models.ServerDevice).filter_by(user_id=current_user.id, device_uid=device_uid).first()
+    if device is None:
+        # 从未同步过的设备，高水位为 0
+        return schemas.DeviceCursor(device_uid=device_uid, name=None, last_client_session_id=0, last_seen_at=None)
+    return device
+
+
+
 # 为客户端程序提供获取令牌的API
 @app.post("/auth/token", response_model=dict, tags=["API Authentication"])
 def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(database.get_db)):
@@ -0,0 +1,394 @@
+"""
+后端维护命令，可以在 API 正常服务时运行：
+
+    python -m app.maintenance backfill [--workers 4] [--users 1,2,3] [--restart]
+        为 rollup_version 低于当前 ROLLUP_VERSION 的历史会话补齐汇总数据，
+        按用户分片到多个进程，每批提交并记录断点，中断后再次运行会从断点继续。
+
+    python -m app.maintenance verify [--workers 4] [--users 1,2,3]
+        把各汇总表与原始会话/活动数据比对，报告不一致（有不一致时退出码为 1）。
+"""
+import argparse
+import sys
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timezone
+from multiprocessing import get_context
+from typing import Dict, List, Optional
+
+from sqlalchemy import select, update, func, case
+from sqlalchemy.orm import Session
+
+from . import database, models, rollups, intervals, categories, migrations, cache, title_index
+from .logger import logger
+
+# 每批处理的会话数（一次服务器端游标读取的行数）
+BACKFILL_CHUNK_SIZE = 1000
+TASK_BACKFILL = "rollup_backfill"
+# 分类汇总在第 3 层引入；这一层不按会话增量补写，而是整体重算应用的分类汇总（见 _backfill_categories）
+CATEGORY_LAYER = 3
+
+
+def _utc_now() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+# ---------- 断点 ----------
+
+def _load_checkpoint(db: Session, user_id: int) -> int:
+    checkpoint = db.query(models.ServerMaintenanceCheckpoint)\
+        .filter_by(task=TASK_BACKFILL, user_id=user_id)\
+        .first()
+    if checkpoint is None or checkpoint.target_version != rollups.ROLLUP_VERSION:
+        return 0
+    return checkpoint.last_session_id
+
+
+def _clear_checkpoint(db: Session, user_id: int) -> None:
+    """该用户已全部处理完，断点只用于中断后续跑，完成后删除"""
+    db.query(models.ServerMaintenanceCheckpoint)\
+        .filter_by(task=TASK_BACKFILL, user_id=user_id)\
+        .delete()
+    db.commit()
+
+
+def _save_checkpoint(db: Session, user_id: int, last_session_id: int) -> None:
+    checkpoint = db.query(models.ServerMaintenanceCheckpoint)\
+        .filter_by(task=TASK_BACKFILL, user_id=user_id)\
+        .first()
+    if checkpoint is None:
+        checkpoint = models.ServerMaintenanceCheckpoint(task=TASK_BACKFILL, user_id=user_id)
+        db.add(checkpoint)
+    checkpoint.target_version = rollups.ROLLUP_VERSION
+    checkpoint.last_session_id = last_session_id
+    checkpoint.updated_at = _utc_now()
+    db.commit()
+
+
+# ---------- backfill ----------
+
+def _backfill_categories(db: Session, user: models.User) -> int:
+    """
+    分类汇总整体重算（与修改规则后的后台任务相同）：重算本身读取应用的全部会话，
+    与会话的 rollup_version 无关，因此不会与同步写入、其他层的补写重复计数。
+    """
+    App = models.ServerWatchedApplication
+    Summary = models.ServerAppUsageSummary
+    S = models.ServerProcessSession
+    app_ids = db.execute(
+        select(Summary.application_id).distinct()
+        .join(S, S.summary_id == Summary.id)
+        .join(App, App.id == Summary.application_id)
+        .where(App.user_id == user.id)
+        .where(S.rollup_version < CATEGORY_LAYER)
+    ).scalars().all()
+    if not app_ids:
+        return 0
+    matcher = categories.get_matcher(db, user)
+    for app in db.query(App).filter(App.id.in_(app_ids)).order_by(App.id).all():
+        categories.recategorize_application(db, user, matcher, app)
+    return len(app_ids)
+
+
+def _backfill_app_sessions(db: Session, user: models.User, tz, application_id: int,
+                           summary_id: int, session_ids: List[int]) -> int:
+    """
+    在一个事务中为同一应用的一批会话补齐缺失的汇总层，并把这些会话标记为最新版本。
+    持有与同步写入相同的 summary 行锁，且只处理加锁后仍未升级的会话，可与 API 并发运行、可重复执行。
+    """
+    summary = db.query(models.ServerAppUsageSummary)\
+        .filter(models.ServerAppUsageSummary.id == summary_id)\
+        .with_for_update()\
+        .first()
+    if summary is None:  # 应用已被删除
+        db.rollback()
+        return 0
+
+    S = models.ServerProcessSession
+    sessions = db.execute(
+        select(S.id, S.session_start_time, S.session_end_time,
+               S.total_lifetime_seconds, S.total_focus_seconds, S.rollup_version)
+        .where(S.id.in_(session_ids))
+        .where(S.rollup_version < rollups.ROLLUP_VERSION)
+        .order_by(S.id)
+    ).all()
+    if not sessions:
+        db.rollback()
+        return 0
+
+    daily, hourly = [], []
+    wallclock_added = 0
+    unindexed = []
+    for s in sessions:
+        version = s.rollup_version or 0
+        # 第 1 层：日汇总表的运行/专注时长
+        lifetime = s.total_lifetime_seconds if version < 1 else 0
+        focus = s.total_focus_seconds if version < 1 else 0
+        # 第 2 层：区间索引与真实运行时长
+        pieces = []
+        if version < 2:
+            pieces = intervals.add_interval(db, application_id, s.session_start_time, s.session_end_time)
+            wallclock_added += intervals.covered_seconds(pieces)
+        if version < 1 or pieces:
+            daily += rollups.daily_rows(
+                user.id, application_id, s.session_start_time, s.session_end_time, lifetime, focus, tz, pieces
+            )
+        # 第 4 层：本地小时汇总
+        if version < 4:
+            hourly += rollups.hourly_rows(
+                user.id, application_id, s.session_start_time, s.session_end_time,
+                s.total_lifetime_seconds, s.total_focus_seconds, tz
+            )
+        # 第 5 层：窗口标题搜索索引
+        if version < 5:
+            unindexed.append(s.id)
+
+    if unindexed:
+        Activity = models.ServerFocusActivity
+        titles = db.execute(
+            select(Activity.window_title).distinct().where(Activity.session_id.in_(unindexed))
+        ).scalars().all()
+        title_index.index_titles(db, user.id, application_id, titles)
+    summary.total_wallclock_seconds = (summary.total_wallclock_seconds or 0) + wallclock_added
+    rollups.upsert_daily(db, daily)
+    rollups.upsert_hourly(db, hourly)
+    db.execute(
+        update(S)
+        .where(S.id.in_([s.id for s in sessions]))
+        .values(rollup_version=rollups.ROLLUP_VERSION)
+    )
+    cache.bump_data_version(db, user.id)
+    db.commit()
+    return len(sessions)
+
+
+def _pending_sessions_stmt(user_id: int, after_id: int):
+    S = models.ServerProcessSession
+    Summary = models.ServerAppUsageSummary
+    return select(S.id, Summary.id.label("summary_id"), Summary.application_id)\
+        .join(Summary, Summary.id == S.summary_id)\
+        .join(models.ServerWatchedApplication, models.ServerWatchedApplication.id == Summary.application_id)\
+        .where(models.ServerWatchedApplication.user_id == user_id)\
+        .where(S.rollup_version < rollups.ROLLUP_VERSION)\
+        .where(S.id > after_id)\
+        .order_by(S.id)
+
+
+def backfill_user(user_id: int, restart: bool = False) -> dict:
+    db = database.SessionLocal()
+    try:
+        user = db.get(models.User, user_id)
+        if user is None:
+            return {"user_id": user_id, "sessions": 0}
+        tz = rollups.get_zone(user.timezone)
+        after_id = 0 if restart else _load_checkpoint(db, user_id)
+        categorized_apps = _backfill_categories(db, user)
+
+        processed = 0
+        # 用独立连接上的服务器端游标流式读取待处理会话，写入走另一个会话并逐批提交
+        with database.engine.connect() as conn:
+            result = conn.execution_options(stream_results=True, yield_per=BACKFILL_CHUNK_SIZE)\
+                .execute(_pending_sessions_stmt(user_id, after_id))
+            if conn.dialect.name == "sqlite":
+                # SQLite（仅用于本地测试）的读事务会阻塞另一个连接提交，这里先读出全部 id 再分批
+                rows = result.all()
+                partitions = (rows[i:i + BACKFILL_CHUNK_SIZE] for i in range(0, len(rows), BACKFILL_CHUNK_SIZE))
+            else:
+                partitions = result.partitions()
+
+            for partition in partitions:
+                by_app = defaultdict(list)
+                for session_id, summary_id, application_id in partition:
+                    by_app[(application_id, summary_id)].append(session_id)
+                for (application_id, summary_id), session_ids in sorted(by_app.items()):
+                    processed += _backfill_app_sessions(db, user, tz, application_id, summary_id, session_ids)
+                _save_checkpoint(db, user_id, partition[-1][0])
+                logger.info(f"backfill: 用户 {user_id} 已处理到会话 {partition[-1][0]}，累计 {processed} 个")
+        _clear_checkpoint(db, user_id)
+        return {"user_id": user_id, "sessions": processed, "category_apps": categorized_apps}
+    finally:
+        db.close()
+
+
+# ---------- verify ----------
+
+def _sums_by_app(db: Session, query) -> Dict[int, tuple]:
+    return {row[0]: tuple(int(v or 0) for v in row[1:]) for row in query.all()}
+
+
+def verify_user(user_id: int) -> dict:
+    """
+    在一个事务中（MariaDB 默认的可重复读提供一致的快照）比对该用户每个应用的：
+    summary 总计 / 日汇总 / 小时汇总 与原始会话之和，真实运行时长与区间索引，分类汇总与焦点活动之和。
+    仍有未升级会话的应用只比对 summary，各汇总表的差异在 backfill 之后才有意义。
+    """
+    db = database.SessionLocal()
+    try:
+        App = models.ServerWatchedApplication
+        Summary = models.ServerAppUsageSummary
+        S = models.ServerProcessSession
+        Activity = models.ServerFocusActivity
+        Daily = models.ServerAppDailyUsage
+        Hourly = models.ServerAppHourlyUsage
+        CategoryDaily = models.ServerCategoryDailyUsage
+
+        raw = _sums_by_app(db, db.query(
+                Summary.application_id,
+                func.sum(S.total_lifetime_seconds),
+                func.sum(S.total_focus_seconds),
+                # 未升级到当前汇总版本的会话数
+                func.sum(case((S.rollup_version < rollups.ROLLUP_VERSION, 1), else_=0)),
+            )
+            .join(S, S.summary_id == Summary.id)
+            .join(App, App.id == Summary.application_id)
+            .filter(App.user_id == user_id)
+            .group_by(Summary.application_id))
+        summaries = _sums_by_app(db, db.query(
+                Summary.application_id,
+                Summary.total_lifetime_seconds,
+                Summary.total_focus_time_seconds,
+                Summary.total_wallclock_seconds,
+            )
+            .join(App, App.id == Summary.application_id)
+            .filter(App.user_id == user_id))
+        daily = _sums_by_app(db, db.query(
+                Daily.application_id,
+                func.sum(Daily.lifetime_seconds),
+                func.sum(Daily.focus_seconds),
+                func.sum(Daily.wallclock_seconds),
+            )
+            .filter(Daily.user_id == user_id)
+            .group_by(Daily.application_id))
+        hourly = _sums_by_app(db, db.query(
+                Hourly.application_id,
+                func.sum(Hourly.lifetime_seconds),
+                func.sum(Hourly.focus_seconds),
+            )
+            .filter(Hourly.user_id == user_id)
+            .group_by(Hourly.application_id))
+        category = _sums_by_app(db, db.query(
+                CategoryDaily.application_id,
+                func.sum(CategoryDaily.focus_seconds),
+            )
+            .filter(CategoryDaily.user_id == user_id)
+            .group_by(CategoryDaily.application_id))
+        activity = _sums_by_app(db, db.query(
+                Summary.application_id,
+                func.sum(Activity.focus_duration_seconds),
+            )
+            .join(S, S.summary_id == Summary.id)
+            .join(Activity, Activity.session_id == S.id)
+            .join(App, App.id == Summary.application_id)
+            .filter(App.user_id == user_id)
+            .group_by(Summary.application_id))
+
+        # 区间已合并、数量有限，直接在 Python 中求总长，避免依赖各数据库的时间差函数
+        covered = defaultdict(int)
+        for application_id, start, end in db.execute(
+            select(models.ServerAppInterval.application_id,
+                   models.ServerAppInterval.start_time,
+                   models.ServerAppInterval.end_time)
+            .join(App, App.id == models.ServerAppInterval.application_id)
+            .where(App.user_id == user_id)
+        ):
+            covered[application_id] += int((end - start).total_seconds())
+        db.rollback()
+
+        drift = []
+
+        def check(application_id, name, expected, actual):
+            if expected != actual:
+                drift.append({"application_id": application_id, "check": name,
+                              "expected": expected, "actual": actual})
+
+        pending_apps = 0
+        for application_id, (lifetime, focus, pending) in raw.items():
+            s_lifetime, s_focus, s_wallclock = summaries.get(application_id, (0, 0, 0))
+            check(application_id, "summary.lifetime", lifetime, s_lifetime)
+            check(application_id, "summary.focus", focus, s_focus)
+            if pending:
+                pending_apps += 1
+                continue
+            d_lifetime, d_focus, d_wallclock = daily.get(application_id, (0, 0, 0))
+            check(application_id, "daily.lifetime", lifetime, d_lifetime)
+            check(application_id, "daily.focus", focus, d_focus)
+            check(application_id, "hourly", (lifetime, focus), hourly.get(application_id, (0, 0)))
+            check(application_id, "summary.wallclock", covered.get(application_id, 0), s_wallclock)
+            check(application_id, "daily.wallclock", covered.get(application_id, 0), d_wallclock)
+            check(application_id, "category.focus", activity.get(application_id, (0,))[0],
+                  category.get(application_id, (0,))[0])
+
+        return {"user_id": user_id, "apps": len(raw), "pending_apps": pending_apps, "drift": drift}
+    finally:
+        db.close()
+
+
+# ---------- 入口 ----------
+
+def _run_shard(mode: str, user_ids: List[int], restart: bool) -> List[dict]:
+    results = []
+    for user_id in user_ids:
+        if mode == "backfill":
+            results.append(backfill_user(user_id, restart=restart))
+        else:
+            results.append(verify_user(user_id))
+    return results
+
+
+def _all_user_ids() -> List[int]:
+    db = database.SessionLocal()
+    try:
+        return db.execute(select(models.User.id).order_by(models.User.id)).scalars().all()
+    finally:
+        db.close()
+
+
+def run(mode: str, workers: int = 1, user_ids: Optional[List[int]] = None, restart: bool = False) -> List[dict]:
+    user_ids = user_ids or _all_user_ids()
+    workers = max(1, min(workers, len(user_ids) or 1))
+    if workers == 1:
+        return _run_shard(mode, user_ids, restart)
+
+    # 按 user_id 取模分片：同一用户只由一个进程处理，不同进程之间不会争用同一 summary 行锁
+    shards = [[uid for uid in user_ids if uid % workers == i] for i in range(workers)]
+    results = []
+    with ProcessPoolExecutor(max_workers=workers, mp_context=get_context("spawn")) as pool:
+        futures = [pool.submit(_run_shard, mode, shard, restart) for shard in shards if shard]
+        for future in as_completed(futures):
+            results.extend(future.result())
+    return sorted(results, key=lambda r: r["user_id"])
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m app.maintenance", description="汇总数据的补写与校验")
+    parser.add_argument("mode", choices=["backfill", "verify"])
+    parser.add_argument("--workers", type=int, default=1, help="并行的进程数")
+    parser.add_argument("--users", type=str, default=None, help="只处理这些用户，逗号分隔的 id")
+    parser.add_argument("--restart", action="store_true", help="backfill 时忽略断点，从头扫描")
+    args = parser.parse_args(argv)
+
+    models.Base.metadata.create_all(bind=database.engine)
+    migrations.run_startup_migrations(database.engine, models.Base.metadata)
+
+    user_ids = [int(x) for x in args.users.split(",") if x.strip()] if args.users else None
+    results = run(args.mode, workers=args.workers, user_ids=user_ids, restart=args.restart)
+
+    if args.mode == "backfill":
+        total = sum(r["sessions"] for r in results)
+        logger.info(f"backfill 完成：{len(results)} 个用户，补写 {total} 个会话")
+        return 0
+
+    drift_count = 0
+    for r in results:
+        for d in r["drift"]:
+            drift_count += 1
+            print(f"user={r['user_id']} app={d['application_id']} {d['check']}: "
+                  f"expected={d['expected']} actual={d['actual']}")
+        if r["pending_apps"]:
+            print(f"user={r['user_id']}: {r['pending_apps']} 个应用仍有未补写的会话，请先运行 backfill")
+    print(f"verify 完成：{len(results)} 个用户，{drift_count} 处不一致")
+    return 1 if drift_count else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
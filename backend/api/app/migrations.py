@@ -0,0 +1,62 @@
+from sqlalchemy import inspect, text, MetaData
+from sqlalchemy.engine import Engine
+
+from .logger import logger
+
+# create_all 只会创建缺失的表，不会给已存在的表补列。
+# 这里按 (表名, 列名, 列定义) 列出后来新增的列，启动时检查并补齐。
+ADDED_COLUMNS = [
+    ("users", "timezone", "VARCHAR(64) NOT NULL DEFAULT 'UTC'"),
+    ("server_process_sessions", "rollup_version", "INTEGER NOT NULL DEFAULT 0"),
+    ("server_app_usage_summary", "total_wallclock_seconds", "BIGINT NOT NULL DEFAULT 0"),
+    ("server_app_daily_usage", "wallclock_seconds", "BIGINT NOT NULL DEFAULT 0"),
+    ("server_process_sessions", "device_id", "INTEGER NULL"),
+    ("server_process_sessions", "client_session_id", "BIGINT NULL"),
+    ("users", "category_rules_version", "INTEGER NOT NULL DEFAULT 0"),
+    ("users", "data_version", "INTEGER NOT NULL DEFAULT 0"),
+    ("users", "last_write_at", "DATETIME NULL"),
+]
+
+
+def _create_missing_indexes(engine: Engine, metadata: MetaData) -> None:
+    """模型中声明、但已有表上还不存在的索引（按名称判断）在这里补建"""
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    for table in metadata.sorted_tables:
+        if table.name not in existing_tables or not table.indexes:
+            continue
+        existing = {ix["name"] for ix in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name in existing:
+                continue
+            try:
+                index.create(bind=engine)
+                # 限定方言的索引（ddl_if）在其他数据库上不会真正创建
+                if index.name in {ix["name"] for ix in inspect(engine).get_indexes(table.name)}:
+                    logger.info(f"数据库迁移: 已为 {table.name} 创建索引 {index.name}")
+            except Exception as e:
+                logger.warning(f"数据库迁移: 为 {table.name} 创建索引 {index.name} 失败: {e}")
+
+
+def run_startup_migrations(engine: Engine, metadata: MetaData) -> None:
+    """为已有的表补齐新增列和索引。多个 worker 同时启动时，失败的一方只记录日志。"""
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    columns_cache = {}
+
+    for table, column, ddl in ADDED_COLUMNS:
+        if table not in existing_tables:
+            continue
+        if table not in columns_cache:
+            columns_cache[table] = {c["name"] for c in inspector.get_columns(table)}
+        if column in columns_cache[table]:
+            continue
+        try:
+            with engine.begin() as conn:
+                conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+            columns_cache[table].add(column)
+            logger.info(f"数据库迁移: 已为 {table} 添加列 {column}")
+        except Exception as e:
+            logger.warning(f"数据库迁移: 为 {table} 添加列 {column} 失败（可能已被其他进程添加）: {e}")
+
+    _create_missing_indexes(engine, metadata)
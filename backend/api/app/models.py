@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, UniqueConstraint
+from sqlalchemy import Column, Integer, BigInteger, String, Text, Date, DateTime, ForeignKey, UniqueConstraint, Index
 from sqlalchemy.orm import relationship
 from .database import Base
 
@@ -9,9 +9,38 @@ class User(Base):
     username = Column(String(50), unique=True, index=True, nullable=False)
     email = Column(String(100), unique=True, index=True, nullable=True)
     hashed_password = Column(String(255), nullable=False)
+    # IANA 时区名（如 Asia/Shanghai），由客户端同步时上报，用于划分"今天""本周"
+    timezone = Column(String(64), nullable=False, default="UTC", server_default="UTC")
+    # 分类规则的版本号，每次增删改规则时加一，用于让各 worker 缓存的匹配器失效
+    category_rules_version = Column(Integer, nullable=False, default=0, server_default="0")
+    # 使用数据的版本号，每次写入汇总表（同步、删除等）时加一，用作仪表盘结果缓存的键
+    data_version = Column(Integer, nullable=False, default=0, server_default="0")
+    # 最近一次写入使用数据的时间（UTC），用于多个 worker 之间一致的"读自己的写"路由
+    last_write_at = Column(DateTime, nullable=True)
 
     # 关系：一个用户可以拥有多个"被监视的应用"
     watched_applications = relationship("ServerWatchedApplication", back_populates="owner", cascade="all, delete-orphan")
+    # 关系：一个用户可以在多台设备上运行客户端
+    devices = relationship("ServerDevice", back_populates="owner", cascade="all, delete-orphan")
+
+# 运行客户端的设备，每台设备维护一个已确认的高水位
+class ServerDevice(Base):
+    __tablename__ = "server_devices"
+    __table_args__ = (
+        UniqueConstraint('user_id', 'device_uid', name='uix_user_device_uid'),
+    )
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    # 客户端首次运行时生成的设备标识
+    device_uid = Column(String(64), nullable=False)
+    name = Column(String(255), nullable=True)
+    created_at = Column(DateTime, nullable=False)
+    last_seen_at = Column(DateTime, nullable=True)
+    # 服务器已确认收到的该设备最大的本地会话 id
+    last_client_session_id = Column(BigInteger, nullable=False, default=0)
+
+    owner = relationship("User", back_populates="devices")
 
 #被监视的应用 (顶层模型)
 class ServerWatchedApplication(Base):
@@ -45,6 +74,8 @@ class ServerAppUsageSummary(Base):
     last_seen_end_at = Column(DateTime, nullable=True)
     total_lifetime_seconds = Column(Integer, nullable=False, default=0)
     total_focus_time_seconds = Column(Integer, nullable=False, default=0)
+    # 真实运行时长：同一应用多个进程/多台设备重叠的时间段只计一次
+    total_wallclock_seconds = Column(BigInteger, nullable=False, default=0, server_default="0")
 
     # 关系
     application = relationship("ServerWatchedApplication", back_populates="summary")
@@ -53,16 +84,25 @@ class ServerAppUsageSummary(Base):
 #进程会话
 class ServerProcessSession(Base):
     __tablename__ = 'server_process_sessions'
+    __table_args__ = (
+        # 同一设备的同一本地会话只会被接收一次
+        Index('uix_session_device_client', 'device_id', 'client_session_id', unique=True),
+    )
     id = Column(Integer, primary_key=True)
 
     # 外键：关联到总账
     summary_id = Column(Integer, ForeignKey('server_app_usage_summary.id'), nullable=False, index=True)
+    # 来源设备及其本地会话 id（旧版客户端不上报，为空）
+    device_id = Column(Integer, ForeignKey('server_devices.id'), nullable=True)
+    client_session_id = Column(BigInteger, nullable=True)
 
     process_name = Column(String(255), nullable=False)
     session_start_time = Column(DateTime, nullable=False)
     session_end_time = Column(DateTime, nullable=False)
     total_lifetime_seconds = Column(Integer, nullable=False)
     total_focus_seconds = Column(Integer, nullable=False, default=0)
+    # 已写入汇总表的版本，低于 rollups.ROLLUP_VERSION 表示尚未汇总（需回填）
+    rollup_version = Column(Integer, nullable=False, default=0, server_default="0")
 
     # 关系
     summary = relationship("ServerAppUsageSummary", back_populates="sessions")
@@ -71,6 +111,12 @@ class ServerProcessSession(Base):
 #焦点活动
 class ServerFocusActivity(Base):
     __tablename__ = 'server_focus_activities'
+    __table_args__ = (
+        # 窗口标题全文检索，仅 MariaDB/MySQL 创建（SQLite 下搜索回退为 LIKE）
+        Index('ix_activity_title_fulltext', 'window_title', mysql_prefix='FULLTEXT').ddl_if(dialect='mysql'),
+        # 按 n-gram 索引查出的候选标题回到活动表做等值查找
+        Index('ix_activity_window_title', 'window_title', mysql_length=255),
+    )
     id = Column(Integer, primary_key=True)
 
     # 外键：关联到会话
@@ -81,3 +127,129 @@ class ServerFocusActivity(Base):
 
     # 关系
     session = relationship("ServerProcessSession", back_populates="activities")
+
+# 按用户本地日期划分的每日使用汇总（同步时写入，仪表盘按日期范围直接读取）
+class ServerAppDailyUsage(Base):
+    __tablename__ = 'server_app_daily_usage'
+    __table_args__ = (
+        UniqueConstraint('application_id', 'local_date', name='uix_daily_app_date'),
+        Index('ix_daily_user_date', 'user_id', 'local_date'),
+    )
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    application_id = Column(Integer, ForeignKey('server_watched_applications.id'), nullable=False)
+
+    local_date = Column(Date, nullable=False)
+    lifetime_seconds = Column(BigInteger, nullable=False, default=0)
+    focus_seconds = Column(BigInteger, nullable=False, default=0)
+    wallclock_seconds = Column(BigInteger, nullable=False, default=0, server_default="0")
+
+# 按用户本地小时划分的使用汇总，用于"星期 × 小时"热力图
+class ServerAppHourlyUsage(Base):
+    __tablename__ = 'server_app_hourly_usage'
+    __table_args__ = (
+        UniqueConstraint('application_id', 'local_hour', name='uix_hourly_app_hour'),
+        Index('ix_hourly_user_hour', 'user_id', 'local_hour'),
+    )
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    application_id = Column(Integer, ForeignKey('server_watched_applications.id'), nullable=False)
+
+    local_hour = Column(DateTime, nullable=False)   # 用户本地时间的整点（不带时区）
+    weekday = Column(Integer, nullable=False)       # 0 = 星期一
+    hour = Column(Integer, nullable=False)          # 0-23
+    lifetime_seconds = Column(BigInteger, nullable=False, default=0)
+    focus_seconds = Column(BigInteger, nullable=False, default=0)
+
+# 每个应用已被会话覆盖的时间段（互不重叠），用于增量计算真实运行时长
+class ServerAppInterval(Base):
+    __tablename__ = 'server_app_intervals'
+    __table_args__ = (
+        Index('ix_interval_app_end', 'application_id', 'end_time'),
+    )
+
+    id = Column(Integer, primary_key=True)
+    application_id = Column(Integer, ForeignKey('server_watched_applications.id'), nullable=False)
+    start_time = Column(DateTime, nullable=False)
+    end_time = Column(DateTime, nullable=False)
+
+# 每个应用出现过的窗口标题（去重），供 n-gram 索引引用
+class ServerWindowTitle(Base):
+    __tablename__ = 'server_window_titles'
+    __table_args__ = (
+        UniqueConstraint('application_id', 'title_hash', name='uix_window_title_app_hash'),
+    )
+
+    id = Column(Integer, primary_key=True)
+    application_id = Column(Integer, ForeignKey('server_watched_applications.id'), nullable=False)
+    title_hash = Column(String(40), nullable=False)  # 标题的 sha1，标题本身过长不适合做唯一索引
+    window_title = Column(String(1024), nullable=False)
+
+# 窗口标题的 2-gram 索引（小写），用于全文索引处理不了的中日韩文字和短词搜索
+class ServerTitleGram(Base):
+    __tablename__ = 'server_title_grams'
+    __table_args__ = (
+        Index('ix_title_gram_user_gram', 'user_id', 'gram', 'title_id'),
+    )
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    application_id = Column(Integer, ForeignKey('server_watched_applications.id'), nullable=False)
+    title_id = Column(Integer, ForeignKey('server_window_titles.id'), nullable=False)
+    gram = Column(String(2), nullable=False)
+
+# 用户定义的分类规则：可执行文件名和/或窗口标题正则匹配时，焦点时间计入该分类
+class ServerCategoryRule(Base):
+    __tablename__ = 'server_category_rules'
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    category = Column(String(64), nullable=False)
+    executable_name = Column(String(255), nullable=True)  # 不区分大小写的完整匹配
+    title_pattern = Column(String(512), nullable=True)    # 正则，不区分大小写，在标题中搜索
+    priority = Column(Integer, nullable=False, default=0)  # 数值小的优先
+    created_at = Column(DateTime, nullable=False)
+
+# 按分类、用户本地日期划分的专注时长（同步时按规则写入，规则变化后在后台重算）
+class ServerCategoryDailyUsage(Base):
+    __tablename__ = 'server_category_daily_usage'
+    __table_args__ = (
+        UniqueConstraint('application_id', 'category', 'local_date', name='uix_category_app_date'),
+        Index('ix_category_user_date', 'user_id', 'local_date'),
+    )
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    application_id = Column(Integer, ForeignKey('server_watched_applications.id'), nullable=False)
+    category = Column(String(64), nullable=False)  # 空字符串表示未分类
+    local_date = Column(Date, nullable=False)
+    focus_seconds = Column(BigInteger, nullable=False, default=0)
+
+# 后台任务（如批量删除）的状态与进度，存在数据库中以便多个 worker 都能查询
+class ServerJob(Base):
+    __tablename__ = 'server_jobs'
+
+    id = Column(String(32), primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    kind = Column(String(32), nullable=False)
+    status = Column(String(16), nullable=False)  # pending / running / done / failed
+    progress = Column(Text, nullable=True)       # JSON
+    error = Column(Text, nullable=True)
+    created_at = Column(DateTime, nullable=False)
+    updated_at = Column(DateTime, nullable=False)
+
+# 维护命令（python -m app.maintenance）的断点：每个用户已处理到的会话 id
+class ServerMaintenanceCheckpoint(Base):
+    __tablename__ = 'server_maintenance_checkpoints'
+    __table_args__ = (
+        UniqueConstraint('task', 'user_id', name='uix_checkpoint_task_user'),
+    )
+
+    id = Column(Integer, primary_key=True)
+    task = Column(String(32), nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    target_version = Column(Integer, nullable=False)  # 断点对应的 ROLLUP_VERSION，版本变化后从头开始
+    last_session_id = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, nullable=False)
@@ -0,0 +1,123 @@
+from typing import List
+
+from sqlalchemy import select, delete
+from sqlalchemy.orm import Session
+
+from . import models, cache
+from .logger import logger
+
+# 每批处理的会话数和焦点活动数。每批单独提交，单个事务持有的行锁和日志量都有上限
+SESSION_CHUNK_SIZE = 500
+ACTIVITY_CHUNK_SIZE = 5000
+ROLLUP_CHUNK_SIZE = 5000
+
+# 直接以 application_id 关联到应用的派生数据表（汇总、索引等），删除应用时一并按批清除
+APP_SCOPED_MODELS = [
+    models.ServerAppDailyUsage,
+    models.ServerAppHourlyUsage,
+    models.ServerAppInterval,
+    models.ServerCategoryDailyUsage,
+    # 片段引用标题，先删片段
+    models.ServerTitleGram,
+    models.ServerWindowTitle,
+]
+
+
+def _delete_activities_of_sessions(db: Session, session_ids: List[int]) -> int:
+    """按批删除这些会话下的焦点活动，单个会话有大量活动时也不会一次删除过多行"""
+    Activity = models.ServerFocusActivity
+    deleted = 0
+    while True:
+        ids = db.execute(
+            select(Activity.id)
+            .where(Activity.session_id.in_(session_ids))
+            .limit(ACTIVITY_CHUNK_SIZE)
+        ).scalars().all()
+        if not ids:
+            return deleted
+        db.execute(delete(Activity).where(Activity.id.in_(ids)))
+        db.commit()
+        deleted += len(ids)
+
+
+def _delete_by_application(db: Session, model, application_id: int) -> int:
+    deleted = 0
+    while True:
+        ids = db.execute(
+            select(model.id).where(model.application_id == application_id).limit(ROLLUP_CHUNK_SIZE)
+        ).scalars().all()
+        if not ids:
+            return deleted
+        db.execute(delete(model).where(model.id.in_(ids)))
+        db.commit()
+        deleted += len(ids)
+
+
+def purge_application(db: Session, application_id: int, reporter=None) -> dict:
+    """
+    删除一个应用及其全部历史数据。
+    不使用 ORM 级联（会把所有子行加载到内存），而是按批执行基于集合的 DELETE：
+    先分批删除焦点活动和会话、再删除派生数据，每批单独提交；
+    最后在一个短事务中锁定 summary，清理期间新同步进来的少量会话，再删除 summary 和应用本身。
+    """
+    Session_ = models.ServerProcessSession
+    counts = {"sessions": 0, "activities": 0, "derived_rows": 0}
+
+    summary_id = db.execute(
+        select(models.ServerAppUsageSummary.id)
+        .where(models.ServerAppUsageSummary.application_id == application_id)
+    ).scalar()
+
+    if summary_id is not None:
+        while True:
+            session_ids = db.execute(
+                select(Session_.id)
+                .where(Session_.summary_id == summary_id)
+                .order_by(Session_.id)
+                .limit(SESSION_CHUNK_SIZE)
+            ).scalars().all()
+            if not session_ids:
+                break
+            counts["activities"] += _delete_activities_of_sessions(db, session_ids)
+            db.execute(delete(Session_).where(Session_.id.in_(session_ids)))
+            db.commit()
+            counts["sessions"] += len(session_ids)
+            if reporter is not None:
+                reporter.update(
+                    current_application_id=application_id,
+                    current_sessions=counts["sessions"],
+                    current_activities=counts["activities"],
+                )
+
+    for model in APP_SCOPED_MODELS:
+        counts["derived_rows"] += _delete_by_application(db, model, application_id)
+
+    # 收尾：持有 summary 行锁（与同步写入使用同一把锁），删除剩余数据和应用本身
+    db.execute(
+        select(models.ServerAppUsageSummary.id)
+        .where(models.ServerAppUsageSummary.application_id == application_id)
+        .with_for_update()
+    ).all()
+    if summary_id is not None:
+        remaining = select(Session_.id).where(Session_.summary_id == summary_id).scalar_subquery()
+        counts["activities"] += db.execute(
+            delete(models.ServerFocusActivity).where(models.ServerFocusActivity.session_id.in_(remaining))
+        ).rowcount or 0
+        counts["sessions"] += db.execute(
+            delete(Session_).where(Session_.summary_id == summary_id)
+        ).rowcount or 0
+    for model in APP_SCOPED_MODELS:
+        counts["derived_rows"] += db.execute(
+            delete(model).where(model.application_id == application_id)
+        ).rowcount or 0
+    user_id = db.execute(
+        select(models.ServerWatchedApplication.user_id).where(models.ServerWatchedApplication.id == application_id)
+    ).scalar()
+    if user_id is not None:
+        cache.bump_data_version(db, user_id)
+    db.execute(delete(models.ServerAppUsageSummary).where(models.ServerAppUsageSummary.application_id == application_id))
+    db.execute(delete(models.ServerWatchedApplication).where(models.ServerWatchedApplication.id == application_id))
+    db.commit()
+
+    logger.info(f"已删除应用 {application_id}: {counts}")
+    return counts
@@ -0,0 +1,165 @@
+import os
+import math
+import time
+import sqlite3
+import threading
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+from fastapi import HTTPException, status
+
+from .logger import logger
+
+# 同步接口的准入控制参数，均可通过环境变量调整
+SYNC_REQUESTS_PER_MINUTE = int(os.getenv("SYNC_REQUESTS_PER_MINUTE", "30"))
+SYNC_SESSIONS_PER_HOUR = int(os.getenv("SYNC_SESSIONS_PER_HOUR", "20000"))
+SYNC_MAX_BODY_BYTES = int(os.getenv("SYNC_MAX_BODY_BYTES", str(8 * 1024 * 1024)))
+# 多 worker 部署时设置此路径，令牌桶状态将保存在共享的 SQLite 文件中
+RATE_LIMIT_STATE_PATH = os.getenv("RATE_LIMIT_STATE_PATH")
+
+
+@dataclass(frozen=True)
+class TokenBucket:
+    """令牌桶参数：容量 capacity，每 period 秒补满一次"""
+    name: str
+    capacity: float
+    period_seconds: float
+
+    @property
+    def refill_per_second(self) -> float:
+        return self.capacity / self.period_seconds
+
+    def take(self, tokens: float, updated_at: float, now: float, cost: float) -> Tuple[bool, float, float]:
+        """
+        根据上次的状态计算本次能否扣除 cost 个令牌。
+        返回 (是否放行, 新的令牌数, 需要等待的秒数)。
+        """
+        tokens = min(self.capacity, tokens + (now - updated_at) * self.refill_per_second)
+        if tokens >= cost:
+            return True, tokens - cost, 0.0
+        return False, tokens, (cost - tokens) / self.refill_per_second
+
+
+class InMemoryBucketStore:
+    """进程内令牌桶状态，适用于单 worker 部署"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._state = {}
+
+    def consume(self, items: List[Tuple[str, TokenBucket, float]], now: float) -> Tuple[bool, float]:
+        """items 为 [(键, 令牌桶, 扣除数)]：全部放行时才一起扣除，否则都不扣，返回最长的等待秒数"""
+        with self._lock:
+            states = [self._state.get(key, (bucket.capacity, now)) for key, bucket, _ in items]
+            allowed, new_tokens, retry_after = _take_all(items, states, now)
+            for (key, _, _), tokens in zip(items, new_tokens):
+                self._state[key] = (tokens, now)
+            return allowed, retry_after
+
+
+class SQLiteBucketStore:
+    """
+    基于 SQLite 文件的共享令牌桶状态，多个 uvicorn worker 共用同一个文件。
+    每次扣减都在 BEGIN IMMEDIATE 事务中完成，保证跨进程的原子性。
+    """
+
+    def __init__(self, path: str):
+        self._path = path
+        self._local = threading.local()
+        conn = self._connect()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS rate_limit_buckets ("
+            "key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL)"
+        )
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self._path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def consume(self, items: List[Tuple[str, TokenBucket, float]], now: float) -> Tuple[bool, float]:
+        """同 InMemoryBucketStore.consume，几个桶在同一个事务中检查和扣除"""
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            states = []
+            for key, bucket, _ in items:
+                row = conn.execute(
+                    "SELECT tokens, updated_at FROM rate_limit_buckets WHERE key = ?", (key,)
+                ).fetchone()
+                states.append(row if row else (bucket.capacity, now))
+            allowed, new_tokens, retry_after = _take_all(items, states, now)
+            conn.executemany(
+                "INSERT OR REPLACE INTO rate_limit_buckets (key, tokens, updated_at) VALUES (?, ?, ?)",
+                [(key, tokens, now) for (key, _, _), tokens in zip(items, new_tokens)],
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return allowed, retry_after
+
+
+def _take_all(items, states, now: float) -> Tuple[bool, List[float], float]:
+    """
+    对每个桶计算补充后的令牌数和能否扣除。全部能扣除时返回扣除后的令牌数；
+    任一不足时一个也不扣（只记录补充后的令牌数），被拒绝的请求不消耗其他桶的配额
+    """
+    results = [
+        bucket.take(tokens, updated_at, now, cost)
+        for (_, bucket, cost), (tokens, updated_at) in zip(items, states)
+    ]
+    if all(allowed for allowed, _, _ in results):
+        return True, [tokens for _, tokens, _ in results], 0.0
+    refilled = [tokens + (cost if allowed else 0) for (_, _, cost), (allowed, tokens, _) in zip(items, results)]
+    return False, refilled, max(retry_after for _, _, retry_after in results)
+
+
+class IngestRateLimiter:
+    """按用户 id 限制同步接口的请求频率与每小时会话总数"""
+
+    def __init__(self, store, requests_per_minute: int, sessions_per_hour: int):
+        self._store = store
+        self.request_bucket = TokenBucket("requests", requests_per_minute, 60)
+        self.session_bucket = TokenBucket("sessions", sessions_per_hour, 3600)
+
+    def check(self, user_id: int, session_count: int) -> None:
+        """超过限额时抛出带 Retry-After 头的 HTTPException"""
+        if session_count > self.session_bucket.capacity:
+            # 单次请求超过整个小时的配额，等待也不可能放行，让客户端拆分批次
+            raise HTTPException(
+                status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                detail=f"单次同步的会话数过多 ({session_count})，请拆分后重试",
+            )
+
+        items = [
+            (f"{bucket.name}:{user_id}", bucket, cost)
+            for bucket, cost in ((self.request_bucket, 1), (self.session_bucket, session_count))
+            if cost > 0
+        ]
+        allowed, retry_after = self._store.consume(items, time.time())
+        if not allowed:
+            retry_seconds = max(1, math.ceil(retry_after))
+            logger.warning(f"用户 {user_id} 触发同步限流，{retry_seconds} 秒后可重试。")
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="同步请求过于频繁，请稍后重试",
+                headers={"Retry-After": str(retry_seconds)},
+            )
+
+
+def _create_store(path: Optional[str]):
+    if path:
+        logger.info(f"同步限流使用共享状态文件: {path}")
+        return SQLiteBucketStore(path)
+    return InMemoryBucketStore()
+
+
+ingest_limiter = IngestRateLimiter(
+    _create_store(RATE_LIMIT_STATE_PATH),
+    requests_per_minute=SYNC_REQUESTS_PER_MINUTE,
+    sessions_per_hour=SYNC_SESSIONS_PER_HOUR,
+)
@@ -0,0 +1,133 @@
+import json
+import zlib
+
+from fastapi import HTTPException, status
+
+from .logger import logger
+
+
+class _BodyTooLarge(HTTPException):
+    def __init__(self):
+        super().__init__(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail="同步数据过大，请拆分后重试")
+
+
+class BodySizeLimitMiddleware:
+    """
+    限制 path_prefix 下请求体的大小：有 Content-Length 时在读取前直接拒绝；
+    没有（分块传输）或不可信时，按实际读到的字节数累计，超过 max_bytes 即中止并返回 413
+    """
+
+    def __init__(self, app, max_bytes: int, path_prefix: str):
+        self.app = app
+        self.max_bytes = max_bytes
+        self.path_prefix = path_prefix
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith(self.path_prefix):
+            await self.app(scope, receive, send)
+            return
+        content_length = next((v for k, v in scope["headers"] if k == b"content-length"), b"")
+        if content_length.isdigit() and int(content_length) > self.max_bytes:
+            logger.warning(f"拒绝过大的请求: {scope['path']} {int(content_length)} 字节 (上限 {self.max_bytes})")
+            await _send_error(send, 413, "同步数据过大，请拆分后重试")
+            return
+
+        size = 0
+        started = False
+
+        async def limited_receive():
+            nonlocal size
+            message = await receive()
+            if message["type"] == "http.request":
+                size += len(message.get("body", b""))
+                if size > self.max_bytes:
+                    logger.warning(f"拒绝过大的请求: {scope['path']} 已读取 {size} 字节 (上限 {self.max_bytes})")
+                    raise _BodyTooLarge()
+            return message
+
+        async def tracking_send(message):
+            nonlocal started
+            if message["type"] == "http.response.start":
+                started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, tracking_send)
+        except _BodyTooLarge:
+            # 在路由之外读取请求体（例如解压中间件）时异常不会被 FastAPI 转成响应，这里补发
+            if started:
+                raise
+            await _send_error(send, 413, "同步数据过大，请拆分后重试")
+
+
+class GzipRequestMiddleware:
+    """
+    解压 path_prefix 下 Content-Encoding: gzip 的请求体（客户端上传较大的同步数据时会压缩）。
+    请求体整个解压到内存，解压后的大小不超过 max_bytes，超过时返回 413，防止压缩炸弹；
+    下游看到的是普通请求：去掉 Content-Encoding，Content-Length 改为解压后的长度。
+    其他路径原样放行，例如导入接口边接收边写入临时文件，gzip 文件由导入任务自己解压，不受这里的上限约束。
+    """
+
+    def __init__(self, app, max_bytes: int, path_prefix: str):
+        self.app = app
+        self.max_bytes = max_bytes
+        self.path_prefix = path_prefix
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith(self.path_prefix):
+            await self.app(scope, receive, send)
+            return
+        headers = [(k, v) for k, v in scope["headers"]]
+        encoding = next((v for k, v in headers if k == b"content-encoding"), None)
+        if encoding is None or encoding.strip().lower() != b"gzip":
+            await self.app(scope, receive, send)
+            return
+
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        chunks, size = [], 0
+        try:
+            more_body = True
+            while more_body:
+                message = await receive()
+                if message["type"] == "http.disconnect":
+                    return
+                more_body = message.get("more_body", False)
+                chunk = decompressor.decompress(message.get("body", b""), self.max_bytes + 1 - size)
+                size += len(chunk)
+                if size > self.max_bytes or decompressor.unconsumed_tail:
+                    logger.warning(f"拒绝解压后过大的请求: {scope['path']} (上限 {self.max_bytes} 字节)")
+                    await _send_error(send, 413, "请求数据解压后过大，请拆分后重试")
+                    return
+                chunks.append(chunk)
+            if not decompressor.eof:
+                raise zlib.error("gzip 数据不完整")
+        except zlib.error as e:
+            await _send_error(send, 400, f"gzip 请求体无效: {e}")
+            return
+
+        body = b"".join(chunks)
+        scope = dict(scope)
+        scope["headers"] = [
+            (k, v) for k, v in headers if k not in (b"content-encoding", b"content-length")
+        ] + [(b"content-length", str(len(body)).encode())]
+
+        sent = False
+
+        async def receive_decompressed():
+            nonlocal sent
+            if sent:
+                return await receive()
+            sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        await self.app(scope, receive_decompressed, send)
+
+
+async def _send_error(send, status_code: int, detail: str) -> None:
+    payload = json.dumps({"detail": detail}, ensure_ascii=False).encode()
+    await send({
+        "type": "http.response.start",
+        "status": status_code,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(payload)).encode())],
+    })
+    await send({"type": "http.response.body", "body": payload})
@@ -0,0 +1,252 @@
+from collections import defaultdict
+from datetime import datetime, date, time, timedelta, timezone
+from typing import List, Tuple
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from sqlalchemy.orm import Session
+
+from . import models
+
+# 会话写入汇总表的版本号，ServerProcessSession.rollup_version 低于此值的会话尚未完整汇总
+#   1: 日汇总表的运行/专注时长
+#   2: 应用区间索引与真实运行时长 (wallclock)
+#   3: 按分类的日汇总表
+#   4: 按本地小时的汇总表（热力图）
+#   5: 窗口标题的 2-gram 搜索索引（title_index）
+ROLLUP_VERSION = 5
+DEFAULT_TIMEZONE = "UTC"
+
+
+def is_valid_timezone(name: str) -> bool:
+    if not name:
+        return False
+    try:
+        ZoneInfo(name)
+        return True
+    except (ZoneInfoNotFoundError, ValueError):
+        return False
+
+
+def get_zone(name: str) -> ZoneInfo:
+    """根据 IANA 时区名获取时区，无效时回退到 UTC"""
+    return ZoneInfo(name) if is_valid_timezone(name) else ZoneInfo(DEFAULT_TIMEZONE)
+
+
+def to_utc_naive(dt: datetime, tz: ZoneInfo) -> datetime:
+    """
+    统一转换为去掉时区信息的 UTC 时间（数据库中的存储形式）。
+    不带时区的时间视为用户本地时间（旧版客户端发送的就是本地时间）。
+    数据库 DATETIME 只精确到秒，这里同样舍去微秒，保证区间计算与存储一致。
+    """
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=tz)
+    return dt.astimezone(timezone.utc).replace(tzinfo=None, microsecond=0)
+
+
+def local_day_start_utc(day: date, tz: ZoneInfo) -> datetime:
+    """用户本地某一天 00:00 对应的 UTC 时间（naive）"""
+    return datetime.combine(day, time.min, tzinfo=tz).astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def local_today(tz: ZoneInfo) -> date:
+    return datetime.now(tz).date()
+
+
+def local_date_of(utc_naive: datetime, tz: ZoneInfo) -> date:
+    return utc_naive.replace(tzinfo=timezone.utc).astimezone(tz).date()
+
+
+def split_by_local_day(start_utc: datetime, end_utc: datetime, tz: ZoneInfo) -> List[Tuple[date, float]]:
+    """把 [start, end) 按用户本地日期切分，返回 [(本地日期, 秒数), ...]"""
+    day = local_date_of(start_utc, tz)
+    pieces = []
+    cursor = start_utc
+    while cursor < end_utc:
+        next_day = day + timedelta(days=1)
+        piece_end = min(end_utc, local_day_start_utc(next_day, tz))
+        pieces.append((day, (piece_end - cursor).total_seconds()))
+        cursor = piece_end
+        day = next_day
+    # 零时长的会话仍归属于开始那一天
+    return pieces or [(day, 0.0)]
+
+
+def split_by_local_hour(start_utc: datetime, end_utc: datetime, tz: ZoneInfo) -> List[Tuple[datetime, float]]:
+    """把 [start, end) 按用户本地整点切分，返回 [(本地整点 naive, 秒数), ...]，各段秒数之和精确等于总时长"""
+    pieces = []
+    cursor = start_utc
+    while cursor < end_utc:
+        local = cursor.replace(tzinfo=timezone.utc).astimezone(tz)
+        hour_start = local.replace(minute=0, second=0, microsecond=0)
+        # 在 UTC 上加一小时得到下一个本地整点，半小时时区和夏令时切换也能正确处理
+        next_boundary = (hour_start.astimezone(timezone.utc) + timedelta(hours=1)).replace(tzinfo=None)
+        piece_end = min(end_utc, next_boundary)
+        pieces.append((hour_start.replace(tzinfo=None, fold=0), (piece_end - cursor).total_seconds()))
+        cursor = piece_end
+    if not pieces:
+        local = start_utc.replace(tzinfo=timezone.utc).astimezone(tz)
+        pieces.append((local.replace(minute=0, second=0, microsecond=0, tzinfo=None), 0.0))
+    return pieces
+
+
+def allocate(total: int, weights: List[float]) -> List[int]:
+    """按权重把整数 total 分摊到各段，最大余数法保证各段之和恰好等于 total"""
+    if not weights:
+        return []
+    weight_sum = sum(weights)
+    if weight_sum <= 0:
+        return [total] + [0] * (len(weights) - 1)
+    exact = [total * w / weight_sum for w in weights]
+    shares = [int(x) for x in exact]
+    remainder = total - sum(shares)
+    by_fraction = sorted(range(len(weights)), key=lambda i: exact[i] - shares[i], reverse=True)
+    for i in by_fraction[:remainder]:
+        shares[i] += 1
+    return shares
+
+
+def upsert_increment(db: Session, model, rows: List[dict], key_columns: List[str], increment_columns: List[str]) -> None:
+    """
+    批量 "插入或累加"：唯一键冲突时把 increment_columns 加到已有行上。
+    生产环境为 MariaDB (ON DUPLICATE KEY UPDATE)，本地测试可使用 SQLite (ON CONFLICT)。
+    """
+    if not rows:
+        return
+    table = model.__table__
+    if db.get_bind().dialect.name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+        stmt = insert(table).values(rows)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=key_columns,
+            set_={c: table.c[c] + stmt.excluded[c] for c in increment_columns},
+        )
+    else:
+        from sqlalchemy.dialects.mysql import insert
+        stmt = insert(table).values(rows)
+        stmt = stmt.on_duplicate_key_update({c: table.c[c] + stmt.inserted[c] for c in increment_columns})
+    db.execute(stmt)
+
+
+def merge_rows(rows: List[dict], key_columns: List[str], increment_columns: List[str]) -> List[dict]:
+    """合并同一批中键相同的增量行，减少批量 upsert 的行数"""
+    merged = {}
+    for row in rows:
+        key = tuple(row[c] for c in key_columns)
+        if key in merged:
+            for c in increment_columns:
+                merged[key][c] += row[c]
+        else:
+            merged[key] = dict(row)
+    return list(merged.values())
+
+
+def daily_rows(
+    user_id: int,
+    application_id: int,
+    start_utc: datetime,
+    end_utc: datetime,
+    lifetime_seconds: int,
+    focus_seconds: int,
+    tz: ZoneInfo,
+    wallclock_pieces: List[Tuple[datetime, datetime]] = (),
+) -> List[dict]:
+    """
+    一个会话在按用户本地日期划分的日汇总表中的增量。
+    跨越本地午夜的会话按各天实际占用的时长比例分摊运行时长与专注时长
+    （焦点活动没有时间戳，只能按比例分摊）。
+    wallclock_pieces 是该会话中此前未被同应用其他会话覆盖的时间段，按实际日期精确计入。
+    """
+    pieces = split_by_local_day(start_utc, end_utc, tz)
+    weights = [seconds for _, seconds in pieces]
+    lifetime_shares = allocate(lifetime_seconds, weights)
+    focus_shares = allocate(focus_seconds, weights)
+
+    wallclock_by_day = defaultdict(float)
+    for piece_start, piece_end in wallclock_pieces:
+        for day, seconds in split_by_local_day(piece_start, piece_end, tz):
+            wallclock_by_day[day] += seconds
+
+    # wallclock 片段一定落在会话的时间范围内，因此日期集合与 pieces 相同
+    return [
+        {
+            "user_id": user_id,
+            "application_id": application_id,
+            "local_date": day,
+            "lifetime_seconds": lifetime,
+            "focus_seconds": focus,
+            "wallclock_seconds": int(wallclock_by_day.get(day, 0)),
+        }
+        for (day, _), lifetime, focus in zip(pieces, lifetime_shares, focus_shares)
+    ]
+
+
+def hourly_rows(
+    user_id: int,
+    application_id: int,
+    start_utc: datetime,
+    end_utc: datetime,
+    lifetime_seconds: int,
+    focus_seconds: int,
+    tz: ZoneInfo,
+) -> List[dict]:
+    """同样按比例分摊到本地各小时（同一本地小时在夏令时回拨时会出现两次，合并为一行）"""
+    hourly = defaultdict(lambda: [0, 0])
+    hour_pieces = split_by_local_hour(start_utc, end_utc, tz)
+    hour_weights = [seconds for _, seconds in hour_pieces]
+    for (local_hour, seconds), lifetime, focus in zip(
+        hour_pieces, allocate(lifetime_seconds, hour_weights), allocate(focus_seconds, hour_weights)
+    ):
+        hourly[local_hour][0] += lifetime
+        hourly[local_hour][1] += focus
+    return [
+        {
+            "user_id": user_id,
+            "application_id": application_id,
+            "local_hour": local_hour,
+            "weekday": local_hour.weekday(),
+            "hour": local_hour.hour,
+            "lifetime_seconds": lifetime,
+            "focus_seconds": focus,
+        }
+        for local_hour, (lifetime, focus) in hourly.items()
+    ]
+
+
+def upsert_daily(db: Session, rows: List[dict]) -> None:
+    upsert_increment(
+        db,
+        models.ServerAppDailyUsage,
+        merge_rows(rows, ["application_id", "local_date"], ["lifetime_seconds", "focus_seconds", "wallclock_seconds"]),
+        key_columns=["application_id", "local_date"],
+        increment_columns=["lifetime_seconds", "focus_seconds", "wallclock_seconds"],
+    )
+
+
+def upsert_hourly(db: Session, rows: List[dict]) -> None:
+    upsert_increment(
+        db,
+        models.ServerAppHourlyUsage,
+        merge_rows(rows, ["application_id", "local_hour"], ["lifetime_seconds", "focus_seconds"]),
+        key_columns=["application_id", "local_hour"],
+        increment_columns=["lifetime_seconds", "focus_seconds"],
+    )
+
+
+def apply_session_rollups(
+    db: Session,
+    user_id: int,
+    application_id: int,
+    start_utc: datetime,
+    end_utc: datetime,
+    lifetime_seconds: int,
+    focus_seconds: int,
+    tz: ZoneInfo,
+    wallclock_pieces: List[Tuple[datetime, datetime]] = (),
+) -> None:
+    """把一个会话累加进日汇总表和小时汇总表"""
+    upsert_daily(db, daily_rows(
+        user_id, application_id, start_utc, end_utc, lifetime_seconds, focus_seconds, tz, wallclock_pieces
+    ))
+    upsert_hourly(db, hourly_rows(
+        user_id, application_id, start_utc, end_utc, lifetime_seconds, focus_seconds, tz
+    ))
@@ -0,0 +1,73 @@
+from typing import List
+
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, status
+from sqlalchemy.orm import Session
+
+from .. import database, models, auth, schemas, jobs, purge
+
+router = APIRouter(
+    prefix="/apps",
+    tags=["Apps"]
+)
+
+
+def _purge_applications(application_ids: List[int]):
+    """返回在后台执行的任务函数：依次删除各个应用，并报告整体进度"""
+    def run(reporter: jobs.JobReporter):
+        db = database.SessionLocal()
+        try:
+            totals = {"sessions": 0, "activities": 0, "derived_rows": 0}
+            reporter.update(applications_total=len(application_ids), applications_done=0, **totals)
+            for done, application_id in enumerate(application_ids, start=1):
+                counts = purge.purge_application(db, application_id, reporter=reporter)
+                for key in totals:
+                    totals[key] += counts[key]
+                reporter.update(applications_done=done, **totals)
+        finally:
+            db.close()
+    return run
+
+
+def _start_purge_job(db: Session, background_tasks: BackgroundTasks, user_id: int, application_ids: List[int]):
+    job = jobs.create_job(db, user_id, "purge_apps", progress={"application_ids": application_ids})
+    background_tasks.add_task(jobs.run_job, job.id, _purge_applications(application_ids))
+    return jobs.job_to_dict(job)
+
+
+@router.delete("/{app_id}", response_model=schemas.JobStatus, status_code=status.HTTP_202_ACCEPTED)
+def delete_app(
+    app_id: int,
+    background_tasks: BackgroundTasks,
+    db: Session = Depends(database.get_db),
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    """删除一个应用及其全部服务器端历史数据（后台分批执行，通过 /jobs/{id} 查询进度）"""
+    exists = db.query(models.ServerWatchedApplication.id)\
+        .filter(models.ServerWatchedApplication.id == app_id)\
+        .filter(models.ServerWatchedApplication.user_id == current_user.id)\
+        .first()
+    if not exists:
+        raise HTTPException(status_code=404, detail="应用不存在")
+    return _start_purge_job(db, background_tasks, current_user.id, [app_id])
+
+
+@router.post("/purge", response_model=schemas.JobStatus, status_code=status.HTTP_202_ACCEPTED)
+def purge_apps(
+    request: schemas.PurgeRequest,
+    background_tasks: BackgroundTasks,
+    db: Session = Depends(database.get_db),
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    """批量删除多个应用（按 id、按可执行文件路径，或当前用户的全部应用）"""
+    if not (request.all or request.application_ids or request.executable_paths):
+        raise HTTPException(status_code=400, detail="请指定要删除的应用")
+
+    query = db.query(models.ServerWatchedApplication.id)\
+        .filter(models.ServerWatchedApplication.user_id == current_user.id)
+    if not request.all:
+        query = query.filter(
+            models.ServerWatchedApplication.id.in_(request.application_ids)
+            | models.ServerWatchedApplication.executable_path.in_(request.executable_paths)
+        )
+    application_ids = [row[0] for row in query.order_by(models.ServerWatchedApplication.id).all()]
+    return _start_purge_job(db, background_tasks, current_user.id, application_ids)
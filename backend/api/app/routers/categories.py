@@ -0,0 +1,117 @@
+from datetime import datetime, timezone
+from typing import List, Optional
+
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, status
+from sqlalchemy.orm import Session
+
+from .. import database, models, auth, schemas, jobs, categories
+
+router = APIRouter(
+    prefix="/categories",
+    tags=["Categories"]
+)
+
+
+def _validate_rule(rule: schemas.CategoryRuleCreate):
+    if not rule.executable_name and not rule.title_pattern:
+        raise HTTPException(status_code=400, detail="executable_name 和 title_pattern 至少需要填写一个")
+    if rule.title_pattern:
+        reason = categories.validate_title_pattern(rule.title_pattern)
+        if reason:
+            raise HTTPException(status_code=400, detail=reason)
+
+
+def _affected_executables(*rules) -> Optional[set]:
+    """规则修改前后都限定了可执行文件时，只需重算这些应用；否则（涉及只按标题匹配的规则）重算全部"""
+    names = set()
+    for rule in rules:
+        if rule is None:
+            continue
+        if not rule.executable_name:
+            return None
+        names.add(rule.executable_name.lower())
+    return names
+
+
+def _rules_changed(db: Session, background_tasks: BackgroundTasks, user: models.User, affected: Optional[set]) -> str:
+    """规则修改后：递增版本号使各处缓存的匹配器失效，提交，并启动后台重算"""
+    categories.bump_rules_version(db, user)
+    version = user.category_rules_version
+    db.commit()
+    job = jobs.create_job(db, user.id, "recategorize", progress={
+        "rules_version": version,
+        "executables": sorted(affected) if affected is not None else None,
+    })
+    background_tasks.add_task(jobs.run_job, job.id, categories.recategorize_user(user.id, affected, version))
+    return job.id
+
+
+def _get_rule(db: Session, user: models.User, rule_id: int) -> models.ServerCategoryRule:
+    rule = db.query(models.ServerCategoryRule)\
+        .filter(models.ServerCategoryRule.id == rule_id)\
+        .filter(models.ServerCategoryRule.user_id == user.id)\
+        .first()
+    if rule is None:
+        raise HTTPException(status_code=404, detail="规则不存在")
+    return rule
+
+
+@router.get("/rules", response_model=List[schemas.CategoryRule])
+def list_rules(
+    db: Session = Depends(database.get_db),
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    """按优先级列出当前用户的分类规则"""
+    return categories.load_rules(db, current_user.id)
+
+
+@router.post("/rules", response_model=schemas.CategoryRuleChange, status_code=status.HTTP_201_CREATED)
+def create_rule(
+    rule_in: schemas.CategoryRuleCreate,
+    background_tasks: BackgroundTasks,
+    db: Session = Depends(database.get_db),
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    _validate_rule(rule_in)
+    rule = models.ServerCategoryRule(
+        user_id=current_user.id,
+        created_at=datetime.now(timezone.utc).replace(tzinfo=None),
+        **rule_in.model_dump()
+    )
+    db.add(rule)
+    db.flush()
+    job_id = _rules_changed(db, background_tasks, current_user, _affected_executables(rule))
+    return {"rule": rule, "recategorize_job_id": job_id}
+
+
+@router.put("/rules/{rule_id}", response_model=schemas.CategoryRuleChange)
+def update_rule(
+    rule_id: int,
+    rule_in: schemas.CategoryRuleCreate,
+    background_tasks: BackgroundTasks,
+    db: Session = Depends(database.get_db),
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    _validate_rule(rule_in)
+    rule = _get_rule(db, current_user, rule_id)
+    affected = _affected_executables(rule, rule_in)
+    for field, value in rule_in.model_dump().items():
+        setattr(rule, field, value)
+    db.flush()
+    job_id = _rules_changed(db, background_tasks, current_user, affected)
+    return {"rule": rule, "recategorize_job_id": job_id}
+
+
+@router.delete("/rules/{rule_id}", response_model=schemas.CategoryRuleChange)
+def delete_rule(
+    rule_id: int,
+    background_tasks: BackgroundTasks,
+    db: Session = Depends(database.get_db),
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    rule = _get_rule(db, current_user, rule_id)
+    affected = _affected_executables(rule)
+    db.delete(rule)
+    db.flush()
+    job_id = _rules_changed(db, background_tasks, current_user, affected)
+    return {"rule": None, "recategorize_job_id": job_id}
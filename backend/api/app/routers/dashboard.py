@@ -1,10 +1,13 @@
-from fastapi import APIRouter, Depends, HTTPException
+import asyncio
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from starlette.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
-from sqlalchemy import func, desc
+from sqlalchemy import func, desc, case, or_
 from datetime import datetime, date, timedelta
-from typing import List
+from typing import List, Optional
 
-from .. import database, models, auth, schemas
+from .. import database, models, auth, schemas, rollups, cache
 
 router = APIRouter(
     prefix="/dashboard",
@@ -13,17 +16,18 @@ router = APIRouter(
 
 @router.get("/stats")
 def get_dashboard_stats(
-    db: Session = Depends(database.get_db),
+    db: Session = Depends(database.get_read_db),
     current_user: models.User = Depends(auth.get_current_user)
 ):
     """获取仪表盘顶部的统计卡片数据"""
-    today_start = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
-    
-    today_focus_seconds = db.query(func.sum(models.ServerProcessSession.total_focus_seconds))\
-        .join(models.ServerAppUsageSummary)\
-        .join(models.ServerWatchedApplication)\
-        .filter(models.ServerWatchedApplication.user_id == current_user.id)\
-        .filter(models.ServerProcessSession.session_start_time >= today_start)\
+    # "今天""本周"按用户所在时区划分，直接读取按本地日期汇总好的日汇总表
+    user_tz = rollups.get_zone(current_user.timezone)
+    today = rollups.local_today(user_tz)
+    Daily = models.ServerAppDailyUsage
+
+    today_focus_seconds = db.query(func.sum(Daily.focus_seconds))\
+        .filter(Daily.user_id == current_user.id)\
+        .filter(Daily.local_date == today)\
         .scalar() or 0
 
     # 2. 总计追踪应用数
@@ -32,27 +36,19 @@ def get_dashboard_stats(
         .count()
 
     # 3. 今日最常用应用 (按专注时间排序)
-    # 查询今日 Session，按 App 分组，求和 Focus 时间，取第一名
-    most_used = db.query(
-        models.ServerWatchedApplication.executable_name,
-        func.sum(models.ServerProcessSession.total_focus_seconds).label("today_focus")
-    ).select_from(models.ServerWatchedApplication)\
-     .join(models.ServerAppUsageSummary)\
-     .join(models.ServerProcessSession)\
-     .filter(models.ServerWatchedApplication.user_id == current_user.id)\
-     .filter(models.ServerProcessSession.session_start_time >= today_start)\
-     .group_by(models.ServerWatchedApplication.id)\
-     .order_by(desc("today_focus"))\
-     .first()
-    
+    most_used = db.query(models.ServerWatchedApplication.executable_name)\
+        .join(Daily, Daily.application_id == models.ServerWatchedApplication.id)\
+        .filter(Daily.user_id == current_user.id)\
+        .filter(Daily.local_date == today)\
+        .order_by(desc(Daily.focus_seconds))\
+        .first()
+
     most_used_app_name = most_used[0] if most_used else "暂无数据"
-    # 4. 本周总运行时长
-    week_start = today_start - timedelta(days=today_start.weekday()) # 本周一
-    week_lifetime = db.query(func.sum(models.ServerProcessSession.total_lifetime_seconds))\
-        .join(models.ServerAppUsageSummary)\
-        .join(models.ServerWatchedApplication)\
-        .filter(models.ServerWatchedApplication.user_id == current_user.id)\
-        .filter(models.ServerProcessSession.session_start_time >= week_start)\
+    # 4. 本周总运行时长（真实运行时长，同一应用的多个进程重叠部分只计一次）
+    week_start = today - timedelta(days=today.weekday()) # 本周一
+    week_lifetime = db.query(func.sum(Daily.wallclock_seconds))\
+        .filter(Daily.user_id == current_user.id)\
+        .filter(Daily.local_date >= week_start)\
         .scalar() or 0
 
     return {
@@ -65,7 +61,7 @@ def get_dashboard_stats(
 @router.get("/apps")
 def get_top_apps(
     limit: int = 10,
-    db: Session = Depends(database.get_db),
+    db: Session = Depends(database.get_read_db),
     current_user: models.User = Depends(auth.get_current_user)
 ):
     """获取应用列表（主内容区）"""
@@ -86,7 +82,8 @@ def get_top_apps(
             "summary": {
                 "last_seen_end_at": app.summary.last_seen_end_at,
                 "total_lifetime_seconds": app.summary.total_lifetime_seconds,
-                "total_focus_time_seconds": app.summary.total_focus_time_seconds
+                "total_focus_time_seconds": app.summary.total_focus_time_seconds,
+                "total_wallclock_seconds": app.summary.total_wallclock_seconds
             }
         })
     return result
@@ -94,7 +91,7 @@ def get_top_apps(
 @router.get("/recent-activity")
 def get_recent_activity(
     limit: int = 5,
-    db: Session = Depends(database.get_db),
+    db: Session = Depends(database.get_read_db),
     current_user: models.User = Depends(auth.get_current_user)
 ):
     """获取侧边栏的最近活动"""
@@ -117,3 +114,174 @@ def get_recent_activity(
         }
         for s in sessions
     ]
+
+def _with_read_session(request: Request, handler, **kwargs):
+    """在独立的只读会话（独立的连接）中执行一个仪表盘查询，供 bundle 并发调用"""
+    db = database.RoutedReadSessionLocal(info={"request": request})
+    try:
+        return handler(db=db, **kwargs)
+    finally:
+        db.close()
+
+@router.get("/bundle")
+async def get_dashboard_bundle(
+    request: Request,
+    apps_limit: int = Query(10, ge=1, le=100),
+    recent_limit: int = Query(10, ge=1, le=100),
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    """首屏一次取回统计卡片、应用列表和最近活动：只鉴权一次，三个查询在线程池中各用一个连接并发执行"""
+    stats, apps, recent_activity = await asyncio.gather(
+        run_in_threadpool(_with_read_session, request, get_dashboard_stats, current_user=current_user),
+        run_in_threadpool(_with_read_session, request, get_top_apps, limit=apps_limit, current_user=current_user),
+        run_in_threadpool(_with_read_session, request, get_recent_activity, limit=recent_limit, current_user=current_user),
+    )
+    return {
+        "stats": stats,
+        "apps": apps,
+        "recent_activity": recent_activity,
+    }
+
+@router.get("/categories")
+def get_category_breakdown(
+    days: int = 7,
+    db: Session = Depends(database.get_read_db),
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    """最近 days 天（含今天，按用户时区）各分类的专注时长，未匹配任何规则的计为 null"""
+    user_tz = rollups.get_zone(current_user.timezone)
+    start_date = rollups.local_today(user_tz) - timedelta(days=max(days, 1) - 1)
+    CategoryDaily = models.ServerCategoryDailyUsage
+
+    rows = db.query(CategoryDaily.category, func.sum(CategoryDaily.focus_seconds))\
+        .filter(CategoryDaily.user_id == current_user.id)\
+        .filter(CategoryDaily.local_date >= start_date)\
+        .group_by(CategoryDaily.category)\
+        .order_by(desc(func.sum(CategoryDaily.focus_seconds)))\
+        .all()
+
+    return [
+        {"category": category or None, "focus_seconds": int(seconds or 0)}
+        for category, seconds in rows
+    ]
+
+@router.get("/heatmap")
+def get_usage_heatmap(
+    weeks: int = Query(4, ge=1, le=52),
+    app_id: Optional[int] = None,
+    db: Session = Depends(database.get_read_db),
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    """最近 weeks 周的"星期 × 小时"专注时长矩阵（7 × 24，第一行为星期一），可只看某个应用"""
+    user_tz = rollups.get_zone(current_user.timezone)
+    start_date = rollups.local_today(user_tz) - timedelta(weeks=weeks) + timedelta(days=1)
+    Hourly = models.ServerAppHourlyUsage
+
+    # 直接汇总预先按本地小时切分好的行，扫描的行数只与时间范围和应用数有关
+    query = db.query(Hourly.weekday, Hourly.hour, func.sum(Hourly.focus_seconds))\
+        .filter(Hourly.user_id == current_user.id)\
+        .filter(Hourly.local_hour >= datetime.combine(start_date, datetime.min.time()))
+    if app_id is not None:
+        query = query.filter(Hourly.application_id == app_id)
+    rows = query.group_by(Hourly.weekday, Hourly.hour).all()
+
+    matrix = [[0] * 24 for _ in range(7)]
+    for weekday, hour, seconds in rows:
+        matrix[weekday][hour] = int(seconds or 0)
+    return {
+        "weeks": weeks,
+        "start_date": start_date,
+        "application_id": app_id,
+        "matrix": matrix,
+    }
+
+# 对比接口中列出的变化最大的应用数
+COMPARE_TOP_MOVERS = 5
+
+
+def _compare_ranges(period: str, today: date):
+    """
+    返回 (本期开始, 本期结束, 上期开始, 上期结束)，都包含端点。
+    本期截止到今天，上期取相同的已过天数（如本周一到周三对比上周一到周三），避免拿不完整的本期对比完整的上期。
+    """
+    if period == "day":
+        return today, today, today - timedelta(days=1), today - timedelta(days=1)
+    if period == "week":
+        start = today - timedelta(days=today.weekday())
+        return start, today, start - timedelta(weeks=1), today - timedelta(weeks=1)
+    start = today.replace(day=1)
+    prev_end_of_month = start - timedelta(days=1)
+    prev_start = prev_end_of_month.replace(day=1)
+    prev_end = prev_start.replace(day=min(today.day, prev_end_of_month.day))
+    return start, today, prev_start, prev_end
+
+
+@router.get("/compare")
+def compare_periods(
+    period: str = Query("week", pattern="^(day|week|month)$"),
+    db: Session = Depends(database.get_read_db),
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    """本期与上期的总时长对比、各应用的变化以及变化最大的应用"""
+    user_tz = rollups.get_zone(current_user.timezone)
+    today = rollups.local_today(user_tz)
+    # 数据版本号变化（有新同步、删除）或日期、时区变化时缓存自然失效
+    cache_key = ("compare", current_user.id, period, current_user.data_version, today, current_user.timezone)
+    cached = cache.dashboard_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    cur_start, cur_end, prev_start, prev_end = _compare_ranges(period, today)
+    Daily = models.ServerAppDailyUsage
+    App = models.ServerWatchedApplication
+    in_current = Daily.local_date >= cur_start
+
+    # 一次查询同时得到两期的按应用汇总
+    rows = db.query(
+            Daily.application_id,
+            App.executable_name,
+            func.sum(case((in_current, Daily.focus_seconds), else_=0)),
+            func.sum(case((in_current, 0), else_=Daily.focus_seconds)),
+            func.sum(case((in_current, Daily.wallclock_seconds), else_=0)),
+            func.sum(case((in_current, 0), else_=Daily.wallclock_seconds)),
+        )\
+        .join(App, App.id == Daily.application_id)\
+        .filter(Daily.user_id == current_user.id)\
+        .filter(or_(
+            Daily.local_date.between(cur_start, cur_end),
+            Daily.local_date.between(prev_start, prev_end),
+        ))\
+        .group_by(Daily.application_id, App.executable_name)\
+        .all()
+
+    apps = []
+    totals = {"current_focus_seconds": 0, "previous_focus_seconds": 0,
+              "current_wallclock_seconds": 0, "previous_wallclock_seconds": 0}
+    for app_id, name, cur_focus, prev_focus, cur_wall, prev_wall in rows:
+        cur_focus, prev_focus = int(cur_focus or 0), int(prev_focus or 0)
+        totals["current_focus_seconds"] += cur_focus
+        totals["previous_focus_seconds"] += prev_focus
+        totals["current_wallclock_seconds"] += int(cur_wall or 0)
+        totals["previous_wallclock_seconds"] += int(prev_wall or 0)
+        if cur_focus or prev_focus:
+            apps.append({
+                "id": app_id,
+                "executable_name": name,
+                "current_focus_seconds": cur_focus,
+                "previous_focus_seconds": prev_focus,
+                "delta_seconds": cur_focus - prev_focus,
+            })
+    apps.sort(key=lambda a: a["current_focus_seconds"], reverse=True)
+    movers = sorted(apps, key=lambda a: abs(a["delta_seconds"]), reverse=True)[:COMPARE_TOP_MOVERS]
+
+    result = {
+        "period": period,
+        "current": {"start": cur_start, "end": cur_end},
+        "previous": {"start": prev_start, "end": prev_end},
+        **totals,
+        "delta_focus_seconds": totals["current_focus_seconds"] - totals["previous_focus_seconds"],
+        "apps": apps,
+        "biggest_movers": [a for a in movers if a["delta_seconds"]],
+    }
+    cache.dashboard_cache.set(cache_key, result)
+    return result
@@ -0,0 +1,237 @@
+import io
+import csv
+import json
+from datetime import datetime, timezone
+from enum import Enum
+from typing import Iterator, Optional
+
+from fastapi import APIRouter, Depends, Query
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select
+
+from .. import database, models, auth
+from ..logger import logger
+
+router = APIRouter(
+    prefix="/export",
+    tags=["Export"]
+)
+
+# 服务端游标每次拉取的行数，同时也是 CSV/NDJSON 每次 yield 的批大小
+EXPORT_BATCH_SIZE = 1000
+# Parquet 每个 row group 的行数
+PARQUET_ROW_GROUP_SIZE = 50_000
+
+
+class ExportFormat(str, Enum):
+    csv = "csv"
+    ndjson = "ndjson"
+    parquet = "parquet"
+
+
+_MEDIA_TYPES = {
+    ExportFormat.csv: "text/csv; charset=utf-8",
+    ExportFormat.ndjson: "application/x-ndjson",
+    ExportFormat.parquet: "application/vnd.apache.parquet",
+}
+
+# (列名, 类型)，类型用于生成固定的 parquet schema，避免按批推断导致前后不一致
+SESSION_COLUMNS = [
+    ("id", "int"), ("application_id", "int"), ("executable_name", "str"),
+    ("executable_path", "str"), ("process_name", "str"),
+    ("session_start_time", "datetime"), ("session_end_time", "datetime"),
+    ("total_lifetime_seconds", "int"), ("total_focus_seconds", "int"),
+]
+
+ACTIVITY_COLUMNS = [
+    ("id", "int"), ("session_id", "int"), ("executable_name", "str"),
+    ("session_start_time", "datetime"), ("window_title", "str"),
+    ("focus_duration_seconds", "int"),
+]
+
+
+def _to_naive_utc(dt: Optional[datetime]) -> Optional[datetime]:
+    """数据库中存的是去掉时区的 UTC 时间，过滤条件需要转换成同样的形式"""
+    if dt is None or dt.tzinfo is None:
+        return dt
+    return dt.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def _sessions_stmt(user_id: int, start: Optional[datetime], end: Optional[datetime]):
+    stmt = select(
+        models.ServerProcessSession.id,
+        models.ServerWatchedApplication.id.label("application_id"),
+        models.ServerWatchedApplication.executable_name,
+        models.ServerWatchedApplication.executable_path,
+        models.ServerProcessSession.process_name,
+        models.ServerProcessSession.session_start_time,
+        models.ServerProcessSession.session_end_time,
+        models.ServerProcessSession.total_lifetime_seconds,
+        models.ServerProcessSession.total_focus_seconds,
+    ).join(models.ServerAppUsageSummary, models.ServerProcessSession.summary_id == models.ServerAppUsageSummary.id)\
+     .join(models.ServerWatchedApplication, models.ServerAppUsageSummary.application_id == models.ServerWatchedApplication.id)\
+     .where(models.ServerWatchedApplication.user_id == user_id)
+    if start is not None:
+        stmt = stmt.where(models.ServerProcessSession.session_start_time >= start)
+    if end is not None:
+        stmt = stmt.where(models.ServerProcessSession.session_start_time < end)
+    return stmt.order_by(models.ServerProcessSession.id)
+
+
+def _activities_stmt(user_id: int, start: Optional[datetime], end: Optional[datetime]):
+    stmt = select(
+        models.ServerFocusActivity.id,
+        models.ServerFocusActivity.session_id,
+        models.ServerWatchedApplication.executable_name,
+        models.ServerProcessSession.session_start_time,
+        models.ServerFocusActivity.window_title,
+        models.ServerFocusActivity.focus_duration_seconds,
+    ).join(models.ServerProcessSession, models.ServerFocusActivity.session_id == models.ServerProcessSession.id)\
+     .join(models.ServerAppUsageSummary, models.ServerProcessSession.summary_id == models.ServerAppUsageSummary.id)\
+     .join(models.ServerWatchedApplication, models.ServerAppUsageSummary.application_id == models.ServerWatchedApplication.id)\
+     .where(models.ServerWatchedApplication.user_id == user_id)
+    if start is not None:
+        stmt = stmt.where(models.ServerProcessSession.session_start_time >= start)
+    if end is not None:
+        stmt = stmt.where(models.ServerProcessSession.session_start_time < end)
+    return stmt.order_by(models.ServerFocusActivity.id)
+
+
+def _iter_batches(stmt) -> Iterator[list]:
+    """
+    使用服务端游标 (stream_results + yield_per) 分批读取结果，
+    任意时刻内存中最多只有一批数据。
+    会话在生成器内部自行创建和关闭，因为流式响应的生命周期长于请求依赖项。
+    导出允许少量复制延迟，直接走只读副本。
+    """
+    db = database.ReadSessionLocal()
+    try:
+        result = db.execute(stmt.execution_options(stream_results=True, yield_per=EXPORT_BATCH_SIZE))
+        for partition in result.partitions():
+            yield partition
+    finally:
+        db.close()
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"无法序列化类型: {type(value)!r}")
+
+
+def _stream_csv(stmt, columns) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow([name for name, _ in columns])
+    # 带 BOM，方便 Excel 正确识别中文
+    yield ("\ufeff" + buffer.getvalue()).encode("utf-8")
+    for rows in _iter_batches(stmt):
+        buffer.seek(0)
+        buffer.truncate()
+        for row in rows:
+            writer.writerow([v.isoformat() if isinstance(v, datetime) else v for v in row])
+        yield buffer.getvalue().encode("utf-8")
+
+
+def _stream_ndjson(stmt, columns) -> Iterator[bytes]:
+    names = [name for name, _ in columns]
+    for rows in _iter_batches(stmt):
+        lines = [
+            json.dumps(dict(zip(names, row)), ensure_ascii=False, default=_json_default)
+            for row in rows
+        ]
+        yield ("\n".join(lines) + "\n").encode("utf-8")
+
+
+class _ChunkSink(io.RawIOBase):
+    """只追加的内存缓冲区，ParquetWriter 写完一个 row group 后由调用方取走数据"""
+
+    def __init__(self):
+        super().__init__()
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _stream_parquet(stmt, columns) -> Iterator[bytes]:
+    # pyarrow 体积较大，只有真正导出 parquet 时才导入
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    arrow_types = {"int": pa.int64(), "str": pa.string(), "datetime": pa.timestamp("us")}
+    schema = pa.schema([(name, arrow_types[kind]) for name, kind in columns])
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema, compression="snappy")
+    pending = []
+
+    def flush_row_group():
+        arrays = [pa.array(values, type=field.type) for values, field in zip(zip(*pending), schema)]
+        writer.write_table(pa.Table.from_arrays(arrays, schema=schema), row_group_size=PARQUET_ROW_GROUP_SIZE)
+        pending.clear()
+
+    for rows in _iter_batches(stmt):
+        pending.extend(rows)
+        if len(pending) >= PARQUET_ROW_GROUP_SIZE:
+            flush_row_group()
+            yield sink.drain()
+
+    if pending:
+        flush_row_group()
+    writer.close()
+    yield sink.drain()
+
+
+_WRITERS = {
+    ExportFormat.csv: _stream_csv,
+    ExportFormat.ndjson: _stream_ndjson,
+    ExportFormat.parquet: _stream_parquet,
+}
+
+
+def _export_response(stmt, columns, fmt: ExportFormat, filename: str) -> StreamingResponse:
+    return StreamingResponse(
+        _WRITERS[fmt](stmt, columns),
+        media_type=_MEDIA_TYPES[fmt],
+        headers={"Content-Disposition": f'attachment; filename="{filename}.{fmt.value}"'},
+    )
+
+
+@router.get("/sessions")
+def export_sessions(
+    format: ExportFormat = ExportFormat.csv,
+    start: Optional[datetime] = Query(None, alias="from"),
+    end: Optional[datetime] = Query(None, alias="to"),
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    """流式导出当前用户的全部进程会话"""
+    logger.info(f"用户 {current_user.username} 导出会话记录 (format={format.value}, from={start}, to={end})")
+    stmt = _sessions_stmt(current_user.id, _to_naive_utc(start), _to_naive_utc(end))
+    return _export_response(stmt, SESSION_COLUMNS, format, "sessions")
+
+
+@router.get("/activities")
+def export_activities(
+    format: ExportFormat = ExportFormat.csv,
+    start: Optional[datetime] = Query(None, alias="from"),
+    end: Optional[datetime] = Query(None, alias="to"),
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    """流式导出当前用户的全部焦点活动，可通过 session_id 与会话导出关联"""
+    logger.info(f"用户 {current_user.username} 导出焦点活动 (format={format.value}, from={start}, to={end})")
+    stmt = _activities_stmt(current_user.id, _to_naive_utc(start), _to_naive_utc(end))
+    return _export_response(stmt, ACTIVITY_COLUMNS, format, "activities")
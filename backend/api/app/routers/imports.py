@@ -0,0 +1,132 @@
+import os
+import uuid
+import tempfile
+from typing import Optional
+
+from fastapi import APIRouter, BackgroundTasks, Depends, Header, HTTPException, Request, status
+from starlette.concurrency import run_in_threadpool
+from sqlalchemy.orm import Session
+
+from .. import database, models, auth, schemas, jobs, importer, devices, rollups
+from ..logger import logger
+
+router = APIRouter(
+    prefix="/import",
+    tags=["Import"]
+)
+
+# 上传文件的大小上限（nginx 中 /api/import 的 client_max_body_size 需与之匹配）
+IMPORT_MAX_BYTES = int(os.getenv("IMPORT_MAX_BYTES", str(512 * 1024 * 1024)))
+# 上传文件在导入完成前保存的目录
+IMPORT_TMP_DIR = os.getenv("IMPORT_TMP_DIR") or tempfile.gettempdir()
+_COPY_BUFFER_SIZE = 1024 * 1024
+
+
+def _too_large() -> HTTPException:
+    return HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail="导入文件过大")
+
+
+async def _save_upload(request: Request) -> str:
+    """
+    把请求体边接收边写入临时文件（后台任务结束时删除），累计超过上限时立即中止。
+    不使用 UploadFile：Starlette 会先把整个表单缓存下来，之后才轮到这里检查大小
+    """
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > IMPORT_MAX_BYTES:
+        raise _too_large()
+    fd, path = tempfile.mkstemp(prefix="import-", dir=IMPORT_TMP_DIR)
+    written = 0
+    try:
+        with os.fdopen(fd, "wb") as out:
+            buffer = bytearray()
+            async for chunk in request.stream():
+                written += len(chunk)
+                if written > IMPORT_MAX_BYTES:
+                    raise _too_large()
+                buffer += chunk
+                if len(buffer) >= _COPY_BUFFER_SIZE:
+                    await run_in_threadpool(out.write, bytes(buffer))
+                    buffer.clear()
+            await run_in_threadpool(out.write, bytes(buffer))
+    except BaseException:
+        os.remove(path)
+        raise
+    return path
+
+
+def _running_import(db: Session, user_id: int) -> Optional[models.ServerJob]:
+    return db.query(models.ServerJob)\
+        .filter(models.ServerJob.user_id == user_id)\
+        .filter(models.ServerJob.kind == "import")\
+        .filter(models.ServerJob.status.in_([jobs.PENDING, jobs.RUNNING]))\
+        .first()
+
+
+def _start_import(
+    db: Session,
+    background_tasks: BackgroundTasks,
+    current_user: models.User,
+    path: str,
+    x_client_timezone: Optional[str],
+    x_device_id: Optional[str],
+    x_device_name: Optional[str],
+) -> dict:
+    fmt = importer.detect_format(path)
+    if fmt is None:
+        raise HTTPException(status_code=400, detail="无法识别的文件格式，请上传 SQLite 数据库或 NDJSON 文件")
+
+    # 锁住用户行再检查并创建任务，同一用户并发的上传在这里排队，只有一个能通过检查。
+    # 先结束鉴权时开启的事务，之后的查询才能看到刚被其他请求提交的任务
+    db.rollback()
+    db.query(models.User.id)\
+        .filter(models.User.id == current_user.id)\
+        .with_for_update()\
+        .one()
+    running = _running_import(db, current_user.id)
+    if running:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"已有导入任务正在进行: {running.id}")
+
+    if x_client_timezone and x_client_timezone != current_user.timezone \
+            and rollups.is_valid_timezone(x_client_timezone):
+        current_user.timezone = x_client_timezone
+    # 没有设备标识时为这次导入单独建一个设备，会话仍可按 client_session_id 去重
+    device = devices.get_or_create_device(
+        db, current_user, x_device_id or f"import-{uuid.uuid4().hex[:24]}", x_device_name
+    )
+    # create_job 提交事务，同时释放用户行锁
+    job = jobs.create_job(db, current_user.id, "import", progress={"format": fmt, "bytes": os.path.getsize(path)})
+    background_tasks.add_task(jobs.run_job, job.id, importer.run_import(current_user.id, device.id, path, fmt))
+    logger.info(f"用户 {current_user.username} 上传了导入文件 ({fmt}, {os.path.getsize(path)} 字节)，任务 {job.id}")
+    return jobs.job_to_dict(job)
+
+
+@router.post("", response_model=schemas.JobStatus, status_code=status.HTTP_202_ACCEPTED)
+async def upload_import(
+    request: Request,
+    background_tasks: BackgroundTasks,
+    db: Session = Depends(database.get_db),
+    current_user: models.User = Depends(auth.get_current_user),
+    x_client_timezone: Optional[str] = Header(None),
+    x_device_id: Optional[str] = Header(None, max_length=64),
+    x_device_name: Optional[str] = Header(None, max_length=255)
+):
+    """
+    一次性导入客户端的历史数据：请求体直接是 local_client.db，或客户端导出的 NDJSON（可 gzip 压缩），
+    Content-Type 用 application/octet-stream，格式按文件头识别。
+    在后台分批写入，返回任务信息，通过 /jobs/{id} 查询进度。
+    带上 X-Device-Id 时导入的会话按该设备去重，并推进设备的高水位，之后的常规同步不会重复上传。
+    """
+    # 接收文件前先做一次不加锁的检查，已有任务时不必等整个文件上传完才拒绝
+    running = await run_in_threadpool(_running_import, db, current_user.id)
+    if running:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"已有导入任务正在进行: {running.id}")
+
+    path = await _save_upload(request)
+    try:
+        return await run_in_threadpool(
+            _start_import, db, background_tasks, current_user, path,
+            x_client_timezone, x_device_id, x_device_name,
+        )
+    except BaseException:
+        os.remove(path)
+        raise
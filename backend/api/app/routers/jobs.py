@@ -0,0 +1,26 @@
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy.orm import Session
+
+from .. import database, models, auth, schemas, jobs
+
+router = APIRouter(
+    prefix="/jobs",
+    tags=["Jobs"]
+)
+
+
+@router.get("/{job_id}", response_model=schemas.JobStatus)
+def get_job(
+    job_id: str,
+    db: Session = Depends(database.get_db),
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    """查询后台任务的状态和进度"""
+    # 进度由后台任务写入主库，这里也读主库，避免从库延迟导致进度回退
+    job = db.query(models.ServerJob)\
+        .filter(models.ServerJob.id == job_id)\
+        .filter(models.ServerJob.user_id == current_user.id)\
+        .first()
+    if job is None:
+        raise HTTPException(status_code=404, detail="任务不存在")
+    return jobs.job_to_dict(job)
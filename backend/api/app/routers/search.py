@@ -0,0 +1,161 @@
+import re
+import json
+import base64
+from collections import defaultdict
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy.orm import Session
+from sqlalchemy import func, desc, or_, and_
+
+from .. import database, models, auth, rollups, title_index
+
+router = APIRouter(
+    prefix="/search",
+    tags=["Search"]
+)
+
+MAX_PAGE_SIZE = 100
+# InnoDB 全文索引默认忽略短于 3 个字符的词
+FULLTEXT_MIN_TOKEN_LENGTH = 3
+# 中日韩文字没有空格分词，MariaDB 也不支持 ngram 分词器，这类查询走 title_index 的 2-gram 索引
+_CJK_RE = re.compile(r"[\u3040-\u30ff\u3400-\u9fff\uac00-\ud7af\uf900-\ufaff]")
+_TOKEN_RE = re.compile(r"\w+")
+
+
+def _fulltext_query(q: str) -> Optional[str]:
+    """把用户输入转换为 BOOLEAN MODE 查询（每个词必须出现、允许前缀匹配）；不适合全文索引时返回 None"""
+    tokens = _TOKEN_RE.findall(q)
+    if not tokens or _CJK_RE.search(q) or any(len(t) < FULLTEXT_MIN_TOKEN_LENGTH for t in tokens):
+        return None
+    return " ".join(f"+{t}*" for t in tokens)
+
+
+def _like_pattern(word: str) -> str:
+    escaped = word.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+
+def _title_condition(db: Session, user_id: int, q: str):
+    """
+    能用全文索引的查询在 MariaDB 上用 MATCH；其余（中日韩文字、短词、SQLite）先用 2-gram 索引找出候选标题，
+    只对候选标题做 LIKE 确认，再按标题等值查找活动，不再对全部活动做 LIKE 扫描。
+    """
+    Activity = models.ServerFocusActivity
+    terms = _fulltext_query(q)
+    if terms and db.get_bind().dialect.name == "mysql":
+        from sqlalchemy.dialects.mysql import match
+        return match(Activity.window_title, against=terms).in_boolean_mode()
+    words = q.split()
+    Title = models.ServerWindowTitle
+    candidates = title_index.candidate_titles(user_id, words)\
+        .where(and_(*[Title.window_title.like(_like_pattern(w), escape="\\") for w in words]))
+    return Activity.window_title.in_(candidates)
+
+
+def _encode_cursor(total: int, title: str) -> str:
+    raw = json.dumps([total, title], ensure_ascii=False).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+
+def _decode_cursor(cursor: str):
+    try:
+        total, title = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return int(total), str(title)
+    except Exception:
+        raise HTTPException(status_code=400, detail="无效的分页游标")
+
+
+@router.get("/titles")
+def search_titles(
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(20, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    db: Session = Depends(database.get_read_db),
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    """按窗口标题搜索历史活动，按总专注时长排序，附带按应用、按日期的分布"""
+    q = q.strip()
+    if not q:
+        raise HTTPException(status_code=400, detail="搜索词不能为空")
+
+    Activity = models.ServerFocusActivity
+    ProcessSession = models.ServerProcessSession
+    App = models.ServerWatchedApplication
+    total_focus = func.sum(Activity.focus_duration_seconds)
+
+    # 1. 当前页的标题：按 (总专注时长 desc, 标题 asc) 做 keyset 分页
+    query = db.query(
+            Activity.window_title,
+            total_focus.label("total_focus_seconds"),
+            func.count(Activity.id).label("activity_count"),
+            func.min(ProcessSession.session_start_time).label("first_seen_at"),
+            func.max(ProcessSession.session_end_time).label("last_seen_at"),
+        )\
+        .join(ProcessSession, ProcessSession.id == Activity.session_id)\
+        .join(models.ServerAppUsageSummary, models.ServerAppUsageSummary.id == ProcessSession.summary_id)\
+        .join(App, App.id == models.ServerAppUsageSummary.application_id)\
+        .filter(App.user_id == current_user.id)\
+        .filter(_title_condition(db, current_user.id, q))\
+        .group_by(Activity.window_title)
+    if cursor:
+        last_total, last_title = _decode_cursor(cursor)
+        query = query.having(or_(
+            total_focus < last_total,
+            and_(total_focus == last_total, Activity.window_title > last_title),
+        ))
+    rows = query.order_by(desc(total_focus), Activity.window_title)\
+        .limit(limit + 1)\
+        .all()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if not rows:
+        return {"items": [], "next_cursor": None}
+
+    # 2. 只对当前页的标题计算分布。焦点活动没有时间戳，按所属会话的开始时间归到用户本地日期
+    titles = [row.window_title for row in rows]
+    breakdown_rows = db.query(
+            Activity.window_title,
+            App.id,
+            App.executable_name,
+            ProcessSession.session_start_time,
+            func.sum(Activity.focus_duration_seconds),
+        )\
+        .join(ProcessSession, ProcessSession.id == Activity.session_id)\
+        .join(models.ServerAppUsageSummary, models.ServerAppUsageSummary.id == ProcessSession.summary_id)\
+        .join(App, App.id == models.ServerAppUsageSummary.application_id)\
+        .filter(App.user_id == current_user.id)\
+        .filter(Activity.window_title.in_(titles))\
+        .group_by(Activity.window_title, App.id, App.executable_name, ProcessSession.id, ProcessSession.session_start_time)\
+        .all()
+
+    user_tz = rollups.get_zone(current_user.timezone)
+    by_app = defaultdict(lambda: defaultdict(int))
+    by_day = defaultdict(lambda: defaultdict(int))
+    app_names = {}
+    for title, app_id, app_name, start_time, seconds in breakdown_rows:
+        app_names[app_id] = app_name
+        by_app[title][app_id] += int(seconds or 0)
+        by_day[title][rollups.local_date_of(start_time, user_tz)] += int(seconds or 0)
+
+    items = []
+    for row in rows:
+        apps = sorted(by_app[row.window_title].items(), key=lambda kv: kv[1], reverse=True)
+        days = sorted(by_day[row.window_title].items())
+        items.append({
+            "window_title": row.window_title,
+            "total_focus_seconds": int(row.total_focus_seconds or 0),
+            "activity_count": row.activity_count,
+            "first_seen_at": row.first_seen_at,
+            "last_seen_at": row.last_seen_at,
+            "apps": [
+                {"application_id": app_id, "executable_name": app_names[app_id], "focus_seconds": seconds}
+                for app_id, seconds in apps
+            ],
+            "days": [{"date": day, "focus_seconds": seconds} for day, seconds in days],
+        })
+
+    last = items[-1]
+    next_cursor = _encode_cursor(last["total_focus_seconds"], last["window_title"]) if has_more else None
+    return {"items": items, "next_cursor": next_cursor}
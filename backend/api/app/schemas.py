@@ -1,6 +1,6 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from datetime import datetime
-from typing import List, Optional
+from typing import Any, Dict, List, Optional
 
 
 
@@ -18,6 +18,23 @@ class SyncProcessSession(BaseModel):
     total_lifetime_seconds: int
     total_focus_seconds: int
     activities: List[SyncFocusActivity]
+    # 客户端本地数据库中的会话 id，配合 X-Device-Id 用于去重和高水位
+    client_session_id: Optional[int] = None
+
+# 同步结果中被拒绝的会话
+class RejectedSession(BaseModel):
+    index: int                                # 在请求列表中的位置
+    client_session_id: Optional[int] = None
+    reason: str
+    retryable: bool = False                   # 服务器临时故障导致的拒绝，客户端应稍后重传；否则数据本身无效
+
+# 同步接口的返回结果
+class SyncResult(BaseModel):
+    message: str
+    accepted: List[int] = []                  # 被接收（含此前已接收）的 client_session_id
+    accepted_count: int = 0
+    rejected: List[RejectedSession] = []
+    watermark: Optional[int] = None           # 本设备新的高水位，未上报设备时为空
 
 # 用于 API 输出和内部使用的模型
 
@@ -45,3 +62,48 @@ class AppUsageSummary(BaseModel):
     
     class Config:
         from_attributes = True
+
+# 设备的同步游标（服务器已确认的高水位）
+class DeviceCursor(BaseModel):
+    device_uid: str
+    name: Optional[str]
+    last_client_session_id: int
+    last_seen_at: Optional[datetime]
+
+    class Config:
+        from_attributes = True
+
+# 后台任务的状态
+class JobStatus(BaseModel):
+    id: str
+    kind: str
+    status: str
+    progress: Dict[str, Any] = {}
+    error: Optional[str] = None
+    created_at: datetime
+    updated_at: datetime
+
+# 批量清除服务器数据的请求，三种方式任选其一或组合
+class PurgeRequest(BaseModel):
+    application_ids: List[int] = []
+    executable_paths: List[str] = []
+    all: bool = False
+
+# 分类规则：executable_name 与 title_pattern 至少填写一个，都填写时需同时满足
+class CategoryRuleCreate(BaseModel):
+    category: str = Field(..., min_length=1, max_length=64)
+    executable_name: Optional[str] = Field(None, max_length=255)
+    title_pattern: Optional[str] = Field(None, max_length=512)
+    priority: int = 0
+
+class CategoryRule(CategoryRuleCreate):
+    id: int
+    created_at: datetime
+
+    class Config:
+        from_attributes = True
+
+# 规则修改的结果，附带后台重算任务的 id（可通过 /jobs/{id} 查询进度）
+class CategoryRuleChange(BaseModel):
+    rule: Optional[CategoryRule] = None
+    recategorize_job_id: str
@@ -0,0 +1,94 @@
+import hashlib
+from typing import Iterable, List, Set
+
+from sqlalchemy import select, insert, func
+from sqlalchemy.orm import Session
+
+from . import models
+
+# 每个标题按小写拆成相邻两个字符的片段（最后一个字符单独成为一个片段），
+# 查询词的每个 2-gram 都出现在标题中是"标题包含该词"的必要条件。
+# MariaDB 的 InnoDB 全文索引不支持 ngram 分词器，中日韩文字和短词的搜索走这个索引。
+GRAM_SIZE = 2
+
+
+def title_hash(title: str) -> str:
+    return hashlib.sha1(title.encode("utf-8")).hexdigest()
+
+
+def title_grams(title: str) -> Set[str]:
+    """标题的全部片段（去重）。以空白开头的片段不会被任何查询词用到，不写入"""
+    text = title.lower()
+    return {text[i:i + GRAM_SIZE] for i in range(len(text)) if not text[i].isspace()}
+
+
+def word_grams(word: str) -> List[str]:
+    """查询词的 2-gram；单个字符的词返回空列表（由调用方按前缀查找）"""
+    text = word.lower()
+    return sorted({text[i:i + GRAM_SIZE] for i in range(len(text) - GRAM_SIZE + 1)})
+
+
+def index_titles(db: Session, user_id: int, application_id: int, titles: Iterable[str]) -> int:
+    """
+    把该应用新出现的窗口标题及其片段写入索引，已索引的标题跳过，返回新增的标题数。
+    调用方需持有该应用的 summary 行锁（与同步写入相同），同一应用的标题不会被并发重复插入。
+    """
+    by_hash = {title_hash(t): t for t in set(titles) if t}
+    if not by_hash:
+        return 0
+    T = models.ServerWindowTitle
+    existing = set(db.execute(
+        select(T.title_hash)
+        .where(T.application_id == application_id)
+        .where(T.title_hash.in_(list(by_hash)))
+    ).scalars().all())
+    new_titles = {h: t for h, t in by_hash.items() if h not in existing}
+    if not new_titles:
+        return 0
+
+    db.execute(insert(T), [
+        {"application_id": application_id, "title_hash": h, "window_title": t}
+        for h, t in new_titles.items()
+    ])
+    # 批量插入拿不到自增 id，通过 (application_id, title_hash) 唯一索引一次查回
+    title_ids = dict(db.execute(
+        select(T.title_hash, T.id)
+        .where(T.application_id == application_id)
+        .where(T.title_hash.in_(list(new_titles)))
+    ).all())
+    gram_rows = [
+        {"user_id": user_id, "application_id": application_id, "title_id": title_ids[h], "gram": gram}
+        for h, t in new_titles.items()
+        for gram in title_grams(t)
+    ]
+    if gram_rows:
+        db.execute(insert(models.ServerTitleGram), gram_rows)
+    return len(new_titles)
+
+
+def _like_prefix(char: str) -> str:
+    return char.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+
+
+def candidate_titles(user_id: int, words: List[str]):
+    """
+    返回一个子查询：该用户的标题中，每个查询词的全部 2-gram 都出现过的标题。
+    这只是必要条件（片段的顺序不保证），调用方还需对候选标题逐词确认包含关系。
+    """
+    T = models.ServerWindowTitle
+    G = models.ServerTitleGram
+    stmt = select(T.window_title)\
+        .join(models.ServerWatchedApplication, models.ServerWatchedApplication.id == T.application_id)\
+        .where(models.ServerWatchedApplication.user_id == user_id)
+    for word in words:
+        grams = word_grams(word)
+        matched = select(G.title_id).where(G.user_id == user_id)
+        if grams:
+            # 数据库的排序规则不区分大小写/重音时，一个片段可能匹配多行，这里用 >= 而不是 ==
+            matched = matched.where(G.gram.in_(grams))\
+                .group_by(G.title_id)\
+                .having(func.count() >= len(grams))
+        else:
+            matched = matched.where(G.gram.like(_like_prefix(word.lower()), escape="\\"))
+        stmt = stmt.where(T.id.in_(matched))
+    return stmt
@@ -5,7 +5,7 @@ from sqlalchemy.orm import joinedload
 
 from local_database import SessionLocal
 from local_models import WatchedApplication
-from tracking_service import add_or_get_watched_app
+from tracking_service import add_or_get_watched_app, forget_app, warm_app_cache
 from path_utils import normalize_exe_path
 
 
@@ -107,6 +107,7 @@ class AppRepository:
                 return False
             db.delete(app)
             db.commit()
+            forget_app(exe_path)
             return True
         finally:
             db.close()
@@ -120,6 +121,15 @@ class AppRepository:
         finally:
             db.close()
 
+    @staticmethod
+    def warm_tracking_cache() -> int:
+        """启动时预热记录会话用的应用 id 缓存，返回缓存的应用数。"""
+        db = SessionLocal()
+        try:
+            return warm_app_cache(db)
+        finally:
+            db.close()
+
     @staticmethod
     def app_exists(exe_path: str) -> bool:
         exe_path = normalize_exe_path(exe_path)
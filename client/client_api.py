@@ -1,14 +1,129 @@
 import os
+import gzip
+import json
+import time
 from pathlib import Path
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from dotenv import load_dotenv
-from typing import List, Dict, Any, Optional, Tuple
+from typing import List, Dict, Any, Optional, Tuple, NamedTuple
 from enum import Enum
+from device import get_device_id, get_device_name
 
 load_dotenv(Path(__file__).resolve().parent.parent / ".env")
 BASE_URL = os.getenv("BASE_URL", "http://127.0.0.1").rstrip('/')
 API_URL = f"{BASE_URL}/api"
 
+# ---- HTTP 连接池 ----
+# 所有请求共用一个 requests.Session：连接保持复用，每轮同步不必重新 TCP/TLS 握手
+HTTP_POOL_SIZE = 4
+# 超时（秒）：读超时按请求体大小放宽，大批量同步时服务器需要更久才能处理完
+HTTP_CONNECT_TIMEOUT = 5
+HTTP_READ_TIMEOUT = 10
+HTTP_READ_TIMEOUT_PER_MB = 10
+# 请求体超过这个大小时 gzip 压缩后再发送
+GZIP_MIN_BYTES = 1024
+# 连接失败或网关错误时的自动重试；429 等带 Retry-After 的响应交给调用方处理。
+# 同步接口按设备和本地会话 id 去重，POST 重试是安全的
+_RETRY_POLICY = Retry(
+    total=2,
+    connect=2,
+    read=0,
+    status=2,
+    backoff_factor=0.5,
+    status_forcelist=(502, 503, 504),
+    allowed_methods=frozenset({"GET", "POST"}),
+    respect_retry_after_header=False,
+    raise_on_status=False,
+)
+
+_http = None
+# 旧版服务器不认识 gzip 请求体，遇到后本进程内不再压缩（见 _gzip_rejected）
+_gzip_supported = True
+
+
+def _get_http() -> requests.Session:
+    global _http
+    if _http is None:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=HTTP_POOL_SIZE, max_retries=_RETRY_POLICY)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        _http = session
+    return _http
+
+
+def close_http_session() -> None:
+    """关闭连接池（退出前由 SyncController.stop 调用），之后的请求会重新建立连接"""
+    global _http
+    if _http is not None:
+        _http.close()
+        _http = None
+
+
+def _timeout_for(body_bytes: int = 0) -> Tuple[float, float]:
+    return HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT + HTTP_READ_TIMEOUT_PER_MB * body_bytes / (1024 * 1024)
+
+
+def _post_json(url: str, data: Any, headers: Dict[str, str]) -> requests.Response:
+    """POST JSON，较大的请求体 gzip 压缩；服务器不支持压缩时自动改为不压缩重发一次"""
+    global _gzip_supported
+    body = json.dumps(data).encode("utf-8")
+    headers = {**headers, "Content-Type": "application/json"}
+    if _gzip_supported and len(body) >= GZIP_MIN_BYTES:
+        compressed = gzip.compress(body, compresslevel=6)
+        response = _get_http().post(
+            url, data=compressed, headers={**headers, "Content-Encoding": "gzip"},
+            timeout=_timeout_for(len(body)),
+        )
+        if not _gzip_rejected(response):
+            return response
+        print(f"服务器不接受 gzip 请求体 (HTTP {response.status_code})，改为不压缩发送")
+        _gzip_supported = False
+    return _get_http().post(url, data=body, headers=headers, timeout=_timeout_for(len(body)))
+
+
+def _gzip_rejected(response: requests.Response) -> bool:
+    """
+    判断失败是否因为服务器无法解码 gzip 请求体：415；400 且说明 gzip 无效；
+    不认识 Content-Encoding 的旧版服务器把压缩数据当作 JSON 解析，返回 422 json_invalid。
+    其他 400/422 是数据本身的问题，不改变压缩设置
+    """
+    if response.status_code == 415:
+        return True
+    if response.status_code not in (400, 422):
+        return False
+    try:
+        detail = response.json().get("detail")
+    except (ValueError, AttributeError):
+        return False
+    if response.status_code == 400:
+        return isinstance(detail, str) and "gzip" in detail.lower()
+    return isinstance(detail, list) and any(
+        isinstance(item, dict) and item.get("type") == "json_invalid" for item in detail
+    )
+
+def get_local_timezone_name() -> str:
+    """
+    返回本机的 IANA 时区名，服务器据此划分用户的"今天""本周"。
+    优先使用 tzlocal（Windows 上可把系统时区映射为 IANA 名称），
+    不可用时退化为按当前 UTC 偏移构造的 Etc/GMT±N（无法表示半小时时区）。
+    """
+    try:
+        from tzlocal import get_localzone_name
+        name = get_localzone_name()
+        if name:
+            return name
+    except Exception:
+        pass
+    offset_hours = round(time.localtime().tm_gmtoff / 3600)
+    if offset_hours == 0:
+        return "UTC"
+    # Etc/GMT 的符号与直觉相反：UTC+8 对应 Etc/GMT-8
+    return f"Etc/GMT{'-' if offset_hours > 0 else '+'}{abs(offset_hours)}"
+
+
 #定义一个清晰的登录状态枚举
 class LoginStatus(Enum):
     SUCCESS = 0
@@ -26,10 +141,10 @@ def api_login(username: str, password: str) -> Tuple[LoginStatus, Optional[str]]
     login_url = f"{API_URL}/auth/token"
 
     try:
-        response = requests.post(
+        response = _get_http().post(
             login_url,
             data={"username": username, "password": password},
-            timeout=10
+            timeout=_timeout_for()
         )
         # 检查是否为 HTTP 错误 (4xx, 5xx)
         response.raise_for_status() 
@@ -59,18 +174,95 @@ def api_login(username: str, password: str) -> Tuple[LoginStatus, Optional[str]]
         print(f"登录API请求失败，底层网络错误: {e}")
         return (LoginStatus.NETWORK_ERROR, None)
 
-def send_data_to_api(data_list: List[Dict[str, Any]], endpoint: str, token: str) -> bool:
+class SendResult(NamedTuple):
+    ok: bool
+    retry_after: Optional[float] = None  # 服务器通过 Retry-After 要求的等待秒数
+    payload: Optional[Dict[str, Any]] = None  # 服务器返回的 JSON（如同步结果）
+    status_code: Optional[int] = None  # 失败时的 HTTP 状态码，网络错误时为空
+
+
+def _parse_retry_after(response) -> Optional[float]:
+    """只处理秒数形式的 Retry-After（后端限流返回的就是秒数）"""
+    if response is None:
+        return None
+    value = response.headers.get("Retry-After")
+    try:
+        return max(0.0, float(value)) if value is not None else None
+    except ValueError:
+        return None
+
+
+def send_data_to_api(data_list: List[Dict[str, Any]], endpoint: str, token: str) -> SendResult:
     if not data_list:
-        return True
+        return SendResult(ok=True)
 
     target_url = f"{API_URL}/{endpoint.lstrip('/')}"
-    headers = {"Authorization": f"Bearer {token}"}
+    headers = {
+        "Authorization": f"Bearer {token}",
+        "X-Client-Timezone": get_local_timezone_name(),
+        "X-Device-Id": get_device_id(),
+        "X-Device-Name": get_device_name(),
+    }
 
     try:
-        response = requests.post(target_url, json=data_list, headers=headers, timeout=5) #可以调整超时时间
+        response = _post_json(target_url, data_list, headers)
         response.raise_for_status()
         print(f"成功发送 {len(data_list)} 条数据到 {endpoint}")
-        return True
+        try:
+            payload = response.json()
+        except ValueError:
+            payload = None
+        return SendResult(ok=True, payload=payload if isinstance(payload, dict) else None)
+    except requests.exceptions.HTTPError as e:
+        retry_after = _parse_retry_after(e.response)
+        print(f"发送数据到 {endpoint} 失败: {e} (Retry-After={retry_after})")
+        status_code = e.response.status_code if e.response is not None else None
+        return SendResult(ok=False, retry_after=retry_after, status_code=status_code)
     except requests.exceptions.RequestException as e:
         print(f"发送数据到 {endpoint} 失败: {e}")
-        return False
+        return SendResult(ok=False)
+
+
+def upload_import_file(path: str, token: str) -> SendResult:
+    """
+    把导出的历史数据文件（gzip 压缩的 NDJSON，见 sync_service.export_pending_sessions）上传到 /import，
+    服务器在后台分批导入。成功时 payload 是任务信息，可以通过 /jobs/{id} 查询进度
+    """
+    target_url = f"{API_URL}/import"
+    headers = {
+        "Authorization": f"Bearer {token}",
+        "Content-Type": "application/octet-stream",
+        "X-Client-Timezone": get_local_timezone_name(),
+        "X-Device-Id": get_device_id(),
+        "X-Device-Name": get_device_name(),
+    }
+    size = os.path.getsize(path)
+    try:
+        with open(path, "rb") as f:
+            response = _get_http().post(target_url, data=f, headers=headers, timeout=_timeout_for(size))
+        response.raise_for_status()
+        print(f"已上传导入文件 ({size} 字节)")
+        return SendResult(ok=True, payload=response.json())
+    except requests.exceptions.HTTPError as e:
+        print(f"上传导入文件失败: {e}")
+        status_code = e.response.status_code if e.response is not None else None
+        return SendResult(ok=False, retry_after=_parse_retry_after(e.response), status_code=status_code)
+    except (requests.exceptions.RequestException, ValueError) as e:
+        print(f"上传导入文件失败: {e}")
+        return SendResult(ok=False)
+
+
+def fetch_sync_cursor(token: str) -> Optional[int]:
+    """
+    询问服务器已确认收到的本设备最大本地会话 id（高水位）。
+    请求失败时返回 None，调用方应按"未知"处理而不是当作 0。
+    """
+    target_url = f"{API_URL}/sync/devices/{get_device_id()}/cursor"
+    headers = {"Authorization": f"Bearer {token}"}
+    try:
+        response = _get_http().get(target_url, headers=headers, timeout=_timeout_for())
+        response.raise_for_status()
+        return int(response.json().get("last_client_session_id", 0))
+    except (requests.exceptions.RequestException, ValueError) as e:
+        print(f"获取同步游标失败: {e}")
+        return None
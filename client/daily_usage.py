@@ -0,0 +1,119 @@
+import datetime
+from collections import defaultdict
+from typing import Dict, List, Tuple
+
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+from local_models import AppDailyUsage, AppUsageSummary, ProcessSession
+
+# 回填时每批读取的会话数
+BACKFILL_CHUNK_SIZE = 2000
+
+
+def allocate(total: int, weights: List[int]) -> List[int]:
+    """按权重把整数 total 分摊成若干整数份，保证各份之和等于 total（最大余数法）"""
+    weight_sum = sum(weights)
+    if not weights or weight_sum <= 0:
+        return [total] + [0] * (len(weights) - 1) if weights else []
+    shares = [total * w // weight_sum for w in weights]
+    remainders = sorted(range(len(weights)), key=lambda i: (total * weights[i]) % weight_sum, reverse=True)
+    for i in remainders[:total - sum(shares)]:
+        shares[i] += 1
+    return shares
+
+
+def split_by_day(start_time: datetime.datetime, end_time: datetime.datetime,
+                 lifetime: int, focus: int) -> List[Tuple[datetime.date, int, int]]:
+    """
+    把一个会话按本地午夜切分成 [(日期, 运行秒数, 焦点秒数), ...]。
+    运行时长按各天实际占用的时长分摊，焦点时长按同样的比例分摊（会话内没有焦点的时间分布）。
+    """
+    days = []
+    cursor = start_time
+    while cursor.date() < end_time.date():
+        midnight = datetime.datetime.combine(cursor.date() + datetime.timedelta(days=1), datetime.time.min)
+        days.append((cursor.date(), (midnight - cursor).total_seconds()))
+        cursor = midnight
+    days.append((cursor.date(), (end_time - cursor).total_seconds()))
+
+    weights = [int(seconds * 1000) for _, seconds in days]
+    lifetimes = allocate(lifetime, weights)
+    focuses = allocate(min(focus, lifetime), weights)
+    # 两次分摊的取整方向可能不同，把超出当天运行时长的焦点秒数挪到其他还有余量的天
+    overflow = 0
+    for i, (lt, fs) in enumerate(zip(lifetimes, focuses)):
+        if fs > lt:
+            overflow += fs - lt
+            focuses[i] = lt
+    for i, lt in enumerate(lifetimes):
+        if not overflow:
+            break
+        moved = min(lt - focuses[i], overflow)
+        focuses[i] += moved
+        overflow -= moved
+    return [(day, lt, fs) for (day, _), lt, fs in zip(days, lifetimes, focuses)]
+
+
+def upsert_daily_usage(db: Session, application_id: int, start_time: datetime.datetime,
+                       end_time: datetime.datetime, lifetime: int, focus: int) -> None:
+    """在调用方的事务中把一个会话累加到日汇总表；行有变化时重新标记为未同步"""
+    rows = [
+        {
+            "application_id": application_id,
+            "date": day,
+            "lifetime_seconds": day_lifetime,
+            "focus_seconds": day_focus,
+            "synced": False,
+        }
+        for day, day_lifetime, day_focus in split_by_day(start_time, end_time, lifetime, focus)
+    ]
+    stmt = sqlite_insert(AppDailyUsage)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[AppDailyUsage.application_id, AppDailyUsage.date],
+        set_={
+            "lifetime_seconds": AppDailyUsage.lifetime_seconds + stmt.excluded.lifetime_seconds,
+            "focus_seconds": AppDailyUsage.focus_seconds + stmt.excluded.focus_seconds,
+            "synced": False,
+        },
+    )
+    db.execute(stmt, rows)
+
+
+def backfill_daily_usage(db: Session) -> int:
+    """
+    日汇总表为空而已有会话时（从旧版本升级），从 process_sessions 一次性重建日汇总，
+    返回写入的行数。表中已有数据时什么也不做。
+    """
+    if db.query(AppDailyUsage.id).first() is not None:
+        return 0
+
+    totals: Dict[Tuple[int, datetime.date], List[int]] = defaultdict(lambda: [0, 0])
+    sessions = db.query(
+        AppUsageSummary.application_id,
+        ProcessSession.session_start_time,
+        ProcessSession.session_end_time,
+        ProcessSession.total_lifetime_seconds,
+        ProcessSession.total_focus_seconds,
+    ).join(
+        AppUsageSummary, AppUsageSummary.id == ProcessSession.summary_id
+    ).filter(
+        ProcessSession.session_end_time.isnot(None)
+    ).yield_per(BACKFILL_CHUNK_SIZE)
+
+    for app_id, start, end, lifetime, focus in sessions:
+        for day, day_lifetime, day_focus in split_by_day(start, end, lifetime, focus):
+            row = totals[(app_id, day)]
+            row[0] += day_lifetime
+            row[1] += day_focus
+
+    if not totals:
+        return 0
+    db.bulk_insert_mappings(AppDailyUsage, [
+        {"application_id": app_id, "date": day, "lifetime_seconds": lifetime,
+         "focus_seconds": focus, "synced": False}
+        for (app_id, day), (lifetime, focus) in totals.items()
+    ])
+    db.commit()
+    return len(totals)
+
@@ -0,0 +1,167 @@
+"""
+本地数据库的微基准：对比旧的连接设置（回滚日志 + synchronous=FULL）与 local_database 中的连接配置。
+
+    python db_benchmark.py [--sessions 300] [--seconds 5] [--readers 2]
+
+1. 提交延迟：串行调用 record_process_session，统计每次保存会话的耗时；
+2. 读写并发：一个线程持续保存会话（模拟监控线程），若干线程反复执行主表查询（模拟界面/同步线程），
+   统计双方的吞吐、读延迟以及 "database is locked" 错误数。
+数据库建在临时目录中，不会碰真实数据。
+"""
+import argparse
+import contextlib
+import datetime
+import io
+import os
+import statistics
+import tempfile
+import threading
+import time
+
+from sqlalchemy import create_engine, event, func
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker, joinedload
+
+import tracking_service
+from local_database import DEFAULT_SQLITE_PROFILE, apply_sqlite_profile
+from local_models import Base, WatchedApplication, ProcessSession
+
+# 改动前 local_database 只设置了 foreign_keys，相当于 SQLite 的默认值
+LEGACY_PROFILE = {"journal_mode": "DELETE", "synchronous": "FULL"}
+
+APP_PATHS = [f"C:/Program Files/Bench/app{i}.exe" for i in range(20)]
+
+
+def _make_sessionmaker(db_path: str, profile: dict):
+    engine = create_engine(f"sqlite:///{db_path}", connect_args={"check_same_thread": False})
+
+    @event.listens_for(engine, "connect")
+    def _configure(dbapi_connection, connection_record):
+        apply_sqlite_profile(dbapi_connection, profile)
+
+    Base.metadata.create_all(bind=engine)
+    return engine, sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+
+def _save_session(SessionLocal, i: int) -> None:
+    path = APP_PATHS[i % len(APP_PATHS)]
+    start = datetime.datetime(2026, 1, 1) + datetime.timedelta(minutes=10 * i)
+    focus = {f"窗口 {j}": 30.0 for j in range(5)}
+    db = SessionLocal()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            tracking_service.record_process_session(
+                db, path, os.path.basename(path), start, start + datetime.timedelta(minutes=5), focus
+            )
+    finally:
+        db.close()
+
+
+def _read_main_table(SessionLocal) -> None:
+    db = SessionLocal()
+    try:
+        db.query(WatchedApplication).options(joinedload(WatchedApplication.summary)).all()
+        db.query(func.count(ProcessSession.id)).filter(ProcessSession.synced == False).scalar()
+    finally:
+        db.close()
+
+
+def _percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def bench_commit_latency(SessionLocal, sessions: int) -> dict:
+    latencies = []
+    for i in range(sessions):
+        t0 = time.perf_counter()
+        _save_session(SessionLocal, i)
+        latencies.append((time.perf_counter() - t0) * 1000)
+    return {
+        "p50_ms": statistics.median(latencies),
+        "p99_ms": _percentile(latencies, 0.99),
+        "sessions_per_s": sessions / (sum(latencies) / 1000),
+    }
+
+
+def bench_concurrency(SessionLocal, seconds: float, readers: int) -> dict:
+    stop = threading.Event()
+    writes, write_errors = [0], [0]
+    read_latencies, read_errors = [], [0]
+    lock = threading.Lock()
+
+    def writer():
+        i = 100_000
+        while not stop.is_set():
+            try:
+                _save_session(SessionLocal, i)
+                writes[0] += 1
+            except OperationalError:
+                write_errors[0] += 1
+            i += 1
+
+    def reader():
+        while not stop.is_set():
+            t0 = time.perf_counter()
+            try:
+                _read_main_table(SessionLocal)
+                with lock:
+                    read_latencies.append((time.perf_counter() - t0) * 1000)
+            except OperationalError:
+                with lock:
+                    read_errors[0] += 1
+
+    threads = [threading.Thread(target=writer)] + [threading.Thread(target=reader) for _ in range(readers)]
+    for t in threads:
+        t.start()
+    time.sleep(seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+    return {
+        "writes_per_s": writes[0] / seconds,
+        "reads_per_s": len(read_latencies) / seconds,
+        "read_p99_ms": _percentile(read_latencies, 0.99),
+        "locked_errors": write_errors[0] + read_errors[0],
+    }
+
+
+def run_profile(name: str, profile: dict, args) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        engine, SessionLocal = _make_sessionmaker(os.path.join(tmp, "bench.db"), profile)
+        try:
+            db = SessionLocal()
+            try:
+                for path in APP_PATHS:
+                    tracking_service.add_or_get_watched_app(db, path, os.path.basename(path))
+                tracking_service.warm_app_cache(db)
+            finally:
+                db.close()
+
+            latency = bench_commit_latency(SessionLocal, args.sessions)
+            concurrency = bench_concurrency(SessionLocal, args.seconds, args.readers)
+        finally:
+            engine.dispose()
+
+    print(f"[{name}] {profile}")
+    print(f"  保存会话: p50 {latency['p50_ms']:.2f} ms, p99 {latency['p99_ms']:.2f} ms, "
+          f"{latency['sessions_per_s']:.0f} 个/秒")
+    print(f"  读写并发: 写 {concurrency['writes_per_s']:.0f} 个/秒, 读 {concurrency['reads_per_s']:.0f} 次/秒, "
+          f"读 p99 {concurrency['read_p99_ms']:.2f} ms, locked 错误 {concurrency['locked_errors']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地 SQLite 连接配置的微基准")
+    parser.add_argument("--sessions", type=int, default=300, help="测提交延迟时串行保存的会话数")
+    parser.add_argument("--seconds", type=float, default=5.0, help="读写并发测试持续的秒数")
+    parser.add_argument("--readers", type=int, default=2, help="并发读线程数")
+    args = parser.parse_args()
+
+    run_profile("旧设置", LEGACY_PROFILE, args)
+    run_profile("当前配置", DEFAULT_SQLITE_PROFILE, args)
+
+
+if __name__ == "__main__":
+    main()
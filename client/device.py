@@ -0,0 +1,49 @@
+import os
+import uuid
+import socket
+from urllib.parse import quote
+
+from data_dir import get_data_dir
+
+# 设备标识与本地数据库放在同一个数据目录中：
+# 重装程序但保留数据目录时标识不变，服务器的高水位仍然对得上
+_DEVICE_ID_FILE = "device_id"
+_device_id = None
+
+
+def get_device_id() -> str:
+    """返回本机的设备标识，首次调用时生成并写入数据目录"""
+    global _device_id
+    if _device_id:
+        return _device_id
+
+    data_dir = get_data_dir()
+    os.makedirs(data_dir, exist_ok=True)
+    path = os.path.join(data_dir, _DEVICE_ID_FILE)
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            value = f.read().strip()
+        if value:
+            _device_id = value
+            return _device_id
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        print(f"[Device] 读取设备标识失败，将重新生成: {e}")
+
+    _device_id = uuid.uuid4().hex
+    try:
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(_device_id)
+    except Exception as e:
+        print(f"[Device] 保存设备标识失败: {e}")
+    return _device_id
+
+
+def get_device_name() -> str:
+    """设备的显示名称（主机名）。HTTP 头只能是 latin-1，非 ASCII 字符做 URL 编码。"""
+    try:
+        name = socket.gethostname()
+    except Exception:
+        return ""
+    return name if name.isascii() else quote(name)
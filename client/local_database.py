@@ -1,8 +1,8 @@
 import os
 from sqlalchemy import create_engine, text, event
 from sqlalchemy.orm import sessionmaker
-from local_models import Base
 from data_dir import get_data_dir
+from settings import Settings
 
 data_dir = get_data_dir()
 os.makedirs(data_dir, exist_ok=True)
@@ -10,6 +10,40 @@ db_path = os.path.join(data_dir, "local_client.db")
 
 # DATABASE_URL 格式 (SQLite)
 DATABASE_URL = f"sqlite:///{db_path}"
+
+# 每个连接建立时设置的 PRAGMA。监控线程、同步线程和界面线程共用同一个文件：
+# WAL 模式下读写互不阻塞，synchronous=NORMAL 在 WAL 下只在检查点时 fsync，
+# busy_timeout 让偶尔的写写冲突等待而不是直接报 "database is locked"。
+# 可在 settings.json 的 "sqliteProfile" 中覆盖单项，例如数据目录在网络盘上时改用 {"journal_mode": "DELETE"}
+DEFAULT_SQLITE_PROFILE = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "busy_timeout": 5000,       # 毫秒
+    "cache_size": -16000,       # 负数表示 KiB，即 16 MB
+    "mmap_size": 64 * 1024 * 1024,
+    "temp_store": "MEMORY",
+}
+# WAL 检查点的间隔（毫秒），由主窗口的定时器调用 checkpoint_wal
+WAL_CHECKPOINT_INTERVAL_MS = 5 * 60 * 1000
+
+
+def load_sqlite_profile() -> dict:
+    profile = dict(DEFAULT_SQLITE_PROFILE)
+    overrides = Settings().get("sqliteProfile") or {}
+    profile.update({k: v for k, v in overrides.items() if k in DEFAULT_SQLITE_PROFILE})
+    return profile
+
+
+def apply_sqlite_profile(dbapi_connection, profile: dict) -> None:
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA foreign_keys=ON")
+    for name, value in profile.items():
+        cursor.execute(f"PRAGMA {name}={value}")
+    cursor.close()
+
+
+sqlite_profile = load_sqlite_profile()
+
 # 创建数据库引擎
 # connect_args 是 SQLite 多线程使用的重要参数
 engine = create_engine(
@@ -19,10 +53,32 @@ engine = create_engine(
 
 
 @event.listens_for(engine, "connect")
-def enable_sqlite_foreign_keys(dbapi_connection, connection_record):
-    cursor = dbapi_connection.cursor()
-    cursor.execute("PRAGMA foreign_keys=ON")
-    cursor.close()
+def configure_sqlite_connection(dbapi_connection, connection_record):
+    apply_sqlite_profile(dbapi_connection, sqlite_profile)
+
+
+def checkpoint_wal() -> None:
+    """把 WAL 中的内容写回主库（PASSIVE：不等待、不阻塞正在进行的读写），避免 -wal 文件无限增长"""
+    if str(sqlite_profile.get("journal_mode", "")).upper() != "WAL":
+        return
+    try:
+        with engine.connect() as conn:
+            busy, log_frames, checkpointed = conn.execute(text("PRAGMA wal_checkpoint(PASSIVE)")).one()
+            if log_frames:
+                print(f"[Database] WAL 检查点: {checkpointed}/{log_frames} 页已写回主库")
+    except Exception as e:
+        print(f"[Database] WAL 检查点失败: {e}")
+
+
+def optimize_on_shutdown() -> None:
+    """退出前让 SQLite 按需更新查询规划所用的统计信息，并关闭连接池"""
+    try:
+        with engine.connect() as conn:
+            conn.execute(text("PRAGMA optimize"))
+    except Exception as e:
+        print(f"[Database] PRAGMA optimize 失败: {e}")
+    finally:
+        engine.dispose()
 
 #创建数据库会话
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
@@ -30,17 +86,8 @@ SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 #创建数据库表
 def create_db_and_tables():
     """
-    在应用首次启动时调用，用于创建数据库文件和所有表。
+    在应用启动时调用，用于创建数据库文件并执行尚未执行的迁移。
+    已是最新版本时只读取一次 PRAGMA user_version。
     """
-    Base.metadata.create_all(bind=engine)
-
-    # 增量迁移：给已有表添加新列（如果不存在）
-    with engine.connect() as conn:
-        try:
-            conn.execute(text(
-                "ALTER TABLE watched_applications ADD COLUMN is_watched BOOLEAN NOT NULL DEFAULT 1"
-            ))
-            conn.commit()
-        except Exception:
-            pass  # 列已存在则跳过
-
+    from local_migrations import run_migrations
+    run_migrations(engine)
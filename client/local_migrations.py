@@ -0,0 +1,146 @@
+"""
+本地数据库的版本化迁移。
+
+数据库文件的 PRAGMA user_version 记录已执行到第几步，启动时只读一次这个值：
+与 SCHEMA_VERSION 相同时不执行任何 DDL；落后时按顺序执行缺少的步骤，每步成功后立即写入新版本号。
+新增迁移时在 MIGRATIONS 末尾追加一步即可，已发布的步骤不要修改或调换顺序。
+每一步都要能在"全新数据库"上安全执行：第 1 步的 create_all 已按最新模型建表，之后的步骤需先检查再修改。
+迁移期间关闭外键约束（SQLite 只允许在事务外切换），以便重建被其他表引用的表。
+"""
+from typing import Callable, List
+
+from sqlalchemy import MetaData, text
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.schema import CreateTable
+from sqlalchemy.orm import Session
+
+from local_models import AppUsageSummary, Base, ProcessSession, SyncState
+
+
+def _column_exists(conn: Connection, table: str, column: str) -> bool:
+    return any(row[1] == column for row in conn.execute(text(f"PRAGMA table_info({table})")))
+
+
+def _create_tables(conn: Connection) -> None:
+    """创建所有缺少的表（全新数据库，或早于版本化迁移的旧数据库）"""
+    Base.metadata.create_all(bind=conn)
+
+
+def _add_is_watched(conn: Connection) -> None:
+    if not _column_exists(conn, "watched_applications", "is_watched"):
+        conn.execute(text(
+            "ALTER TABLE watched_applications ADD COLUMN is_watched BOOLEAN NOT NULL DEFAULT 1"
+        ))
+
+
+def _backfill_daily_usage(conn: Connection) -> None:
+    """从旧版本升级：日汇总表还是空的，用已有会话回填一次"""
+    from daily_usage import backfill_daily_usage
+    db = Session(bind=conn)
+    try:
+        rows = backfill_daily_usage(db)
+        if rows:
+            print(f"已从历史会话回填 {rows} 条日汇总记录。")
+    finally:
+        db.close()
+
+
+def _mark_activity_synced_sessions(conn: Connection) -> None:
+    """
+    同步改为按会话的 synced 标记进行之前，旧版本只标记焦点活动。
+    把焦点活动已全部同步的会话标记为已同步，避免升级后整批重新上传；没有焦点活动的会话从未上传过，保持未同步
+    """
+    conn.execute(text(
+        "UPDATE process_sessions SET synced = 1 "
+        "WHERE synced = 0 "
+        "AND EXISTS (SELECT 1 FROM focus_activities a WHERE a.session_id = process_sessions.id) "
+        "AND NOT EXISTS (SELECT 1 FROM focus_activities a WHERE a.session_id = process_sessions.id AND a.synced = 0)"
+    ))
+
+
+def _create_sync_state(conn: Connection) -> None:
+    """
+    新增同步水位表。会话的初始水位取第一个未同步会话之前的 id（全部已同步时取最大 id），
+    水位之后已同步过的会话可能被重传一次，由服务器按设备去重
+    """
+    SyncState.__table__.create(bind=conn, checkfirst=True)
+    conn.execute(text(
+        "INSERT OR IGNORE INTO sync_state (name, last_synced_id) "
+        "SELECT 'process_sessions', COALESCE("
+        "(SELECT MIN(id) - 1 FROM process_sessions WHERE synced = 0), "
+        "(SELECT MAX(id) FROM process_sessions), 0)"
+    ))
+
+
+def _autoincrement_session_ids(conn: Connection) -> None:
+    """
+    会话 id 改为 AUTOINCREMENT，删除会话后不再复用其 id（同步水位和服务器去重都以它为准）。
+    SQLite 不能修改已有表的主键定义，只能按新模型建表、复制数据后替换旧表；
+    已删除会话的 id 可能已经上传过，序列从现有最大 id 与同步水位中较大者继续
+    """
+    sql = conn.execute(text(
+        "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'process_sessions'"
+    )).scalar() or ""
+    if "AUTOINCREMENT" in sql.upper():
+        return
+
+    table = ProcessSession.__table__
+    metadata = MetaData()
+    AppUsageSummary.__table__.to_metadata(metadata)  # 外键引用的表，生成 DDL 时需要
+    new_table = table.to_metadata(metadata, name="process_sessions_new")
+    existing = {row[1] for row in conn.execute(text("PRAGMA table_info(process_sessions)"))}
+    columns = ", ".join(c.name for c in table.columns if c.name in existing)
+    conn.execute(CreateTable(new_table))
+    conn.execute(text(f"INSERT INTO process_sessions_new ({columns}) SELECT {columns} FROM process_sessions"))
+    conn.execute(text("DROP TABLE process_sessions"))
+    conn.execute(text("ALTER TABLE process_sessions_new RENAME TO process_sessions"))
+    for index in table.indexes:
+        index.create(bind=conn, checkfirst=True)
+
+    # 复制数据时 SQLite 已按最大 id 写入序列（表为空时没有这一行），这里再与同步水位取较大者
+    conn.execute(text("DELETE FROM sqlite_sequence WHERE name = 'process_sessions'"))
+    conn.execute(text(
+        "INSERT INTO sqlite_sequence (name, seq) SELECT 'process_sessions', MAX("
+        "COALESCE((SELECT MAX(id) FROM process_sessions), 0), "
+        "COALESCE((SELECT last_synced_id FROM sync_state WHERE name = 'process_sessions'), 0))"
+    ))
+    if conn.execute(text("PRAGMA foreign_key_check(focus_activities)")).first() is not None:
+        raise RuntimeError("重建 process_sessions 后焦点活动的外键不一致")
+
+
+# 第 i 步执行后 user_version 为 i + 1
+MIGRATIONS: List[Callable[[Connection], None]] = [
+    _create_tables,
+    _add_is_watched,
+    _backfill_daily_usage,
+    _mark_activity_synced_sessions,
+    _create_sync_state,
+    _autoincrement_session_ids,
+]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def get_user_version(conn: Connection) -> int:
+    return conn.execute(text("PRAGMA user_version")).scalar() or 0
+
+
+def run_migrations(engine: Engine) -> int:
+    """执行尚未执行的迁移步骤，返回执行的步数"""
+    with engine.connect() as conn:
+        version = get_user_version(conn)
+    if version >= SCHEMA_VERSION:
+        return 0
+
+    for step, migrate in enumerate(MIGRATIONS[version:], start=version + 1):
+        with engine.connect() as conn:
+            conn.exec_driver_sql("PRAGMA foreign_keys=OFF")
+            conn.commit()
+            try:
+                with conn.begin():
+                    migrate(conn)
+                    conn.execute(text(f"PRAGMA user_version = {step}"))
+            finally:
+                conn.exec_driver_sql("PRAGMA foreign_keys=ON")
+                conn.commit()
+        print(f"[Database] 已执行迁移 {step}/{SCHEMA_VERSION}: {migrate.__name__.lstrip('_')}")
+    return SCHEMA_VERSION - version
@@ -226,6 +226,9 @@ class ProcessSession(Base):
             name="ck_session_end_after_start",
         ),
         Index("idx_process_sessions_synced", "synced"),
+        # 会话 id 同时是同步水位和服务器去重的依据，必须只增不减：
+        # 不加 AUTOINCREMENT 时，删除 id 最大的会话（彻底删除应用）后 SQLite 会复用该 id
+        {"sqlite_autoincrement": True},
     )
 
     def __repr__(self):
@@ -289,3 +292,23 @@ class FocusActivity(Base):
             f"duration={self.focus_duration_seconds}s"
             f")>"
         )
+
+
+class SyncState(Base):
+    __tablename__ = "sync_state"
+
+    # 被同步的表名，如 "process_sessions"
+    name = Column(String, primary_key=True)
+
+    # 已同步的最大 id：id 不超过它的行都已处理完毕，待同步的行为 id > last_synced_id
+    last_synced_id = Column(Integer, nullable=False, default=0)
+
+    updated_at = Column(DateTime, nullable=True)
+
+    def __repr__(self):
+        return (
+            f"<SyncState("
+            f"name='{self.name}', "
+            f"last_synced_id={self.last_synced_id}"
+            f")>"
+        )
@@ -7,6 +7,7 @@ from PySide6.QtCore import QLockFile  # Qt 提供的跨平台文件锁工具
 
 from main_window import Mywindow  # 自定义主窗口
 from local_database import create_db_and_tables  # 数据库初始化工具
+from app_repository import AppRepository  # 应用数据访问
 from settings import Settings  # 配置读取工具
 from theme import apply_theme  # 主题应用工具
 import autostart  # 开机自启动相关工具
@@ -121,6 +122,7 @@ if __name__ == "__main__":
     print("正在初始化数据库...")
     create_db_and_tables()
     print("数据库初始化完成。")
+    print(f"已缓存 {AppRepository.warm_tracking_cache()} 个应用的 id。")
 
     # ========================================================
     # 第五步：修复开机自启动路径
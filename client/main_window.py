@@ -26,9 +26,8 @@ from search_utils import make_search_keywords, matches_search_keywords
 
 from dialogs import AppDetailDialog, ClosingDialog, AddAppDialog
 from login_dialog import LoginDialog
-from sync_service import get_and_prepare_sync_data, mark_activities_as_synced
-from client_api import send_data_to_api
-from services import retry_failed_sessions, get_failed_queue_count
+from services import get_failed_queue_count
+from local_database import checkpoint_wal, optimize_on_shutdown, WAL_CHECKPOINT_INTERVAL_MS
 
 
 def _themed_icon(svg_path, color):
@@ -216,15 +215,18 @@ class Mywindow(QMainWindow):
         self.monitor_controller.status_updated.connect(self.table_manager.update_status)
         self.monitor_controller.session_finished.connect(self._refresh_table)
         self.monitor_controller.session_save_failed.connect(self._on_session_save_failed)
+        self.monitor_controller.failed_sessions_retried.connect(self._on_failed_sessions_retried)
 
         self.sync_controller = SyncController(token_provider=lambda: self.token, parent=self)
         self.sync_controller.status_updated.connect(self.update_status_bar)
+        # 会话保存后触发同步（后台合并几秒内的多个会话再上传）
+        self.monitor_controller.session_finished.connect(self.sync_controller.request_sync)
 
-        # 失败会话重试定时器（每 30 秒检查一次）
-        self._retry_timer = QTimer(self)
-        self._retry_timer.setInterval(30_000)
-        self._retry_timer.timeout.connect(self._retry_failed_sessions)
-        self._retry_timer.start()
+        # 定期把 WAL 写回主库
+        self._checkpoint_timer = QTimer(self)
+        self._checkpoint_timer.setInterval(WAL_CHECKPOINT_INTERVAL_MS)
+        self._checkpoint_timer.timeout.connect(checkpoint_wal)
+        self._checkpoint_timer.start()
 
         # ---- 系统托盘 ----
         self._setup_tray_icon()
@@ -498,10 +500,7 @@ class Mywindow(QMainWindow):
     def run_immediate_sync(self):
         if not self.token:
             return
-        data, marks = get_and_prepare_sync_data()
-        if data and send_data_to_api(data, "/sync/sessions/", self.token):
-            mark_activities_as_synced(marks)
-            self.update_status_bar("同步成功")
+        self.sync_controller.sync_now()
 
     def _on_session_save_failed(self, exe_name: str, error: str):
         count = get_failed_queue_count()
@@ -509,10 +508,11 @@ class Mywindow(QMainWindow):
             f"⚠ 保存失败: {exe_name} — {error}（队列中 {count} 条待重试）", 8000
         )
 
-    def _retry_failed_sessions(self):
-        success, remaining = retry_failed_sessions()
+    def _on_failed_sessions_retried(self, success: int, remaining: int):
+        """监控线程完成一轮失败会话重试后调用"""
         if success > 0:
             self._refresh_table()
+            self.sync_controller.request_sync()
             self.statusBar().showMessage(
                 f"成功恢复 {success} 条会话记录，剩余 {remaining} 条待重试", 5000
             )
@@ -575,6 +575,10 @@ class Mywindow(QMainWindow):
             timeout_ms=3000, dialog=self._closing_dialog, status_text="正在停止同步服务"
         )
 
+        self._closing_dialog.set_status("正在整理本地数据库...")
+        self._checkpoint_timer.stop()
+        optimize_on_shutdown()
+
         self._closing_dialog.set_status("保存完成，正在关闭...")
         QApplication.processEvents()
         QTimer.singleShot(300, self._finish_close_event)
@@ -8,6 +8,7 @@ class MonitorController(QObject):
     status_updated = Signal(dict)
     session_finished = Signal(str, int)
     session_save_failed = Signal(str, str)
+    failed_sessions_retried = Signal(int, int)
 
     def __init__(self, parent=None):
         super().__init__(parent)
@@ -25,6 +26,7 @@ class MonitorController(QObject):
         self._worker.status_updated.connect(self.status_updated)
         self._worker.session_finished.connect(self.session_finished)
         self._worker.session_save_failed.connect(self.session_save_failed)
+        self._worker.failed_sessions_retried.connect(self.failed_sessions_retried)
         self._thread.finished.connect(self._on_thread_finished)
         self._thread.start()
 
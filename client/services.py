@@ -3,36 +3,103 @@ import json
 import psutil
 import datetime
 import time
+import uuid
+import threading
 import win32gui
 import win32process
 from PySide6.QtCore import QObject, Signal, QMutex, QMutexLocker
-from typing import List, Dict, TypedDict
+from typing import List, Dict, Tuple, TypedDict
 from path_utils import normalize_exe_path
 from data_dir import get_data_dir
 
-# --- 失败队列文件路径 ---
+# --- 失败会话日志 ---
+# 保存失败的会话追加写入 JSON Lines 日志（每行一条记录，写入后 fsync），入队是 O(1) 的，
+# 进程在写入中途崩溃最多损坏最后一行，读取时跳过即可。记录类型：
+#   {"op": "add", "id": ..., 会话数据...}       新的失败会话
+#   {"op": "update", "id": ..., "retry_count": ..., "last_error": ..., "failed_at": ...}  重试失败后更新状态
+#   {"op": "done", "id": ...}                    重试成功，移出队列
+# 读取时按顺序回放得到当前队列；作废的记录过多时整体重写（压缩）一次。
 _FAILED_QUEUE_DIR = get_data_dir()
 os.makedirs(_FAILED_QUEUE_DIR, exist_ok=True)
-_FAILED_QUEUE_PATH = os.path.join(_FAILED_QUEUE_DIR, "failed_sessions.json")
+_FAILED_JOURNAL_PATH = os.path.join(_FAILED_QUEUE_DIR, "failed_sessions.jsonl")
+# 旧版本整体重写的 JSON 队列文件，首次读取日志时导入
+_LEGACY_QUEUE_PATH = os.path.join(_FAILED_QUEUE_DIR, "failed_sessions.json")
 _MAX_RETRIES = 10
-
-
-def _load_failed_queue() -> List[dict]:
-    if not os.path.exists(_FAILED_QUEUE_PATH):
-        return []
-    try:
-        with open(_FAILED_QUEUE_PATH, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except Exception:
-        return []
-
-
-def _save_failed_queue(queue: List[dict]) -> None:
+# 每轮最多重试的会话数
+RETRY_BATCH_SIZE = 50
+# 重试间隔（秒），由监控线程调用
+RETRY_INTERVAL_SECONDS = 30
+# 每轮重试的时间预算（秒）：重试在监控线程中进行，用完后剩余的留到下一轮，不长时间耽误焦点采样
+RETRY_TIME_BUDGET_SECONDS = 2.0
+# 日志行数超过这个值且超过有效条目数的两倍时压缩
+_COMPACT_MIN_LINES = 200
+
+_journal_lock = threading.Lock()
+
+
+def _append_records(records: List[dict]) -> None:
+    """追加若干条记录并 fsync，调用方持有 _journal_lock"""
+    lines = "".join(json.dumps(r, ensure_ascii=False, default=str) + "\n" for r in records).encode("utf-8")
+    with open(_FAILED_JOURNAL_PATH, "a+b") as f:
+        # 上次崩溃留下了没有换行的半行时先补一个换行，否则新记录会和它拼在一起一起丢失
+        if f.seek(0, os.SEEK_END) > 0:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b"\n":
+                lines = b"\n" + lines
+        f.write(lines)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def _import_legacy_queue() -> None:
+    """把旧版的 failed_sessions.json 导入日志，然后改名保留，调用方持有 _journal_lock"""
+    if not os.path.exists(_LEGACY_QUEUE_PATH):
+        return
     try:
-        with open(_FAILED_QUEUE_PATH, "w", encoding="utf-8") as f:
-            json.dump(queue, f, ensure_ascii=False, indent=2, default=str)
+        with open(_LEGACY_QUEUE_PATH, "r", encoding="utf-8") as f:
+            items = json.load(f)
+        records = [{"op": "add", "id": uuid.uuid4().hex, **item} for item in items if isinstance(item, dict)]
+        if records:
+            _append_records(records)
+        os.replace(_LEGACY_QUEUE_PATH, _LEGACY_QUEUE_PATH + ".migrated")
+        print(f"[Failed Queue] 已将旧队列中的 {len(records)} 条会话导入日志")
     except Exception as e:
-        print(f"[Failed Queue] 写入队列文件失败: {e}")
+        print(f"[Failed Queue] 导入旧队列失败: {e}")
+
+
+def _load_journal() -> Tuple[Dict[str, dict], int]:
+    """回放日志，返回 (id -> 当前条目, 日志行数)，调用方持有 _journal_lock"""
+    _import_legacy_queue()
+    entries: Dict[str, dict] = {}
+    line_count = 0
+    if not os.path.exists(_FAILED_JOURNAL_PATH):
+        return entries, 0
+    with open(_FAILED_JOURNAL_PATH, "r", encoding="utf-8") as f:
+        for line in f:
+            line_count += 1
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # 崩溃时写了一半的行
+            op, entry_id = record.pop("op", None), record.get("id")
+            if op == "add":
+                entries[entry_id] = record
+            elif op == "update" and entry_id in entries:
+                entries[entry_id].update(record)
+            elif op == "done":
+                entries.pop(entry_id, None)
+    return entries, line_count
+
+
+def _compact_journal(entries: Dict[str, dict]) -> None:
+    """只保留有效条目重写日志：先写临时文件再原子替换，调用方持有 _journal_lock"""
+    tmp_path = _FAILED_JOURNAL_PATH + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        for entry in entries.values():
+            f.write(json.dumps({"op": "add", **entry}, ensure_ascii=False, default=str) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, _FAILED_JOURNAL_PATH)
 
 
 def _enqueue_failed_session(
@@ -43,8 +110,9 @@ def _enqueue_failed_session(
     focus_details: dict,
     error: str,
 ) -> None:
-    queue = _load_failed_queue()
-    queue.append({
+    record = {
+        "op": "add",
+        "id": uuid.uuid4().hex,
         "executable_path": exe_path,
         "executable_name": exe_name,
         "start_time": start_time.isoformat(),
@@ -53,36 +121,38 @@ def _enqueue_failed_session(
         "retry_count": 0,
         "last_error": str(error),
         "failed_at": datetime.datetime.now().isoformat(),
-    })
-    _save_failed_queue(queue)
-    print(f"[Failed Queue] 会话已入队，当前队列长度: {len(queue)}")
+    }
+    try:
+        with _journal_lock:
+            _append_records([record])
+        print("[Failed Queue] 会话已写入失败日志，稍后重试")
+    except Exception as e:
+        print(f"[Failed Queue] 写入失败日志出错: {e}")
 
 
-def retry_failed_sessions() -> tuple[int, int]:
+def retry_failed_sessions(limit: int = RETRY_BATCH_SIZE,
+                          time_budget: float = RETRY_TIME_BUDGET_SECONDS) -> tuple[int, int]:
     """
-    在主线程中调用，重试队列中的失败会话。
+    在监控线程中定期调用，重试日志中最早的至多 limit 条失败会话，用完 time_budget 秒后停止。
+    每条的结果在其提交后立即写入日志，中途崩溃也不会把已保存的会话再保存一次。
     返回 (成功数, 剩余数)。
     """
     from local_database import SessionLocal
     from tracking_service import record_process_session
 
-    queue = _load_failed_queue()
-    if not queue:
-        return 0, 0
+    with _journal_lock:
+        entries, line_count = _load_journal()
+    batch = [e for e in entries.values() if e.get("retry_count", 0) < _MAX_RETRIES][:limit]
+    if not batch:
+        return 0, len(entries)
 
+    deadline = time.monotonic() + time_budget
     success_count = 0
-    remaining = []
-
-    for item in queue:
-        if item.get("retry_count", 0) >= _MAX_RETRIES:
-            print(f"[Failed Queue] 跳过已达最大重试次数的会话: {item['executable_name']}")
-            remaining.append(item)
-            continue
-
-        item["retry_count"] = item.get("retry_count", 0) + 1
-
+    for item in batch:
+        if time.monotonic() >= deadline:
+            break
+        db = SessionLocal()
         try:
-            db = SessionLocal()
             record_process_session(
                 db=db,
                 executable_path=item["executable_path"],
@@ -91,21 +161,44 @@ def retry_failed_sessions() -> tuple[int, int]:
                 end_time=datetime.datetime.fromisoformat(item["end_time"]),
                 focus_details=item["focus_details"],
             )
-            db.close()
             success_count += 1
+            outcome = {"op": "done", "id": item["id"]}
+            entries.pop(item["id"], None)
             print(f"[Failed Queue] 重试成功: {item['executable_name']}")
         except Exception as e:
-            item["last_error"] = str(e)
-            item["failed_at"] = datetime.datetime.now().isoformat()
-            remaining.append(item)
-            print(f"[Failed Queue] 重试失败 ({item['retry_count']}/{_MAX_RETRIES}): {item['executable_name']} - {e}")
+            retry_count = item.get("retry_count", 0) + 1
+            outcome = {
+                "op": "update",
+                "id": item["id"],
+                "retry_count": retry_count,
+                "last_error": str(e),
+                "failed_at": datetime.datetime.now().isoformat(),
+            }
+            print(f"[Failed Queue] 重试失败 ({retry_count}/{_MAX_RETRIES}): {item['executable_name']} - {e}")
+        finally:
+            db.close()
+        try:
+            with _journal_lock:
+                _append_records([outcome])
+            line_count += 1
+        except Exception as e:
+            print(f"[Failed Queue] 更新失败日志出错: {e}")
 
-    _save_failed_queue(remaining)
-    return success_count, len(remaining)
+    try:
+        with _journal_lock:
+            if not entries or (line_count > _COMPACT_MIN_LINES and line_count > 2 * len(entries)):
+                # 压缩前重新回放，包含本轮期间新入队的会话
+                current, _ = _load_journal()
+                _compact_journal(current)
+    except Exception as e:
+        print(f"[Failed Queue] 压缩失败日志出错: {e}")
+    return success_count, len(entries)
 
 
 def get_failed_queue_count() -> int:
-    return len(_load_failed_queue())
+    with _journal_lock:
+        entries, _ = _load_journal()
+    return len(entries)
 
 
 # --- 基础类型 ---
@@ -148,6 +241,7 @@ class GlobalMonitorWorker(QObject):
     status_updated = Signal(dict)
     session_finished = Signal(str, int)
     session_save_failed = Signal(str, str)
+    failed_sessions_retried = Signal(int, int)  # (成功数, 剩余数)
     finished = Signal()
 
     def __init__(self, watched_apps_info: List[tuple]):
@@ -164,6 +258,7 @@ class GlobalMonitorWorker(QObject):
         self._mutex = QMutex()
         self._active_sessions: Dict[int, ActiveSession] = {}
         self._last_tick = None
+        self._last_retry = time.monotonic()
 
     def update_watch_list(self, new_list: List[tuple]):
         """
@@ -202,6 +297,7 @@ class GlobalMonitorWorker(QObject):
                     self._check_processes_lifecycle_nonblocking()
                     self._check_focus_nonblocking(1.0)
                 self._emit_status()
+                self._retry_failed_sessions_if_due()
 
                 # 灵敏等待，每 0.1 秒检查一次是否停止，总共 1 秒
                 for _ in range(10):
@@ -291,6 +387,16 @@ class GlobalMonitorWorker(QObject):
         finally:
             db.close()
 
+    def _retry_failed_sessions_if_due(self):
+        """每隔 RETRY_INTERVAL_SECONDS 在本线程中分批重试失败会话，不占用界面线程；每轮受 RETRY_TIME_BUDGET_SECONDS 限制"""
+        now = time.monotonic()
+        if now - self._last_retry < RETRY_INTERVAL_SECONDS:
+            return
+        self._last_retry = now
+        success, remaining = retry_failed_sessions()
+        if success or remaining:
+            self.failed_sessions_retried.emit(success, remaining)
+
     def _force_close_all(self):
         for pid, session in self._active_sessions.items():
             self._save_session(session)
@@ -1,12 +1,15 @@
 from PySide6.QtCore import QObject, Signal, QThread, Qt
 from sync_service import ApiSyncWorker
 from shutdown_helper import wait_for_thread
+from client_api import close_http_session
 from typing import Callable, Optional
 
 
 class SyncController(QObject):
     status_updated = Signal(str)
     _request_stop = Signal()
+    _request_sync = Signal()
+    _request_sync_now = Signal()
 
     def __init__(self, token_provider: Callable[[], Optional[str]], parent=None):
         super().__init__(parent)
@@ -22,17 +25,30 @@ class SyncController(QObject):
         self._worker.moveToThread(self._thread)
         self._thread.started.connect(self._worker.start_service)
         self._request_stop.connect(self._worker.stop, Qt.QueuedConnection)
+        self._request_sync.connect(self._worker.request_sync, Qt.QueuedConnection)
+        self._request_sync_now.connect(self._worker.sync_now, Qt.QueuedConnection)
         self._worker.status_updated.connect(self.status_updated, Qt.QueuedConnection)
         self._worker.finished.connect(self._thread.quit)
         self._thread.finished.connect(self._on_thread_finished)
         self._thread.start()
 
+    def request_sync(self):
+        """通知后台有新数据待同步（可在任意线程调用，由 worker 线程合并处理）"""
+        if self._worker:
+            self._request_sync.emit()
+
+    def sync_now(self):
+        """用户登录或手动同步：结束失败退避，立即同步一次"""
+        if self._worker:
+            self._request_sync_now.emit()
+
     def stop(self, timeout_ms=3000, dialog=None, status_text=""):
         if self._worker and self._thread and self._thread.isRunning():
             print("[SyncController] 正在停止同步线程...")
             self._request_stop.emit()
             wait_for_thread(self._thread, timeout_ms, dialog, status_text)
             print("[SyncController] 同步线程已停止")
+        close_http_session()
 
     def _on_thread_finished(self):
         if self._worker:
@@ -1,106 +1,380 @@
-
+import gzip
+import json
+import os
+import random
+import tempfile
 from PySide6.QtCore import QObject, Signal, Slot, QTimer, Qt
-from sqlalchemy.orm import joinedload, Session
+from sqlalchemy.orm import Session
 from local_database import SessionLocal
-from local_models import FocusActivity, ProcessSession, AppUsageSummary
-from client_api import send_data_to_api
-from typing import List
+from local_models import FocusActivity, ProcessSession, AppUsageSummary, WatchedApplication
+import sync_state
+from client_api import send_data_to_api, fetch_sync_cursor, upload_import_file, SendResult
+from typing import Iterator, List, NamedTuple, Optional, Iterable, Tuple
+
+# 每次上传的会话数和请求体大小上限（服务器默认拒绝超过 8 MB 的同步请求）。
+# 长时间离线后也按小批依次上传，每批上传并标记后才读取下一批，内存占用与积压量无关
+SYNC_BATCH_MAX_SESSIONS = 200
+SYNC_BATCH_MAX_BYTES = 1024 * 1024
+
+# 同步调度：新会话保存后等待一个合并窗口再上传；空闲时的心跳间隔；失败后的指数退避（秒）
+SYNC_DEBOUNCE_SECONDS = 5
+SYNC_HEARTBEAT_SECONDS = 30 * 60
+SYNC_BACKOFF_BASE_SECONDS = 30
+SYNC_BACKOFF_MAX_SECONDS = 30 * 60
+SYNC_BACKOFF_JITTER = 0.2
+
+
+class SyncBatch(NamedTuple):
+    sessions: List[dict]      # 上传给服务器的会话
+    session_ids: List[int]    # 本批包含的本地会话 id
+
+
+def _read_pending_sessions(db: Session, after_id: int, limit: int) -> List[dict]:
+    """
+    读取 id 大于 after_id 的未同步会话（包括没有焦点活动的后台进程），按主键范围扫描，
+    并一次带上每个会话的全部焦点活动，只取上传需要的列
+    """
+    sessions = db.query(
+        ProcessSession.id,
+        ProcessSession.process_name,
+        WatchedApplication.executable_path,
+        ProcessSession.session_start_time,
+        ProcessSession.session_end_time,
+        ProcessSession.total_lifetime_seconds,
+        ProcessSession.total_focus_seconds,
+    ).join(
+        AppUsageSummary, AppUsageSummary.id == ProcessSession.summary_id
+    ).join(
+        WatchedApplication, WatchedApplication.id == AppUsageSummary.application_id
+    ).filter(
+        ProcessSession.id > after_id,
+        ProcessSession.synced == False,
+        ProcessSession.session_end_time.isnot(None),
+    ).order_by(ProcessSession.id).limit(limit).all()
+
+    result = {}
+    for session_id, process_name, path, start, end, lifetime, focus in sessions:
+        result[session_id] = {
+            "client_session_id": session_id,
+            "process_name": process_name,
+            "executable_path": path,
+            # 本地时间带上 UTC 偏移再发送，服务器统一换算为 UTC
+            "session_start_time": start.astimezone().isoformat(),
+            "session_end_time": end.astimezone().isoformat(),
+            "total_lifetime_seconds": lifetime,
+            "total_focus_seconds": focus,
+            "activities": [],
+        }
+    if not result:
+        return []
+
+    activities = db.query(
+        FocusActivity.session_id,
+        FocusActivity.window_title,
+        FocusActivity.focus_duration_seconds,
+    ).filter(
+        FocusActivity.session_id.in_(list(result)),
+    ).order_by(FocusActivity.id).all()
+    for session_id, title, seconds in activities:
+        result[session_id]["activities"].append({
+            "window_title": title,
+            "focus_duration_seconds": seconds,
+        })
+    return list(result.values())
+
+
+def iter_sync_batches(
+    max_sessions: int = SYNC_BATCH_MAX_SESSIONS,
+    max_bytes: int = SYNC_BATCH_MAX_BYTES,
+) -> Iterator[SyncBatch]:
+    """
+    从同步水位之后按会话 id 顺序逐批产生待上传的数据，每批不超过 max_sessions 个会话、约 max_bytes 字节
+    （单个会话超过 max_bytes 时单独成批）。每批读取都在独立的短会话中完成，
+    调用方应在上传并标记当前批之后再取下一批。
+    """
+    last_id = None
+    pending: List[dict] = []
+    while True:
+        if not pending:
+            db = SessionLocal()
+            try:
+                if last_id is None:
+                    last_id = sync_state.get_watermark(db, sync_state.SESSIONS)
+                pending = _read_pending_sessions(db, last_id, max_sessions)
+            finally:
+                db.close()
+            if not pending:
+                return
+
+        sessions, size = [], 2
+        while pending and len(sessions) < max_sessions:
+            # 与 requests 的 json= 相同，按 ensure_ascii 编码估算大小
+            session_size = len(json.dumps(pending[0])) + 1
+            if sessions and size + session_size > max_bytes:
+                break
+            sessions.append(pending.pop(0))
+            size += session_size
+        last_id = sessions[-1]["client_session_id"]
+        yield SyncBatch(sessions, [s["client_session_id"] for s in sessions])
 
-def get_and_prepare_sync_data():
+
+def accepted_session_ids(payload: Optional[dict]) -> Optional[set]:
+    """
+    从同步接口的返回结果中取出服务器接收的本地会话 id。
+    旧版服务器不返回逐条结果，此时返回 None，表示整批都已接收。
+    """
+    if not payload or "accepted" not in payload:
+        return None
+    for item in payload.get("rejected") or []:
+        print(f"[Sync Util] 服务器拒绝了会话 {item.get('client_session_id')}: {item.get('reason')}")
+    return set(payload["accepted"])
+
+
+def first_retryable_rejection(payload: Optional[dict]) -> Optional[int]:
+    """
+    返回因服务器临时故障被拒绝、需要稍后重传的最小本地会话 id，没有时返回 None。
+    旧版服务器不区分拒绝原因，此时按需要重传处理，宁可重传也不丢数据
+    """
+    ids = [
+        item.get("client_session_id") for item in (payload or {}).get("rejected") or []
+        if item.get("retryable", True) and item.get("client_session_id") is not None
+    ]
+    return min(ids) if ids else None
+
+
+def mark_batch_as_synced(batch: SyncBatch, accepted_sessions: Optional[Iterable[int]] = None,
+                         retry_from: Optional[int] = None):
+    """
+    在一个事务中把一批会话及其焦点活动标记为已同步，并把同步水位推进到本批最后一个会话。
+    一批会话的 id 是连续读取的，按 id 范围更新，语句数与批大小无关；
+    给出 accepted_sessions 时，被服务器拒绝的会话（通常只有几个）保持未同步。
+    数据本身无效的会话水位照常越过；给出 retry_from 时水位只推进到它之前，下次同步从这里重新读取
+    """
+    if not batch.session_ids:
+        return
+    first_id, last_id = batch.session_ids[0], batch.session_ids[-1]
+    watermark = last_id if retry_from is None else min(last_id, retry_from - 1)
+    rejected = [] if accepted_sessions is None else sorted(set(batch.session_ids) - set(accepted_sessions))
     db = SessionLocal()
     try:
-        activities_to_sync = db.query(FocusActivity).options(
-            joinedload(FocusActivity.session).joinedload(ProcessSession.summary).joinedload(AppUsageSummary.application)
-        ).filter(FocusActivity.synced == False).all()
-        if not activities_to_sync:
-            return [], []
-        sessions_map = {}
-        for activity in activities_to_sync:
-            session_id = activity.session_id
-            if session_id not in sessions_map:
-                sessions_map[session_id] = {
-                    "process_name": activity.session.process_name,
-                    "executable_path": activity.session.summary.application.executable_path,
-                    "session_start_time": activity.session.session_start_time.isoformat(),
-                    "session_end_time": activity.session.session_end_time.isoformat(),
-                    "total_lifetime_seconds": activity.session.total_lifetime_seconds,
-                    "total_focus_seconds": activity.session.total_focus_seconds,
-                    "activities": []
-                }
-
-            sessions_map[session_id]["activities"].append({
-                "window_title": activity.window_title,
-                "focus_duration_seconds": activity.focus_duration_seconds
-            })
-
-        data_to_send = list(sessions_map.values())
-        print(f"[Sync Util] 发现 {len(data_to_send)} 个会话包含未同步数据，准备上传...")
-        return data_to_send, activities_to_sync
+        session_filter = [ProcessSession.id.between(first_id, last_id), ProcessSession.synced == False]
+        activity_filter = [FocusActivity.session_id.between(first_id, last_id), FocusActivity.synced == False]
+        if rejected:
+            session_filter.append(ProcessSession.id.notin_(rejected))
+            activity_filter.append(FocusActivity.session_id.notin_(rejected))
+        db.query(ProcessSession).filter(*session_filter).update({"synced": True}, synchronize_session=False)
+        db.query(FocusActivity).filter(*activity_filter).update({"synced": True}, synchronize_session=False)
+        sync_state.advance_watermark(db, sync_state.SESSIONS, watermark)
+        db.commit()
+        print(f"[Sync Util] 已将 {len(batch.session_ids) - len(rejected)} 个会话标记为已同步，同步水位推进到 {watermark}。")
+    except Exception as e:
+        print(f"[Sync Util] 标记同步状态时出错: {e}")
+        db.rollback()
     finally:
         db.close()
 
-def mark_activities_as_synced(activities: List[FocusActivity]):
-    if not activities:
+
+def upload_pending_sessions(token: str) -> Tuple[int, Optional[SendResult]]:
+    """
+    逐批上传全部待同步会话，每批成功后立即标记。
+    返回 (服务器接收的会话数, 失败时的结果)；遇到失败即停止，剩余数据留到下次。
+    有会话因服务器临时故障被拒绝时同样停止并按失败退避，之后的批次不会先于它上传，
+    服务器的设备高水位也就不会越过它
+    """
+    synced_count = 0
+    for batch in iter_sync_batches():
+        print(f"[Sync Util] 上传 {len(batch.sessions)} 个会话...")
+        result = send_data_to_api(batch.sessions, endpoint="/sync/sessions/", token=token)
+        if not result.ok:
+            return synced_count, result
+        accepted = accepted_session_ids(result.payload)
+        retry_from = first_retryable_rejection(result.payload)
+        mark_batch_as_synced(batch, accepted, retry_from)
+        synced_count += len(batch.sessions) if accepted is None else len(accepted)
+        if retry_from is not None:
+            print(f"[Sync Util] 会话 {retry_from} 起有服务器暂时无法写入的会话，稍后从这里重试。")
+            return synced_count, SendResult(ok=False)
+    return synced_count, None
+
+def export_pending_sessions(path: str) -> int:
+    """
+    把全部待同步会话写成 gzip 压缩的 NDJSON（每行一个与同步接口相同格式的会话），返回写入的会话数。
+    与 iter_sync_batches 一样逐批读取，积压再多内存占用也有上限
+    """
+    count = 0
+    with gzip.open(path, "wt", encoding="utf-8") as f:
+        for batch in iter_sync_batches():
+            for session in batch.sessions:
+                f.write(json.dumps(session, ensure_ascii=False) + "\n")
+            count += len(batch.sessions)
+    return count
+
+
+def import_pending_sessions(token: str) -> Tuple[int, SendResult]:
+    """
+    积压的历史会话很多时（如首次登录），导出为一个文件一次性上传到 /import，代替逐批同步。
+    服务器按设备和本地会话 id 去重并推进高水位；本地会话仍由之后的常规同步确认并标记，
+    那时服务器已有这些会话，只计为已接收。返回 (导出的会话数, 上传结果)
+    """
+    fd, path = tempfile.mkstemp(suffix=".ndjson.gz")
+    os.close(fd)
+    try:
+        count = export_pending_sessions(path)
+        if not count:
+            return 0, SendResult(ok=True)
+        print(f"[Sync Util] 导出 {count} 个会话，上传到服务器导入...")
+        return count, upload_import_file(path, token)
+    finally:
+        os.remove(path)
+
+
+def reserve_ids_up_to_watermark(watermark: int):
+    """
+    服务器上本设备的会话 id 已用到 watermark：把本地会话 id 的序列推进到不小于它，
+    重装或恢复旧备份后新建的会话不会再与服务器已有的会话同 id。
+    不按高水位把本地未同步的会话标记为已同步：恢复备份后 id 不超过高水位的也可能是另一个新会话，
+    照常上传，服务器按 id 和开始时间确认是否已有（已有的计为已接收，不会重复累加）
+    """
+    if not watermark:
         return
     db = SessionLocal()
     try:
-        activity_ids = [activity.id for activity in activities]
-        db.query(FocusActivity).filter(FocusActivity.id.in_(activity_ids)).update({"synced": True})
+        sync_state.reserve_ids(db, ProcessSession.__tablename__, watermark)
         db.commit()
-        print(f"[Sync Util] 已将 {len(activity_ids)} 条焦点活动记录标记为已同步。")
     except Exception as e:
-        print(f"[Sync Util] 标记同步状态时出错: {e}")
+        print(f"[Sync Util] 按服务器高水位推进本地会话 id 时出错: {e}")
         db.rollback()
     finally:
         db.close()
 
 
 class ApiSyncWorker(QObject):
+    """
+    后台同步：有新会话保存时（request_sync）在短暂的合并窗口后同步，
+    平时只按很长的心跳间隔检查一次；本地没有待同步数据时不发任何请求。
+    失败后按指数退避（带随机抖动）重试，服务器给出 Retry-After 时以其为准；
+    登录失效（401）不是临时故障，不退避，等待重新登录。登录或手动同步（sync_now）时立即同步。
+    """
     finished = Signal()
     status_updated = Signal(str)
 
-    def __init__(self, token_provider, interval_seconds: int = 60):
+    def __init__(
+        self,
+        token_provider,
+        debounce_seconds: int = SYNC_DEBOUNCE_SECONDS,
+        heartbeat_seconds: int = SYNC_HEARTBEAT_SECONDS,
+    ):
         super().__init__()
         self._token_provider = token_provider
-        self.interval = interval_seconds * 1000
+        self.debounce = debounce_seconds * 1000
+        self.heartbeat = heartbeat_seconds * 1000
         self._timer = None
         self._running = False
+        self._reconciled_token = None
+        self._failures = 0          # 连续失败次数，> 0 时处于退避中
+        self._token_rejected = False  # 服务器拒绝了当前 token（401）
+        self._failure_token = None  # 进入退避或登录失效时使用的 token，换了 token 即恢复
+
+    def _schedule_next(self, delay_ms: int):
+        """调整下一次检查的时间（例如服务器通过 Retry-After 要求延后）"""
+        if self._timer:
+            self._timer.start(int(delay_ms))
+
+    def _current_token(self) -> Optional[str]:
+        return self._token_provider() if self._token_provider else None
+
+    def _reset_backoff(self):
+        self._failures = 0
+        self._token_rejected = False
+        self._failure_token = None
+
+    def _backoff_ms(self) -> int:
+        delay = min(SYNC_BACKOFF_MAX_SECONDS, SYNC_BACKOFF_BASE_SECONDS * 2 ** (self._failures - 1))
+        return int(delay * random.uniform(1 - SYNC_BACKOFF_JITTER, 1 + SYNC_BACKOFF_JITTER) * 1000)
 
     @Slot()  # 确保这是个槽（在目标线程执行）
     def start_service(self):
         """在 worker 线程中被调用，创建并启动 QTimer（QTimer 必须在这里创建）"""
-        print(f"[Sync Service] QTimer 服务已在后台线程启动，每 {self.interval // 1000} 秒检查一次。")
+        print(f"[Sync Service] 后台同步已启动：新会话 {self.debounce // 1000} 秒后同步，空闲时每 {self.heartbeat // 1000} 秒检查一次。")
         self._running = True
         # 不要把 parent 设为主线程对象，用 None 或 self（self 已在目标线程）
         self._timer = QTimer()
-        self._timer.setInterval(self.interval)
+        self._timer.setSingleShot(True)
         self._timer.timeout.connect(self.perform_sync_check)
-        self._timer.start()
-        # 立即触发一次检查（可选）
+        # 启动时立即检查一次，补传上次退出前未同步的数据
         self.perform_sync_check()
 
+    @Slot()
+    def request_sync(self):
+        """
+        有新数据（会话保存等）时调用：合并窗口内的多次请求只同步一次。
+        退避或登录失效期间不提前，除非此后换了 token（重新登录）
+        """
+        if not self._running or not self._timer:
+            return
+        if self._failures or self._token_rejected:
+            if self._current_token() == self._failure_token:
+                return
+            self._reset_backoff()
+        if not self._timer.isActive() or self._timer.remainingTime() > self.debounce:
+            self._schedule_next(self.debounce)
+
+    @Slot()
+    def sync_now(self):
+        """用户登录或手动同步时调用：结束退避，立即同步"""
+        if not self._running or not self._timer:
+            return
+        self._reset_backoff()
+        self._schedule_next(0)
+
     @Slot()
     def perform_sync_check(self):
         # 早退条件：如果已经停止则不执行
         if not self._running:
             return
-        print("\n--- [Sync Service] QTimer 触发新一轮后台同步检查 ---")
-        token = self._token_provider() if self._token_provider else None
+        print("\n--- [Sync Service] 触发新一轮后台同步检查 ---")
+        # 默认下一次为空闲心跳，出错时下面会改为退避时间
+        self._schedule_next(self.heartbeat)
+        token = self._current_token()
         if not token:
             self.status_updated.emit("未登录，跳过后台同步。")
             return
+        if self._token_rejected and token == self._failure_token:
+            self.status_updated.emit("登录已失效，请重新登录后同步。")
+            return
 
-        data_to_send, activities_to_mark = get_and_prepare_sync_data()
-        if not data_to_send:
-            self.status_updated.emit("后台检查：数据已是最新。")
-        else:
-            self.status_updated.emit(f"后台发现 {len(data_to_send)} 个新会话，上传中...")
-            success = send_data_to_api(data_to_send, endpoint="/sync/sessions/", token=token)
-            if success:
-                mark_activities_as_synced(activities_to_mark)
-                self.status_updated.emit(f"后台成功同步 {len(data_to_send)} 个会话。")
+        # 每次登录后先取一次服务器的高水位，保证之后新建的会话 id 不与服务器已有的重复
+        if self._reconciled_token != token:
+            watermark = fetch_sync_cursor(token)
+            if watermark is not None:
+                reserve_ids_up_to_watermark(watermark)
+                self._reconciled_token = token
+
+        synced_count, failure = upload_pending_sessions(token)
+        if failure is None:
+            self._reset_backoff()
+            if synced_count:
+                self.status_updated.emit(f"后台成功同步 {synced_count} 个会话。")
             else:
-                self.status_updated.emit("后台同步失败，将在下一周期重试。")
+                self.status_updated.emit("后台检查：数据已是最新。")
+            return
+
+        self._failure_token = token
+        if failure.status_code == 401:
+            # 重试也只会再得到 401：保持心跳间隔，等待重新登录
+            self._failures = 0
+            self._token_rejected = True
+            self.status_updated.emit(f"登录已失效，请重新登录后同步（本轮已同步 {synced_count} 个会话）。")
+            return
+
+        self._failures += 1
+        if failure.retry_after is not None:
+            delay_ms = max(1000, int(failure.retry_after * 1000))
+            self.status_updated.emit(f"服务器繁忙，{delay_ms // 1000} 秒后重试同步（本轮已同步 {synced_count} 个会话）。")
+        else:
+            delay_ms = self._backoff_ms()
+            self.status_updated.emit(f"后台同步失败，{delay_ms // 1000} 秒后重试（本轮已同步 {synced_count} 个会话）。")
+        self._schedule_next(delay_ms)
 
     @Slot()  # 这个 stop 必须在 worker 线程中运行（通过 queued connection 调用）
     def stop(self):
@@ -0,0 +1,44 @@
+import datetime
+
+from sqlalchemy import func, text
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+from local_models import SyncState
+
+# 会话的同步水位（焦点活动随会话一起上传，不单独记录）
+SESSIONS = "process_sessions"
+
+
+def get_watermark(db: Session, name: str) -> int:
+    return db.query(SyncState.last_synced_id).filter(SyncState.name == name).scalar() or 0
+
+
+def advance_watermark(db: Session, name: str, last_id: int) -> None:
+    """把水位推进到 last_id（只增不减），在调用方的事务中执行"""
+    stmt = sqlite_insert(SyncState).values(
+        name=name, last_synced_id=last_id, updated_at=datetime.datetime.now()
+    )
+    db.execute(stmt.on_conflict_do_update(
+        index_elements=[SyncState.name],
+        set_={
+            "last_synced_id": func.max(SyncState.last_synced_id, stmt.excluded.last_synced_id),
+            "updated_at": stmt.excluded.updated_at,
+        },
+    ))
+
+
+def reserve_ids(db: Session, table: str, last_id: int) -> None:
+    """
+    把 AUTOINCREMENT 表的序列至少推进到 last_id，之后插入的行 id 都大于它（在调用方的事务中执行）。
+    恢复旧备份后 sqlite_sequence 也随之回退，用服务器的高水位把它推回去
+    """
+    db.execute(
+        text("UPDATE sqlite_sequence SET seq = :last_id WHERE name = :table AND seq < :last_id"),
+        {"table": table, "last_id": last_id},
+    )
+    db.execute(
+        text("INSERT INTO sqlite_sequence (name, seq) SELECT :table, :last_id "
+             "WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = :table)"),
+        {"table": table, "last_id": last_id},
+    )
@@ -1,58 +1,137 @@
 import datetime
+import threading
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy import insert, update, func, or_
 from sqlalchemy.orm import Session
 from local_models import (WatchedApplication, AppUsageSummary,
                             ProcessSession, FocusActivity)
 from path_utils import normalize_exe_path
+from daily_usage import upsert_daily_usage
 
 
-def add_or_get_watched_app(db: Session, executable_path: str, executable_name: str):
+# 规范化后的可执行文件路径 -> (应用 id, summary id)
+# 会话结束时直接用缓存的 id 写入，不必每次都查询应用和 summary
+_app_ids: Dict[str, Tuple[int, int]] = {}
+_app_ids_lock = threading.Lock()
+
+
+def warm_app_cache(db: Session) -> int:
+    """启动时一次性加载所有应用的 id 缓存，返回缓存的应用数"""
+    rows = db.query(WatchedApplication.executable_path, WatchedApplication.id, AppUsageSummary.id)\
+        .join(AppUsageSummary, AppUsageSummary.application_id == WatchedApplication.id)\
+        .all()
+    with _app_ids_lock:
+        _app_ids.clear()
+        for path, app_id, summary_id in rows:
+            _app_ids[path] = (app_id, summary_id)
+    return len(rows)
+
+
+def forget_app(executable_path: str) -> None:
+    """应用被删除后调用，丢弃缓存的 id"""
+    with _app_ids_lock:
+        _app_ids.pop(normalize_exe_path(executable_path), None)
+
+
+def _cached_ids(executable_path: str) -> Optional[Tuple[int, int]]:
+    with _app_ids_lock:
+        return _app_ids.get(executable_path)
+
+
+def _remember_ids(executable_path: str, app_id: int, summary_id: int) -> None:
+    with _app_ids_lock:
+        _app_ids[executable_path] = (app_id, summary_id)
+
+
+def _ensure_watched_app(db: Session, executable_path: str, executable_name: str,
+                        rewatch: bool = True) -> Tuple[int, int]:
     """
-    检查一个应用是否已被监视。
-    如果未监视，创建新记录；如果已存在，恢复监视并返回。
-    同时保证每个应用都有一条 AppUsageSummary。
+    在当前事务中获取或创建应用及其 summary（只 flush，不提交），返回 (应用 id, summary id)。
+    rewatch 时已存在的应用会恢复监视。
     """
-    executable_path = normalize_exe_path(executable_path)
-
     watched_app = db.query(WatchedApplication).filter(
         WatchedApplication.executable_path == executable_path
     ).first()
 
     if watched_app:
         watched_app.executable_name = executable_name
-        watched_app.is_watched = True
+        if rewatch:
+            watched_app.is_watched = True
         if not watched_app.launch_path:
             watched_app.launch_path = executable_path
+    else:
+        watched_app = WatchedApplication(
+            executable_name=executable_name,
+            executable_path=executable_path,
+            launch_path=executable_path,
+            is_watched=True,
+        )
+        db.add(watched_app)
+        db.flush()
 
-        summary = db.query(AppUsageSummary).filter(
-            AppUsageSummary.application_id == watched_app.id
-        ).first()
-        if not summary:
-            summary = AppUsageSummary(
-                application_id=watched_app.id,
-            )
-            db.add(summary)
-
-        db.commit()
-        db.refresh(watched_app)
-        return watched_app
-
-    new_watched_app = WatchedApplication(
-        executable_name=executable_name,
-        executable_path=executable_path,
-        launch_path=executable_path,
-        is_watched=True,
-    )
-    db.add(new_watched_app)
+    summary = db.query(AppUsageSummary).filter(
+        AppUsageSummary.application_id == watched_app.id
+    ).first()
+    if not summary:
+        summary = AppUsageSummary(
+            application_id=watched_app.id,
+        )
+        db.add(summary)
     db.flush()
+    return watched_app.id, summary.id
 
-    summary = AppUsageSummary(
-        application_id=new_watched_app.id,
-    )
-    db.add(summary)
 
+def add_or_get_watched_app(db: Session, executable_path: str, executable_name: str):
+    """
+    检查一个应用是否已被监视。
+    如果未监视，创建新记录；如果已存在，恢复监视并返回。
+    同时保证每个应用都有一条 AppUsageSummary。
+    """
+    executable_path = normalize_exe_path(executable_path)
+
+    app_id, summary_id = _ensure_watched_app(db, executable_path, executable_name)
     db.commit()
-    db.refresh(new_watched_app)
-    return new_watched_app
+    _remember_ids(executable_path, app_id, summary_id)
+    return db.get(WatchedApplication, app_id)
+
+
+def _refresh_watched_app(db: Session, app_id: int, executable_path: str, executable_name: str) -> None:
+    """
+    缓存命中时对已有应用做与 _ensure_watched_app(rewatch=False) 相同的更新：更新可执行文件名、补齐启动路径。
+    一条 UPDATE，只有确实需要修改时才写入
+    """
+    App = WatchedApplication
+    db.execute(
+        update(App)
+        .where(App.id == app_id)
+        .where(or_(
+            App.executable_name != executable_name,
+            App.launch_path.is_(None),
+            App.launch_path == "",
+        ))
+        .values(
+            executable_name=executable_name,
+            launch_path=func.coalesce(func.nullif(App.launch_path, ""), executable_path),
+        )
+    )
+
+
+def _add_to_summary(db: Session, summary_id: int, start_time: datetime.datetime,
+                    end_time: datetime.datetime, lifetime: int, focus: int) -> bool:
+    """用一条 UPDATE 累加总账，返回 summary 是否存在"""
+    result = db.execute(
+        update(AppUsageSummary)
+        .where(AppUsageSummary.id == summary_id)
+        .values(
+            total_lifetime_seconds=AppUsageSummary.total_lifetime_seconds + lifetime,
+            total_focus_time_seconds=AppUsageSummary.total_focus_time_seconds + focus,
+            first_seen_at=func.coalesce(AppUsageSummary.first_seen_at, start_time),
+            last_seen_start_at=start_time,
+            last_seen_end_at=end_time,
+        )
+    )
+    return result.rowcount > 0
 
 
 def record_process_session(
@@ -65,75 +144,71 @@ def record_process_session(
 ):
     """
     当一个被监视的进程结束时，调用此函数。
-    它会创建一条 ProcessSession 记录，并在其下创建多条 FocusActivity 记录，
-    最后更新总账 AppUsageSummary。
+    在一个事务中更新总账 AppUsageSummary 和日汇总 AppDailyUsage、创建一条 ProcessSession 记录，
+    并批量插入其下的 FocusActivity 记录，只提交一次。
+    应用和 summary 的 id 取自内存缓存，缓存未命中时才查询（必要时创建）。
     """
     print(f"[Tracking Service] 正在为 '{executable_name}' @ '{executable_path}' 记录一个新会话...")
 
     executable_path = normalize_exe_path(executable_path)
 
-    # 1. 获取或创建应用，并确保应用有 summary
-    watched_app = add_or_get_watched_app(db, executable_path, executable_name)
-
-    summary = db.query(AppUsageSummary).filter(
-        AppUsageSummary.application_id == watched_app.id
-    ).first()
-    if not summary:
-        summary = AppUsageSummary(
-            application_id=watched_app.id,
-        )
-        db.add(summary)
-        db.flush()
-
-    # 2. 计算本次会话的总时长和总焦点时长
+    # 1. 计算本次会话的总时长和总焦点时长
     total_lifetime = int((end_time - start_time).total_seconds())
     total_focus_time = int(sum(focus_details.values()))
     if total_lifetime <= 1:
         print(f"[Tracking Service] 会话时长过短 ({total_lifetime}s)，已忽略。")
         return
 
-    # 3. 创建一条新的"会话"记录 (ProcessSession)
-    new_session = ProcessSession(
-        summary=summary,
-        process_name=executable_name,
-        session_start_time=start_time,
-        session_end_time=end_time,
-        total_lifetime_seconds=total_lifetime,
-        total_focus_seconds=total_focus_time
-    )
-    db.add(new_session)
-    print(f"[Tracking Service] -> 已创建会话记录: {start_time.strftime('%H:%M:%S')} - {end_time.strftime('%H:%M:%S')}")
-
-    # 4. 在"会话"下为每个窗口标题创建"焦点活动"记录 (FocusActivity)
-    if not focus_details:
-        print("[Tracking Service] -> 该会话没有检测到焦点活动。")
-    else:
-        print(f"[Tracking Service] -> 该会话检测到 {len(focus_details)} 个窗口标题活动...")
-        for title, focus_seconds in focus_details.items():
-            focus_seconds_int = int(focus_seconds)
-            if focus_seconds_int > 0:
-                activity = FocusActivity(
-                    session=new_session,
-                    window_title=title,
-                    focus_duration_seconds=focus_seconds_int
-                )
-                db.add(activity)
-                print(f"[Tracking Service]     - 焦点活动: '{title}' ({focus_seconds}s)")
-
-    # 5. 更新总账 (AppUsageSummary)
-    summary.total_lifetime_seconds += total_lifetime
-    summary.total_focus_time_seconds += total_focus_time
-    if not summary.first_seen_at:
-        summary.first_seen_at = start_time
-    summary.last_seen_start_at = start_time
-    summary.last_seen_end_at = end_time
-
-    print(f"[Tracking Service] -> 正在更新总账: lifetime +{total_lifetime}s, focus +{total_focus_time}s")
-
-    # 6. 提交所有更改
     try:
+        # 2. 更新总账 (AppUsageSummary)；缓存未命中或缓存的 summary 已不存在（应用被删除）时重新获取。
+        # 不恢复监视：取消监视时正在运行的进程，其会话在进程退出时才保存，不能因此把应用重新设为监视
+        ids = _cached_ids(executable_path)
+        if ids is None or not _add_to_summary(db, ids[1], start_time, end_time, total_lifetime, total_focus_time):
+            ids = _ensure_watched_app(db, executable_path, executable_name, rewatch=False)
+            _add_to_summary(db, ids[1], start_time, end_time, total_lifetime, total_focus_time)
+        else:
+            _refresh_watched_app(db, ids[0], executable_path, executable_name)
+        print(f"[Tracking Service] -> 正在更新总账: lifetime +{total_lifetime}s, focus +{total_focus_time}s")
+        # 跨越午夜的会话按天拆分后累加到日汇总 (AppDailyUsage)
+        upsert_daily_usage(db, ids[0], start_time, end_time, total_lifetime, total_focus_time)
+
+        # 3. 创建一条新的"会话"记录 (ProcessSession)
+        session_id = db.execute(
+            insert(ProcessSession).values(
+                summary_id=ids[1],
+                process_name=executable_name,
+                session_start_time=start_time,
+                session_end_time=end_time,
+                total_lifetime_seconds=total_lifetime,
+                total_focus_seconds=total_focus_time,
+                synced=False,
+            )
+        ).inserted_primary_key[0]
+        print(f"[Tracking Service] -> 已创建会话记录: {start_time.strftime('%H:%M:%S')} - {end_time.strftime('%H:%M:%S')}")
+
+        # 4. 一条批量 INSERT 写入该会话的全部"焦点活动"记录 (FocusActivity)
+        activities = [
+            {
+                "session_id": session_id,
+                "window_title": title,
+                "focus_duration_seconds": int(focus_seconds),
+                "synced": False,
+            }
+            for title, focus_seconds in focus_details.items()
+            if int(focus_seconds) > 0
+        ]
+        if activities:
+            db.execute(insert(FocusActivity), activities)
+            print(f"[Tracking Service] -> 该会话检测到 {len(activities)} 个窗口标题活动")
+        else:
+            print("[Tracking Service] -> 该会话没有检测到焦点活动。")
+
+        # 5. 提交所有更改
         db.commit()
-        print(f"[Tracking Service] 数据库更新成功！")
     except Exception as e:
         print(f"[Tracking Service] 数据库提交失败: {e}")
         db.rollback()
+        raise
+
+    _remember_ids(executable_path, *ids)
+    print(f"[Tracking Service] 数据库更新成功！")